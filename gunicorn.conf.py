@@ -0,0 +1,26 @@
+"""gunicorn settings, loaded from the working directory by default.
+
+Workers are threaded, because each GET /stock/events stream holds a
+thread for as long as its client stays connected; keep GUNICORN_THREADS
+well above EVENTS_MAX_SUBSCRIBERS. The hooks keep the per-worker
+snapshots in METRICS_DIR consistent; see shoptrack/metrics.py.
+"""
+import os
+
+from shoptrack.metrics import archive_worker, clear_directory
+
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    # Counters restart from zero with the server
+    directory = os.environ.get('METRICS_DIR')
+    if directory:
+        clear_directory(directory)
+
+def child_exit(server, worker):
+    # Keep the counts of a worker that exited or was recycled, and free its PID
+    directory = os.environ.get('METRICS_DIR')
+    if directory and os.path.isdir(directory):
+        archive_worker(directory, worker.pid)
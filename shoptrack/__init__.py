@@ -2,6 +2,7 @@ import os
 
 from flask import Flask, jsonify
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 def create_app(test_config = None):
     
@@ -10,7 +11,70 @@ def create_app(test_config = None):
     # Default configuration
     app.config.from_mapping(
         SECRET_KEY = os.environ.get('SECRET_KEY', 'dev'),
-        DATABASE = os.path.join(app.instance_path, 'shoptrack.sqlite')
+        DATABASE = os.path.join(app.instance_path, 'shoptrack.sqlite'),
+        # PostgreSQL connection pool, one per worker process
+        DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1)),
+        DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10)),
+        DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+        DB_POOL_MAX_IDLE = float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+        DB_POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+        DB_POOL_CHECK_INTERVAL = float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)),
+        # Server-side prepared statements for hot queries; disable behind pgbouncer
+        DB_PREPARE_STATEMENTS = os.environ.get('DB_PREPARE_STATEMENTS', '1') not in ('0', 'false', 'no'),
+        # SQLite: 'production' keeps a WAL-mode connection per worker thread
+        SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default'),
+        SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+        # Per-worker cache of bearer token -> session lookups
+        TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000)),
+        TOKEN_CACHE_TTL = float(os.environ.get('TOKEN_CACHE_TTL', 60)),
+        # Expired-session cleanup; a reaper interval of 0 disables the background thread
+        SESSION_PURGE_BATCH = int(os.environ.get('SESSION_PURGE_BATCH', 1000)),
+        SESSION_MAX_PER_USER = int(os.environ.get('SESSION_MAX_PER_USER', 0)),
+        SESSION_REAPER_INTERVAL = float(os.environ.get('SESSION_REAPER_INTERVAL', 0)),
+        # Password hashing; 0 pool workers hashes inline in the request thread
+        PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt'),
+        PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', 16)),
+        HASH_POOL_WORKERS = int(os.environ.get('HASH_POOL_WORKERS', 0)),
+        HASH_POOL_MAX_QUEUE = int(os.environ.get('HASH_POOL_MAX_QUEUE', 8)),
+        HASH_POOL_TIMEOUT = float(os.environ.get('HASH_POOL_TIMEOUT', 10)),
+        # JSON output: None keeps Flask's rule (compact unless debug); 'http' or 'iso' dates
+        JSON_COMPACT = None,
+        JSON_DATETIME_FORMAT = os.environ.get('JSON_DATETIME_FORMAT', 'http'),
+        # Query/request metrics; set METRICS_DIR to aggregate /metrics across workers
+        METRICS_DIR = os.environ.get('METRICS_DIR'),
+        METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)),
+        SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 250)),
+        # Bearer token Prometheus sends to scrape /metrics; unset disables the endpoint
+        METRICS_TOKEN = os.environ.get('METRICS_TOKEN'),
+        # Per-blueprint rate limits such as '10/minute' (unset = unlimited). /auth is
+        # limited per client IP, the others per user; buckets are shared through
+        # RATE_LIMIT_STORE (default instance/ratelimit.sqlite, or 'memory')
+        RATE_LIMITS = {
+            'auth': os.environ.get('RATE_LIMIT_AUTH'),
+            'stock': os.environ.get('RATE_LIMIT_STOCK'),
+        },
+        RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE'),
+        # Proxies in front of the app whose X-Forwarded-For is trusted for the client
+        # IP (1 behind the Heroku router or one nginx); 0 uses the socket address
+        PROXY_FIX_X_FOR = int(os.environ.get('PROXY_FIX_X_FOR', 0)),
+        # Products inserted per transaction by POST /stock/import and flask products import
+        IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500)),
+        # GET /stock/events: recent events each worker keeps for Last-Event-ID resume,
+        # events queued per slow subscriber, and seconds between keep-alive comments
+        EVENTS_BACKLOG = int(os.environ.get('EVENTS_BACKLOG', 10000)),
+        EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 1000)),
+        EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15)),
+        # Streams a WSGI worker serves at once; each holds one of its threads
+        EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', 16)),
+        # Days tombstones of deleted products are kept for GET /stock/changes
+        TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 90)),
+        # Queue product creates and stock changes to one writer thread per worker, which
+        # commits everything queued within the window (at most MAX_OPS writes) at once
+        GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '0') not in ('0', 'false', 'no'),
+        GROUP_COMMIT_WINDOW_MS = float(os.environ.get('GROUP_COMMIT_WINDOW_MS', 2)),
+        GROUP_COMMIT_MAX_OPS = int(os.environ.get('GROUP_COMMIT_MAX_OPS', 64)),
     )
 
     if test_config is None:
@@ -23,6 +87,12 @@ def create_app(test_config = None):
     except OSError:
         pass
 
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
+    from . import serialize
+    app.json = serialize.ShopTrackJSONProvider(app)
+
 
 
     @app.route('/hello')
@@ -39,18 +109,67 @@ def create_app(test_config = None):
     def not_found_error(error):
         return jsonify({'error': 'Not found'}), 404
 
+    from .pool import PoolExhausted
+
+    @app.errorhandler(PoolExhausted)
+    def pool_exhausted_error(error):
+        app.logger.warning(f'Database pool exhausted: {error}')
+        return jsonify({'error': 'Service temporarily unavailable'}), 503
+
+    from . import metrics
+    metrics.init_app(app)
+
     from . import db
     db.init_app(app)
+    from . import queries
+    queries.init_app(app)
     CORS(app)
+    from . import ratelimit
+    ratelimit.init_app(app)
+    from . import hashing
+    hashing.init_app(app)
+
     from . import auth
+    auth.init_app(app)
     app.register_blueprint(auth.bp)
 
+    from . import sessions
+    sessions.init_app(app)
+
+    from . import events
+    events.init_app(app)
+
+    from . import groupcommit
+    groupcommit.init_app(app)
+
     from . import stock
     app.register_blueprint(stock.bp)
+
+    from . import summary
+    summary.init_app(app)
+
+    from . import importer
+    importer.init_app(app)
+
+    from . import changes
+    changes.init_app(app)
+
+    from . import bench
+    bench.init_app(app)
     
     # Add a simple root endpoint
     @app.route('/')
     def index():
         return jsonify({'message': 'ShopTrack API is running'})
 
+    # Per-worker runtime counters for operators
+    @app.route('/stats')
+    def stats():
+        return jsonify({
+            'pool': db.pool_stats(),
+            'token_cache': auth.get_token_cache().stats(),
+            'event_subscribers': events.get_hub().broadcaster.subscriber_count(),
+            'group_commit': groupcommit.get_group_committer().stats(),
+        })
+
     return app
\ No newline at end of file
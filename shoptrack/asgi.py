@@ -0,0 +1,904 @@
+"""Async serving mode: the /auth and /stock API on ASGI with an asyncpg pool.
+
+Run it with an ASGI server, for example::
+
+    gunicorn -k uvicorn.workers.UvicornWorker "shoptrack.asgi:app"
+
+Requests and responses follow the same JSON contracts as the Flask
+blueprints. Configuration (DATABASE_URL, pool sizes, token cache, password
+hashing) is read through create_app(), so both modes share one config. The
+async mode needs PostgreSQL; use the Flask app for SQLite development.
+"""
+import asyncio
+import contextvars
+import csv
+import io
+import json
+import os
+import re
+import secrets
+import time
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl
+
+from werkzeug.http import parse_etags, quote_etag
+
+try:
+    import asyncpg
+    ASYNCPG_AVAILABLE = True
+except ImportError:
+    ASYNCPG_AVAILABLE = False
+
+from shoptrack import create_app
+from shoptrack.changes import validate_changes_args, sync_plan
+from shoptrack.etag import inventory_etag
+from shoptrack.events import (
+    CHANNEL, AsyncSubscription, Broadcaster, Event, EventStream, build_events, product_change, stock_change
+)
+from shoptrack.hashing import HashingBusy
+from shoptrack.history import validate_history_args, history_query
+from shoptrack.metrics import observe_query, observe_request, metrics_authorized
+from shoptrack.importer import (
+    IMPORT_FORMATS, import_format, parse_rows, import_batches, import_columns, new_import_result, import_failed
+)
+from shoptrack.pagination import validate_page_args, paginate_query, page_response
+from shoptrack.queries import numbered_placeholders, asyncpg_sql
+from shoptrack.ratelimit import IP_SCOPES, TOO_MANY_REQUESTS, client_ip, retry_after
+from shoptrack.rollup import validate_rollup_args, rollup_query, rollup_rows
+from shoptrack.search import validate_search_args, match_expression, search_page
+from shoptrack.serialize import RowSet
+from shoptrack.stock import (
+    HISTORY_COLUMNS, EXPORT_MIMETYPES, EXPORT_CHUNK_ROWS,
+    check_batch_items, plan_batch, batch_rejected
+)
+from shoptrack.summary import SUMMARY_COLUMNS
+from shoptrack.validation import (
+    validate_product_data,
+    validate_stock_data,
+    validate_user_data,
+    validate_batch_data
+)
+# Statements run while serving the current request, for shoptrack_http_request_queries
+_query_count = contextvars.ContextVar('query_count', default=None)
+# Transaction control and the pool's reset on release, which the Flask app does not record either
+_UNRECORDED_QUERIES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SELECT pg_advisory_unlock_all()')
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class NotModified(Exception):
+    def __init__(self, headers):
+        super().__init__('Not modified')
+        self.headers = headers
+
+
+class Request:
+    def __init__(self, scope, body, params, receive=None):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.params = params
+        self.body = body
+        # Unless the route streams its body, it has been read and the
+        # only message left is http.disconnect
+        self.receive = receive
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope.get('headers', [])
+        }
+        self.args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+        self.user_id = None
+
+    def json(self):
+        """Parsed JSON body, with the same errors as validate_json_request()."""
+        content_type = self.headers.get('content-type', '').split(';')[0].strip()
+        if content_type != 'application/json' and not content_type.endswith('+json'):
+            raise HTTPError(400, "Content-Type must be application/json")
+        try:
+            data = json.loads(self.body)
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON format")
+        if data is None:
+            raise HTTPError(400, "Invalid JSON data")
+        return data
+
+
+class ReceiveStream(io.RawIOBase):
+    """A request body still arriving over ASGI, as a blocking binary stream.
+
+    Reads wait for the event loop to receive the next chunk, so it must be
+    read from a worker thread; only one chunk is held at a time.
+    """
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._pending = b''
+        self._done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending and not self._done:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            if message['type'] == 'http.disconnect':
+                raise OSError('Client disconnected')
+            self._pending = message.get('body', b'')
+            self._done = not message.get('more_body', False)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+class Response:
+    def __init__(self, body, status=200, headers=None, content_type='application/json'):
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+        self.content_type = content_type
+
+    def _raw_headers(self):
+        headers = [(b'content-type', self.content_type.encode())]
+        headers.extend((k.lower().encode(), str(v).encode()) for k, v in self.headers.items())
+        return headers
+
+    async def send(self, send):
+        body = self.body.encode() if isinstance(self.body, str) else self.body
+        await send({
+            'type': 'http.response.start',
+            'status': self.status,
+            'headers': self._raw_headers() + [(b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class StreamingResponse(Response):
+    async def send(self, send):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self._raw_headers()})
+        async for chunk in self.body:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+class ShopTrackASGI:
+    def __init__(self, flask_app=None):
+        self.flask_app = flask_app or create_app()
+        self.config = self.flask_app.config
+        self.token_cache = self.flask_app.extensions['token_cache']
+        self.hasher = self.flask_app.extensions['password_hasher']
+        self.metrics = self.flask_app.extensions['metrics']
+        self.pool = None
+        self.routes = []
+        # Stock events from the LISTEN connection, for GET /stock/events
+        self.events = Broadcaster(self.config['EVENTS_BACKLOG'])
+        self.listener = None
+        self._listener_task = None
+
+    def route(self, method, rule, auth=False, stream=False):
+        """Register a handler; with ``stream`` it reads the body itself from ``request.receive``."""
+        # Flask-style rules: '/stock/<int:id>' -> '/stock/(?P<id>\d+)'
+        pattern = re.compile('^' + re.sub(r'<int:(\w+)>', r'(?P<\1>\\d+)', rule) + '$')
+
+        def decorator(handler):
+            self.routes.append((method, rule, pattern, handler, auth, stream))
+            return handler
+        return decorator
+
+    def json_response(self, payload, status=200, headers=None):
+        # Same provider and layout as Flask's jsonify()
+        body = self.flask_app.json.encode(payload) + b'\n'
+        return Response(body, status, headers)
+
+    def error(self, message, status, headers=None):
+        return self.json_response({'error': message}, status, headers)
+
+    async def startup(self):
+        database_url = os.environ.get('DATABASE_URL')
+        if not ASYNCPG_AVAILABLE or not database_url:
+            raise RuntimeError('The ASGI mode needs asyncpg and a PostgreSQL DATABASE_URL')
+        self.pool = await asyncpg.create_pool(
+            database_url,
+            min_size=self.config['DB_POOL_MIN'],
+            max_size=self.config['DB_POOL_MAX'],
+            max_inactive_connection_lifetime=self.config['DB_POOL_MAX_IDLE'],
+            init=self._init_connection,
+        )
+        self.listener = await self._listen()
+        self._listener_task = asyncio.create_task(self._keep_listening())
+
+    async def shutdown(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            self._listener_task = None
+        if self.listener is not None:
+            await self.listener.close()
+            self.listener = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def _init_connection(self, conn):
+        conn.add_query_logger(self._log_query)
+
+    def _log_query(self, record):
+        if record.query.startswith(_UNRECORDED_QUERIES):
+            return
+        # Runs in the context of the request that ran the query
+        count = _query_count.get()
+        if count is not None:
+            count[0] += 1
+        observe_query(
+            self.metrics, record.query, record.elapsed, self.config['SLOW_QUERY_MS'], self.flask_app.logger
+        )
+
+    async def _listen(self):
+        conn = await asyncpg.connect(os.environ.get('DATABASE_URL'))
+        await conn.add_listener(CHANNEL, self._on_notify)
+        return conn
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.events.publish(Event.decode(payload))
+
+    async def _keep_listening(self):
+        # Reconnect when the database drops the LISTEN connection
+        while True:
+            await asyncio.sleep(1)
+            if not self.listener.is_closed():
+                continue
+            try:
+                self.listener = await self._listen()
+            except (OSError, asyncpg.PostgresError) as e:
+                self.flask_app.logger.warning(f'Stock event listener disconnected: {e}')
+                continue
+            # Notifications sent while disconnected are gone
+            self.events.forget()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            started = time.perf_counter()
+            count = [0]
+            _query_count.set(count)
+            endpoint, response = await self._dispatch(scope, receive)
+            self._add_cors_headers(scope, response)
+            # Like the Flask app, a streamed body is not part of the request time
+            elapsed = time.perf_counter() - started
+            # asyncpg hands finished queries to _log_query() with call_soon()
+            await asyncio.sleep(0)
+            observe_request(self.metrics, endpoint, scope['method'], response.status, elapsed, count[0])
+            await response.send(send)
+
+    def _add_cors_headers(self, scope, response):
+        # Mirrors flask-cors defaults in the Flask app: any origin, any method,
+        # and whatever headers a preflight asks for.
+        headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope.get('headers', []))
+        if 'origin' not in headers:
+            return
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        if scope['method'] == 'OPTIONS':
+            response.headers['Access-Control-Allow-Methods'] = 'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'
+            if 'access-control-request-headers' in headers:
+                response.headers['Access-Control-Allow-Headers'] = headers['access-control-request-headers']
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _dispatch(self, scope, receive):
+        """Route one request; returns the matched rule, as the metrics endpoint label, and the response."""
+        path_matched = None
+        for method, rule, pattern, handler, auth, stream in self.routes:
+            match = pattern.match(scope['path'])
+            if not match:
+                continue
+            path_matched = path_matched or rule
+            if method != scope['method']:
+                continue
+
+            params = {k: int(v) for k, v in match.groupdict().items()}
+            body = None if stream else await self._read_body(receive)
+            request = Request(scope, body, params, receive)
+            # Rate limits are per blueprint, as in the Flask app: /auth per client IP
+            # before anything else, the others per user once the token is resolved
+            blueprint = scope['path'].split('/')[1]
+            try:
+                if blueprint in IP_SCOPES:
+                    ip = client_ip(
+                        (scope.get('client') or ('',))[0],
+                        request.headers.get('x-forwarded-for'),
+                        self.flask_app.config['PROXY_FIX_X_FOR'],
+                    )
+                    await self._rate_limit(blueprint, f'ip:{ip}')
+                if auth:
+                    await self._authenticate(request)
+                    if blueprint not in IP_SCOPES:
+                        await self._rate_limit(blueprint, f'user:{request.user_id}')
+                return rule, await handler(request, **params)
+            except HTTPError as e:
+                return rule, self.error(e.message, e.status, e.headers)
+            except NotModified as e:
+                return rule, Response(b'', 304, e.headers)
+            except HashingBusy:
+                return rule, self.error('Server busy, please retry shortly.', 503, {'Retry-After': '1'})
+            except Exception as e:
+                self.flask_app.logger.error(f'Server Error: {e}')
+                return rule, self.error('Internal server error', 500)
+
+        if path_matched and scope['method'] == 'OPTIONS':
+            return path_matched, Response(b'', 200, content_type='text/html; charset=utf-8')
+        if path_matched:
+            return path_matched, self.error('Method not allowed', 405)
+        return 'unmatched', self.error('Not found', 404)
+
+    async def _authenticate(self, request):
+        auth_header = request.headers.get('authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            raise HTTPError(401, 'Invalid authorization header')
+
+        token = auth_header.split(' ')[1]
+        now = datetime.now()
+        entry = self.token_cache.get(token)
+        if entry is not None and entry[1] > now:
+            request.user_id = entry[0]
+            return
+        if entry is not None:
+            self.token_cache.pop(token)
+            raise HTTPError(401, 'Unauthorized')
+
+        session = await self.pool.fetchrow(asyncpg_sql('session_by_token'), token)
+        if session is None or session['expires'] <= now:
+            raise HTTPError(401, 'Unauthorized')
+
+        self.token_cache.set(token, (session['user_id'], session['expires']))
+        request.user_id = session['user_id']
+
+    async def _rate_limit(self, blueprint, identity):
+        limiter = self.flask_app.extensions.get('rate_limiter')
+        if limiter is None:
+            return
+        # The shared bucket store is a SQLite file, so take it off the event loop
+        wait = await asyncio.get_running_loop().run_in_executor(None, limiter.check, blueprint, identity)
+        if wait:
+            raise HTTPError(429, TOO_MANY_REQUESTS, {'Retry-After': retry_after(wait)})
+
+    async def run_hasher(self, fn, *args):
+        # Hashing blocks (inline or waiting on the process pool), so keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+app = ShopTrackASGI()
+
+
+@app.route('GET', '/')
+async def index(request):
+    return app.json_response({'message': 'ShopTrack API is running'})
+
+@app.route('GET', '/hello')
+async def hello(request):
+    return Response('Hello, World!', content_type='text/html; charset=utf-8')
+
+@app.route('GET', '/metrics')
+async def metrics(request):
+    token = app.config['METRICS_TOKEN']
+    if not token:
+        return app.error('Not found', 404)
+    if not metrics_authorized(request.headers.get('authorization'), token):
+        return app.error('Unauthorized', 401)
+    # Reads the other workers' snapshots from METRICS_DIR, so keep it off the event loop
+    text = await asyncio.get_running_loop().run_in_executor(None, app.metrics.render)
+    return Response(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('GET', '/stats')
+async def stats(request):
+    # The same counters as the Flask app's /stats, for this worker's asyncpg pool
+    return app.json_response({
+        'pool': {
+            'size': app.pool.get_size(),
+            'idle': app.pool.get_idle_size(),
+            'in_use': app.pool.get_size() - app.pool.get_idle_size(),
+            'min': app.pool.get_min_size(),
+            'max': app.pool.get_max_size(),
+            'pid': os.getpid(),
+        },
+        'token_cache': app.token_cache.stats(),
+        'event_subscribers': app.events.subscriber_count(),
+        'group_commit': None,
+    })
+
+
+@app.route('POST', '/auth/register')
+async def register(request):
+    data = request.json()
+    is_valid, error = validate_user_data(data)
+    if not is_valid:
+        return app.error(error, 400)
+
+    pwhash = await app.run_hasher(app.hasher.hash, data['password'])
+    try:
+        await app.pool.execute(asyncpg_sql('insert_user'), data['username'], pwhash)
+    except asyncpg.UniqueViolationError:
+        return app.error(f"User {data['username']} is already registered.", 400)
+    return app.json_response({'message': 'User registered successfully.'}, 201)
+
+@app.route('POST', '/auth/login')
+async def login(request):
+    data = request.json()
+    is_valid, error = validate_user_data(data)
+    if not is_valid:
+        return app.error(error, 400)
+
+    user = await app.pool.fetchrow(asyncpg_sql('user_by_username'), data['username'])
+    if user is None:
+        return app.error('Incorrect username.', 401)
+
+    if not await app.run_hasher(app.hasher.verify, user['password'], data['password']):
+        return app.error('Incorrect password.', 401)
+
+    token = secrets.token_hex(32)
+    async with app.pool.acquire() as conn:
+        async with conn.transaction():
+            if app.hasher.needs_rehash(user['password']):
+                pwhash = await app.run_hasher(app.hasher.hash, data['password'])
+                await conn.execute(asyncpg_sql('update_user_password'), pwhash, user['id'])
+            await conn.execute(
+                asyncpg_sql('insert_session'), token, user['id'], datetime.now() + timedelta(days=30)
+            )
+
+    return app.json_response({
+        'message': 'Login successful',
+        'token': token,
+        'user': {'id': user['id'], 'username': user['username']}
+    })
+
+@app.route('POST', '/auth/logout', auth=True)
+async def logout(request):
+    token = request.headers['authorization'].split(' ')[1]
+    await app.pool.execute(asyncpg_sql('delete_session'), token)
+    app.token_cache.pop(token)
+    return app.json_response({'message': 'Logged out successfully.'})
+
+
+async def _paginated(request, table, owner_column):
+    is_valid, page = validate_page_args(request.args)
+    if not is_valid:
+        raise HTTPError(400, page)
+    if page is None:
+        return None
+
+    query, params = paginate_query(f'SELECT * FROM {table} WHERE {owner_column} = ?', (request.user_id,), page, '?')
+    rows = await app.pool.fetch(numbered_placeholders(query), *params)
+    return app.json_response(page_response(rows, page))
+
+async def _record_events(conn, user_id, changes):
+    """NOTIFY the events of the product writes in ``conn``'s open transaction; see shoptrack.events."""
+    version = await conn.fetchval(asyncpg_sql('inventory_version'), user_id)
+    events = build_events(user_id, version, changes, app.flask_app.json.dumps)
+    await conn.execute(asyncpg_sql('notify_stock_events'), [event.encode() for event in events])
+
+async def _record_reset(conn, user_id):
+    """NOTIFY a ``reset`` event: tells ``user_id``'s subscribers to reload."""
+    version = await conn.fetchval(asyncpg_sql('inventory_version'), user_id)
+    await conn.execute(asyncpg_sql('notify_stock_events'), [Event.reset(user_id, version or 0).encode()])
+
+async def _inventory_etag(request):
+    """Weak ETag for the user's products; raises a 304 if the client already has it."""
+    version = await app.pool.fetchval(asyncpg_sql('inventory_version'), request.user_id)
+    etag = inventory_etag(request.user_id, version or 0)
+    headers = {'ETag': quote_etag(etag, weak=True), 'Cache-Control': 'private, no-cache'}
+    if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+        raise NotModified(headers)
+    return headers
+
+@app.route('GET', '/stock/', auth=True)
+async def get_stock(request):
+    etag_headers = await _inventory_etag(request)
+    response = await _paginated(request, 'product', 'owner_id')
+    if response is not None:
+        response.headers.update(etag_headers)
+        return response
+
+    products = await app.pool.fetch(asyncpg_sql('products_by_owner'), request.user_id)
+    if not products:
+        return app.error('No products found', 404)
+    return app.json_response(RowSet(products), headers=etag_headers)
+
+@app.route('GET', '/stock/summary', auth=True)
+async def get_inventory_summary(request):
+    row = await app.pool.fetchrow(asyncpg_sql('inventory_summary'), request.user_id)
+    if row is None:
+        summary = {column: 0 for column in SUMMARY_COLUMNS}
+        summary['updated'] = None
+        return app.json_response(summary)
+    return app.json_response(dict(row))
+
+@app.route('GET', '/stock/search', auth=True)
+async def search_stock(request):
+    etag_headers = await _inventory_etag(request)
+    is_valid, options = validate_search_args(request.args)
+    if not is_valid:
+        return app.error(options, 400)
+
+    rows = await app.pool.fetch(
+        asyncpg_sql('search_products'),
+        match_expression(options['terms'], 'postgresql'), request.user_id,
+        options['limit'] + 1, options['offset']
+    )
+    return app.json_response(search_page(rows, options['limit'], options['offset']), headers=etag_headers)
+
+@app.route('GET', '/stock/<int:id>', auth=True)
+async def get_product(request, id):
+    etag_headers = await _inventory_etag(request)
+    product = await app.pool.fetchrow(asyncpg_sql('product_by_id'), id, request.user_id)
+    if not product:
+        return app.error('Product not found', 404)
+    return app.json_response(dict(product), headers=etag_headers)
+
+@app.route('POST', '/stock/', auth=True)
+async def create_product(request):
+    data = request.json()
+    is_valid, error = validate_product_data(data)
+    if not is_valid:
+        return app.error(error, 400)
+
+    try:
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                product_id = await conn.fetchval(
+                    asyncpg_sql('insert_product_returning'),
+                    data['name'], data['stock'], data['price'], data.get('description'), request.user_id
+                )
+                # Record initial stock as a 'buy' transaction if stock > 0
+                if data['stock'] > 0:
+                    await conn.execute(
+                        asyncpg_sql('insert_history'),
+                        product_id, data['name'], request.user_id, data['price'], data['stock'], 'buy'
+                    )
+                await _record_events(conn, request.user_id, [product_change('product.created', product_id, data)])
+    except asyncpg.PostgresError:
+        return app.error('Failed to create product', 500)
+    return app.json_response({'message': 'Product created successfully.'}, 201)
+
+@app.route('POST', '/stock/import', auth=True, stream=True)
+async def import_stock(request):
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    body_format = import_format(mimetype, request.args.get('format'))
+    if body_format is None:
+        formats = ', '.join(f'{name} ({mimetype})' for name, mimetype in IMPORT_FORMATS.items())
+        return app.error(f"Body must be one of: {formats}", 400)
+
+    loop = asyncio.get_running_loop()
+    rows = parse_rows(io.BufferedReader(ReceiveStream(request.receive, loop)), body_format)
+    result = new_import_result()
+    batches = import_batches(rows, app.config['IMPORT_BATCH_SIZE'], result)
+    while True:
+        # Parsing waits for the body as it arrives, so it runs off the event loop,
+        # and only the batch being inserted is held in memory
+        batch = await loop.run_in_executor(None, next, batches, None)
+        if batch is None:
+            break
+        columns = import_columns([product for _, product in batch], request.user_id)
+        try:
+            async with app.pool.acquire() as conn:
+                async with conn.transaction():
+                    rows_inserted = await conn.fetch(asyncpg_sql('import_products'), *columns)
+                    await conn.execute(asyncpg_sql('import_history_by_ids'), [row['id'] for row in rows_inserted])
+            result['imported'] += len(batch)
+        except Exception as e:
+            app.flask_app.logger.error(f'Product import batch failed: {e}')
+            for number, _ in batch:
+                import_failed(result, number, "Failed to import product")
+
+    if result['imported']:
+        # Too many products to stream as events; live subscribers reload instead
+        async with app.pool.acquire() as conn:
+            await _record_reset(conn, request.user_id)
+    return app.json_response(result)
+
+@app.route('PUT', '/stock/<int:id>', auth=True)
+async def update_product(request, id):
+    data = request.json()
+    owned = await app.pool.fetchrow(asyncpg_sql('product_by_id'), id, request.user_id)
+    if owned is None:
+        return app.error('Product not found or access denied', 404)
+
+    is_valid, error = validate_product_data(data)
+    if not is_valid:
+        return app.error(error, 400)
+
+    try:
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    asyncpg_sql('update_product'),
+                    data['name'], data['stock'], data['price'], data.get('description'), id, request.user_id
+                )
+                await _record_events(conn, request.user_id, [product_change('product.updated', id, data)])
+    except asyncpg.PostgresError:
+        return app.error('Failed to update product', 500)
+    return app.json_response({'message': 'Product updated successfully.'})
+
+@app.route('DELETE', '/stock/<int:id>', auth=True)
+async def delete_product(request, id):
+    try:
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                deleted = await conn.fetchval(asyncpg_sql('delete_product_returning'), id, request.user_id)
+                if deleted is not None:
+                    await _record_events(conn, request.user_id, [('product.deleted', {'id': id})])
+    except asyncpg.PostgresError:
+        return app.error('Failed to delete product', 500)
+    if deleted is None:
+        return app.error('Product not found or access denied', 404)
+    return app.json_response({'message': 'Product deleted successfully.'})
+
+async def _change_stock(request, id, operation):
+    data = request.json()
+    is_valid, error = validate_stock_data(data)
+    if not is_valid:
+        return app.error(error, 400)
+
+    quantity = data['stock']
+    async with app.pool.acquire() as conn:
+        async with conn.transaction():
+            if operation == 'remove':
+                row = await conn.fetchrow(
+                    asyncpg_sql('remove_stock_checked'), id, request.user_id, quantity, quantity
+                )
+                if row is not None and row['name'] is None:
+                    return app.error(
+                        f"Insufficient stock. Available: {row['available']}, requested: {quantity}", 400
+                    )
+            else:
+                row = await conn.fetchrow(asyncpg_sql('add_stock_returning'), quantity, id, request.user_id)
+            if row is None:
+                return app.error('Product not found or access denied', 400)
+
+            await conn.execute(
+                asyncpg_sql('insert_history'),
+                id, row['name'], request.user_id, row['price'], quantity,
+                'sell' if operation == 'remove' else 'buy'
+            )
+            change = -quantity if operation == 'remove' else quantity
+            await _record_events(conn, request.user_id, [stock_change(id, row, change)])
+
+    if operation == 'remove':
+        return app.json_response({'message': 'Stock removed successfully.'})
+    return app.json_response({'message': 'Stock added successfully.'})
+
+@app.route('PATCH', '/stock/<int:id>/stock/add', auth=True)
+async def add_stock(request, id):
+    return await _change_stock(request, id, 'add')
+
+@app.route('PATCH', '/stock/<int:id>/stock/remove', auth=True)
+async def remove_stock(request, id):
+    return await _change_stock(request, id, 'remove')
+
+@app.route('POST', '/stock/batch', auth=True)
+async def batch_stock(request):
+    data = request.json()
+    is_valid, error = validate_batch_data(data)
+    if not is_valid:
+        return app.error(error, 400)
+
+    atomic = data.get('atomic', False)
+    items = data['items']
+    results = check_batch_items(items)
+    if atomic and any(results):
+        return app.json_response(batch_rejected(results), 400)
+
+    product_ids = sorted({item['product_id'] for item, r in zip(items, results) if r is None})
+    async with app.pool.acquire() as conn:
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            rows = await conn.fetch(asyncpg_sql('products_for_batch'), request.user_id, product_ids)
+            products = {row['id']: dict(row) for row in rows}
+            original_stock = {product_id: product['stock'] for product_id, product in products.items()}
+            history_rows, changed = plan_batch(items, results, products, request.user_id)
+
+            failed = sum(1 for r in results if r['status'] == 'error')
+            if failed and atomic:
+                await transaction.rollback()
+                return app.json_response(batch_rejected(results), 400)
+
+            if history_rows:
+                await conn.executemany(
+                    asyncpg_sql('set_product_stock'),
+                    [(product['stock'], product['id'], request.user_id) for product in changed]
+                )
+                await conn.executemany(asyncpg_sql('insert_history'), history_rows)
+                await _record_events(conn, request.user_id, [
+                    stock_change(product['id'], product, product['stock'] - original_stock[product['id']])
+                    for product in changed
+                ])
+        except Exception:
+            await transaction.rollback()
+            return app.error('Failed to apply batch', 500)
+        await transaction.commit()
+
+    return app.json_response({'applied': len(history_rows), 'failed': failed, 'results': results})
+
+@app.route('GET', '/stock/changes', auth=True)
+async def get_stock_changes(request):
+    is_valid, since = validate_changes_args(request.args)
+    if not is_valid:
+        return app.error(since, 400)
+
+    row = await app.pool.fetchrow(asyncpg_sql('sync_versions'), request.user_id)
+    version, pruned = (row['version'], row['pruned']) if row else (0, 0)
+    response, since = sync_plan(version, pruned, since)
+    if since is None:
+        return app.json_response(response)
+
+    # Bounded by the version read above, like shoptrack.changes.get_changes()
+    response['upserts'] = RowSet(
+        await app.pool.fetch(asyncpg_sql('changed_products'), request.user_id, since, version)
+    )
+    if not response['reset']:
+        rows = await app.pool.fetch(asyncpg_sql('deleted_products'), request.user_id, since, version)
+        response['deletions'] = [row['product_id'] for row in rows]
+    return app.json_response(response)
+
+@app.route('GET', '/stock/events', auth=True)
+async def stock_events(request):
+    last_id = request.headers.get('last-event-id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return app.error('Last-Event-ID must be an integer', 400)
+
+    version = None
+    if last_id is not None:
+        version = await app.pool.fetchval(asyncpg_sql('inventory_version'), request.user_id) or 0
+    stream = EventStream(request.user_id, last_id)
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+
+    async def chunks():
+        # An idle subscriber is a suspended coroutine and its queue; it holds
+        # no pool connection, so one worker can serve thousands
+        subscription = AsyncSubscription(request.user_id, app.config['EVENTS_QUEUE_SIZE'])
+        replay = app.events.subscribe(subscription, last_id)
+        disconnected = asyncio.ensure_future(request.receive())
+        try:
+            yield stream.start(replay, version)
+            while True:
+                waiting = asyncio.ensure_future(subscription.get(heartbeat))
+                await asyncio.wait((waiting, disconnected), return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    waiting.cancel()
+                    return
+                events = waiting.result()
+                if not events:
+                    # A comment line keeps proxies from timing out an idle stream
+                    yield ': keep-alive\n\n'
+                    continue
+                text = stream.render(events)
+                if text:
+                    yield text
+        finally:
+            disconnected.cancel()
+            app.events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        chunks(),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _history_args(request):
+    is_valid, page = validate_page_args(request.args)
+    if not is_valid:
+        raise HTTPError(400, page)
+    is_valid, filters = validate_history_args(request.args)
+    if not is_valid:
+        raise HTTPError(400, filters)
+    return page, filters
+
+def _history_page(rows, page):
+    return app.json_response(page_response(rows, page))
+
+@app.route('GET', '/stock/history', auth=True)
+async def get_history(request):
+    page, filters = _history_args(request)
+    query, params = history_query(request.user_id, filters, page)
+    history = await app.pool.fetch(numbered_placeholders(query), *params)
+    if page is not None:
+        return _history_page(history, page)
+
+    if not history:
+        return app.error('No transaction history found', 404)
+    return app.json_response(RowSet(history))
+
+@app.route('GET', '/stock/history/rollup', auth=True)
+async def get_history_rollup(request):
+    is_valid, options = validate_rollup_args(request.args)
+    if not is_valid:
+        return app.error(options, 400)
+
+    query, params = rollup_query(request.user_id, 'postgresql', **options)
+    rows = await app.pool.fetch(numbered_placeholders(query), *params)
+    return app.json_response({'bucket': options['bucket'], 'rollup': rollup_rows(rows)})
+
+@app.route('GET', '/stock/<int:id>/history', auth=True)
+async def get_product_history(request, id):
+    page, filters = _history_args(request)
+    # Ownership is checked by the history query itself; see OWNED_PRODUCT_HISTORY
+    query, params = history_query(request.user_id, filters, page, product_id=id)
+    history = await app.pool.fetch(numbered_placeholders(query), *params)
+    if not history:
+        return app.error('Product not found or access denied', 404)
+    if history[0]['id'] is None:
+        history = []
+
+    if page is not None:
+        return _history_page(history, page)
+    if not history:
+        return app.error('No transaction history found for this product', 404)
+    return app.json_response(RowSet(history))
+
+@app.route('GET', '/stock/history/export', auth=True)
+async def export_history(request):
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        return app.error(f"Format must be one of: {', '.join(EXPORT_MIMETYPES)}", 400)
+
+    async def chunks():
+        dumps = app.flask_app.json.dumps
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(HISTORY_COLUMNS)
+        pending = 0
+
+        async with app.pool.acquire() as conn:
+            async with conn.transaction():
+                # asyncpg cursors are server-side and fetch EXPORT_CHUNK_ROWS at a time
+                cursor = conn.cursor(asyncpg_sql('history_export'), request.user_id, prefetch=EXPORT_CHUNK_ROWS)
+                async for row in cursor:
+                    if export_format == 'csv':
+                        record = [row[column] for column in HISTORY_COLUMNS]
+                        record[-1] = record[-1].isoformat(sep=' ')
+                        writer.writerow(record)
+                    else:
+                        buffer.write(dumps(dict(row), separators=(',', ':')) + '\n')
+                    pending += 1
+                    if pending >= EXPORT_CHUNK_ROWS:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                        pending = 0
+        yield buffer.getvalue()
+
+    return StreamingResponse(
+        chunks(),
+        content_type=EXPORT_MIMETYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename=history.{export_format}'}
+    )
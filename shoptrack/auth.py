@@ -5,11 +5,13 @@ import secrets
 import os
 
 from flask import (
-    Blueprint, g, request, jsonify
+    Blueprint, current_app, g, request, jsonify
 )
-from werkzeug.security import check_password_hash, generate_password_hash
-
-from shoptrack.db import get_db, get_placeholder, execute_query
+from shoptrack.cache import TTLCache
+from shoptrack.db import get_db
+from shoptrack.hashing import HashingBusy, get_hasher
+from shoptrack.queries import run_query
+from shoptrack.ratelimit import limit_user
 from shoptrack.validation import validate_user_data, validate_json_request
 
 # Import PostgreSQL error if available
@@ -22,6 +24,48 @@ except ImportError:
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+@bp.errorhandler(HashingBusy)
+def hashing_busy(error):
+    # Shed load quickly instead of queueing more logins behind the hash pool
+    return jsonify({'error': 'Server busy, please retry shortly.'}), 503, {'Retry-After': '1'}
+
+def init_app(app):
+    # token -> (user_id, expires); see resolve_token()
+    app.extensions['token_cache'] = TTLCache(
+        maxsize=app.config['TOKEN_CACHE_SIZE'],
+        ttl=app.config['TOKEN_CACHE_TTL'],
+    )
+
+def get_token_cache():
+    return current_app.extensions['token_cache']
+
+def resolve_token(token):
+    """Return the user id for a live session token, or None.
+
+    Lookups are served from the per-worker token cache when possible. Cached
+    entries still honour the session's ``expires`` column, and logout evicts
+    them, so the cache TTL only bounds how long a session deleted by another
+    worker can keep working here.
+    """
+    cache = get_token_cache()
+    now = datetime.now()
+
+    entry = cache.get(token)
+    if entry is not None:
+        user_id, expires = entry
+        if expires > now:
+            return user_id
+        cache.pop(token)
+        return None
+
+    cursor = run_query('session_by_token', (token,))
+    session = cursor.fetchone()
+    if not session or session['expires'] <= now:
+        return None
+
+    cache.set(token, (session['user_id'], session['expires']))
+    return session['user_id']
+
 def login_required(f):
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
@@ -32,13 +76,15 @@ def login_required(f):
         token = auth_header.split(' ')[1]
         
         # Verify token and get user ID
-        placeholder = get_placeholder()
-        cursor = execute_query(f'SELECT user_id FROM sessions WHERE id = {placeholder}', (token,))
-        session = cursor.fetchone()
-        if not session:
+        user_id = resolve_token(token)
+        if user_id is None:
             return jsonify({'error': 'Unauthorized'}), 401
         
-        g.user_id = session['user_id']
+        g.user_id = user_id
+        
+        throttled = limit_user(user_id)
+        if throttled is not None:
+            return throttled
         
         return f(*args, **kwargs)
     return decorated_function
@@ -50,14 +96,13 @@ class Token:
     def verify(self):
         if not self.token:
             return False
-        placeholder = get_placeholder()
-        cursor = execute_query(f'SELECT * FROM sessions WHERE id = {placeholder}', (self.token,))
+        cursor = run_query('session_full_by_token', (self.token,))
         session = cursor.fetchone()
         if session is None:
             return False
         if session['expires'] < datetime.now():
             # Clean up expired session
-            execute_query(f'DELETE FROM sessions WHERE id = {placeholder}', (self.token,))
+            run_query('delete_session', (self.token,))
             get_db().commit()
             return False
         return True
@@ -83,11 +128,7 @@ def register():
     db = get_db()
     
     try:
-        placeholder = get_placeholder()
-        execute_query(
-            f'INSERT INTO "user" (username, password) VALUES ({placeholder}, {placeholder})',
-            (data['username'], generate_password_hash(data['password']))
-        )
+        run_query('insert_user', (data['username'], get_hasher().hash(data['password'])))
         get_db().commit()
     except (sqlite3.IntegrityError, PostgresIntegrityError) if POSTGRESQL_AVAILABLE else sqlite3.IntegrityError:
         error = f"User {data['username']} is already registered."
@@ -108,22 +149,22 @@ def login():
     if not is_valid:
         return jsonify({'error': error}), 400
     
-    placeholder = get_placeholder()
-    cursor = execute_query(f'SELECT * FROM "user" WHERE LOWER(username) = LOWER({placeholder})', (data['username'],))
+    cursor = run_query('user_by_username', (data['username'],))
     user = cursor.fetchone()
     if user is None:
         return jsonify({'error': 'Incorrect username.'}), 401
     
-    if not check_password_hash(user['password'], data['password']):
+    hasher = get_hasher()
+    if not hasher.verify(user['password'], data['password']):
         return jsonify({'error': 'Incorrect password.'}), 401
 
     token = Token().generate()
     
-    placeholder = get_placeholder()
-    execute_query(
-        f'INSERT INTO sessions (id, user_id, expires) VALUES ({placeholder}, {placeholder}, {placeholder})',
-        (token, user['id'], datetime.now() + timedelta(days=30))
-    )
+    if hasher.needs_rehash(user['password']):
+        # Move the stored hash to the configured parameters while we have the password
+        run_query('update_user_password', (hasher.hash(data['password']), user['id']))
+    
+    run_query('insert_session', (token, user['id'], datetime.now() + timedelta(days=30)))
     get_db().commit()
     
     return jsonify({
@@ -141,7 +182,7 @@ def logout():
     auth_header = request.headers.get('Authorization')
     token = auth_header.split(' ')[1]
     
-    placeholder = get_placeholder()
-    execute_query(f'DELETE FROM sessions WHERE id = {placeholder}', (token,))
+    run_query('delete_session', (token,))
     get_db().commit()
+    get_token_cache().pop(token)
     return jsonify({'message': 'Logged out successfully.'}), 200
\ No newline at end of file
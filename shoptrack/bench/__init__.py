@@ -0,0 +1,111 @@
+"""Synthetic data and repeatable load benchmarks.
+
+``flask bench seed`` fills the configured database with generated users,
+products and history. ``flask bench run`` drives the scenarios in
+shoptrack.bench.scenarios through the Flask test client, or over HTTP from
+several client processes with ``--url``, and prints a JSON report with
+latency percentiles and throughput per scenario. Given ``--baseline`` it
+exits with status 1 when a scenario regressed, so CI can gate on it.
+Everything runs offline against the default SQLite database.
+"""
+import json
+import platform
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from shoptrack.bench.runner import compare_reports, run_http, run_in_process
+from shoptrack.bench.scenarios import SCENARIOS
+from shoptrack.bench.seed import DEFAULT_PASSWORD, DEFAULT_PREFIX, bench_usernames, seed_data
+from shoptrack.db import get_dialect
+
+bench_cli = AppGroup('bench', help='Generate benchmark data and run load benchmarks.')
+
+@bench_cli.command('seed')
+@click.option('--users', type=int, default=10, show_default=True, help='Users to add.')
+@click.option('--products', type=int, default=20, show_default=True, help='Products per user.')
+@click.option('--history', type=int, default=50, show_default=True, help='History rows per product.')
+@click.option('--days', type=int, default=90, show_default=True, help='History is spread over this many past days.')
+@click.option('--prefix', default=DEFAULT_PREFIX, show_default=True, help='Username prefix.')
+@click.option('--password', default=DEFAULT_PASSWORD, show_default=True, help='Password of every generated user.')
+@click.option('--seed', type=int, default=None, help='Random seed, for reproducible data.')
+def seed_command(users, products, history, days, prefix, password, seed):
+    """Bulk insert synthetic users, products and history."""
+    if not prefix.isalpha():
+        raise click.BadParameter('must only contain letters', param_hint='--prefix')
+    counts = seed_data(users, products, history, prefix=prefix, password=password, days=days, seed=seed)
+    click.echo(f"Added {counts['users']} users, {counts['products']} products and {counts['history']} history rows.")
+
+@bench_cli.command('run')
+@click.option(
+    '--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)),
+    help='Scenario to run; may be repeated. Defaults to all of them.'
+)
+@click.option('--requests', type=int, default=200, show_default=True, help='Timed requests per scenario.')
+@click.option('--users', type=int, default=10, show_default=True, help='Seeded users to spread the load over.')
+@click.option('--url', default=None, help='Benchmark a running server over HTTP instead of the test client.')
+@click.option('--processes', type=int, default=4, show_default=True, help='Client processes in HTTP mode.')
+@click.option('--prefix', default=DEFAULT_PREFIX, show_default=True, help='Username prefix used by "bench seed".')
+@click.option('--password', default=DEFAULT_PASSWORD, show_default=True, help='Password used by "bench seed".')
+@click.option('--seed', type=int, default=None, help='Random seed for the request mix.')
+@click.option('--output', type=click.Path(dir_okay=False, writable=True), default=None, help='Also write the report here.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None, help='Report to compare with.')
+@click.option('--tolerance', type=float, default=0.2, show_default=True, help='Allowed slowdown against the baseline.')
+def run_command(scenarios, requests, users, url, processes, prefix, password, seed, output, baseline, tolerance):
+    """Run the benchmark scenarios and print a JSON report."""
+    usernames = [username for _, username in bench_usernames(prefix)][:users]
+    if not usernames:
+        raise click.ClickException(f'No users named {prefix}<n>; run "flask bench seed" first.')
+
+    report = {
+        'meta': {
+            'mode': 'http' if url else 'test_client',
+            'url': url,
+            'processes': processes if url else 1,
+            'dialect': get_dialect(),
+            'users': len(usernames),
+            'requests': requests,
+            'seed': seed,
+            'python': platform.python_version(),
+            'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        },
+        'scenarios': {},
+    }
+
+    app = current_app._get_current_object()
+    for name in scenarios or SCENARIOS:
+        try:
+            if url:
+                result = run_http(url.rstrip('/'), name, usernames, password, requests, processes, seed)
+            else:
+                result = run_in_process(app, name, usernames, password, requests, seed)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        report['scenarios'][name] = result
+        click.echo(
+            f"{name}: {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, "
+            f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, {result['errors']} errors",
+            err=True,
+        )
+
+    text = json.dumps(report, indent=2)
+    click.echo(text)
+    if output:
+        with open(output, 'w', encoding='utf8') as f:
+            f.write(text + '\n')
+
+    if baseline:
+        with open(baseline, encoding='utf8') as f:
+            previous = json.load(f)
+        if previous.get('meta', {}).get('mode') != report['meta']['mode']:
+            click.echo('Warning: the baseline was measured in a different mode.', err=True)
+        regressions = compare_reports(report, previous, tolerance)
+        for regression in regressions:
+            click.echo(f'Regression: {regression}', err=True)
+        if regressions:
+            raise SystemExit(1)
+
+def init_app(app):
+    app.cli.add_command(bench_cli)
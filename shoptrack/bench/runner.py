@@ -0,0 +1,136 @@
+"""Run scenarios, summarise their latencies and compare reports with a baseline."""
+import math
+import multiprocessing
+import random
+import threading
+import time
+
+from shoptrack.bench.scenarios import SCENARIOS, FlaskClientTransport, HTTPTransport
+
+# Fields compared against the baseline; see compare_reports()
+LATENCY_FIELDS = ('p50_ms', 'p95_ms', 'p99_ms')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+def summarize(latencies, errors, elapsed):
+    """Latency percentiles in milliseconds and throughput for one scenario."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(count / elapsed, 2) if elapsed > 0 else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3) if count else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3) if count else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3) if count else None,
+        'max_ms': round(latencies[-1] * 1000, 3) if count else None,
+    }
+
+def _timed_steps(scenario, requests):
+    latencies = []
+    errors = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        ok = scenario.step()
+        latencies.append(time.perf_counter() - started)
+        if not ok:
+            errors += 1
+    return latencies, errors
+
+def run_in_process(app, name, usernames, password, requests, seed=None):
+    """Run ``requests`` steps of scenario ``name`` through the Flask test client."""
+    scenario = SCENARIOS[name](FlaskClientTransport(app), usernames, password, random.Random(seed))
+    started = time.perf_counter()
+    latencies, errors = _timed_steps(scenario, requests)
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+def _http_worker(url, name, usernames, password, requests, seed, barrier, results):
+    transport = HTTPTransport(url)
+    try:
+        scenario = SCENARIOS[name](transport, usernames, password, random.Random(seed))
+    except Exception as e:
+        barrier.abort()
+        results.put((None, str(e)))
+        return
+
+    try:
+        # Every process finishes its logins before any of them starts the clock
+        barrier.wait()
+        results.put(_timed_steps(scenario, requests))
+    except Exception as e:
+        results.put((None, str(e)))
+    finally:
+        transport.close()
+
+def run_http(url, name, usernames, password, requests, processes, seed=None):
+    """Run scenario ``name`` against the server at ``url`` from ``processes`` client processes.
+
+    The requests are split evenly between the processes, and so are the
+    users when there are enough of them. Throughput is measured over the
+    wall-clock time of the whole run.
+    """
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes + 1)
+    results = context.Queue()
+    workers = []
+    for index in range(processes):
+        share = requests // processes + (1 if index < requests % processes else 0)
+        users = usernames[index::processes] if len(usernames) >= processes else usernames
+        worker_seed = None if seed is None else seed + index
+        worker = context.Process(
+            target=_http_worker,
+            args=(url, name, users, password, share, worker_seed, barrier, results),
+            daemon=True,
+        )
+        worker.start()
+        workers.append(worker)
+
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    started = time.perf_counter()
+    outcomes = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.join()
+
+    failures = [error for latencies, error in outcomes if latencies is None]
+    if failures:
+        raise RuntimeError(f'Benchmark client failed: {failures[0]}')
+
+    latencies = [latency for worker_latencies, _ in outcomes for latency in worker_latencies]
+    errors = sum(worker_errors for _, worker_errors in outcomes)
+    return summarize(latencies, errors, elapsed)
+
+def compare_reports(report, baseline, tolerance):
+    """List the scenarios of ``report`` that are slower than ``baseline`` by more than ``tolerance``.
+
+    A scenario regresses when any latency percentile grows, or its
+    throughput drops, by more than ``tolerance`` (0.2 = 20%). Scenarios
+    missing from either report are ignored.
+    """
+    regressions = []
+    for name, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for field in LATENCY_FIELDS:
+            if result.get(field) is None or not previous.get(field):
+                continue
+            if result[field] > previous[field] * (1 + tolerance):
+                regressions.append(f'{name}: {field} {result[field]} > baseline {previous[field]}')
+        if result.get('throughput_rps') is not None and previous.get('throughput_rps'):
+            if result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+                regressions.append(
+                    f"{name}: throughput_rps {result['throughput_rps']} < baseline {previous['throughput_rps']}"
+                )
+    return regressions
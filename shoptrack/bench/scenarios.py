@@ -0,0 +1,197 @@
+"""Benchmark scenarios, driven through the Flask test client or over HTTP.
+
+A scenario logs its users in during setup, which is not timed, and then
+performs one timed operation per ``step()``. Steps only talk to the app
+through a transport, so the same scenario runs in-process or against a
+server started with gunicorn or ``flask run``.
+"""
+import http.client
+import json
+import random
+from urllib.parse import urlsplit
+
+
+class FlaskClientTransport:
+    """Requests through ``app.test_client()``, without a network or server."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.headers, response.get_json(silent=True)
+
+
+class HTTPTransport:
+    """Requests over one keep-alive HTTP connection to ``base_url``."""
+
+    def __init__(self, base_url, timeout=30.0):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=data, headers=headers)
+                response = self.connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the idle keep-alive connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+
+        if response.will_close:
+            self.close()
+        try:
+            parsed = json.loads(payload) if payload else None
+        except ValueError:
+            parsed = None
+        return response.status, response.headers, parsed
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class Scenario:
+    """Base class; subclasses set ``name`` and implement ``step()``."""
+
+    name = None
+    login = True
+
+    def __init__(self, transport, usernames, password, rng=None):
+        self.transport = transport
+        self.password = password
+        self.rng = rng or random.Random()
+        self.usernames = list(usernames)
+        # username -> {'headers': ..., 'products': [ids], 'etags': {path: etag}}
+        self.sessions = {}
+        if self.login:
+            for username in self.usernames:
+                self.sessions[username] = self._open_session(username)
+
+    def _open_session(self, username):
+        status, _, body = self.transport.request(
+            'POST', '/auth/login', {'username': username, 'password': self.password}
+        )
+        if status != 200:
+            raise RuntimeError(f'Could not log in as {username}: {status} {body}')
+        headers = {'Authorization': f"Bearer {body['token']}"}
+        status, _, products = self.transport.request('GET', '/stock/', headers=headers)
+        if status != 200 or not products:
+            raise RuntimeError(f'User {username} has no products; run "flask bench seed" first')
+        return {'headers': headers, 'products': [product['id'] for product in products], 'etags': {}}
+
+    def session(self):
+        return self.sessions[self.rng.choice(self.usernames)]
+
+    def step(self):
+        """Run one operation; return False when the app answered with an unexpected status."""
+        raise NotImplementedError
+
+
+class LoginStorm(Scenario):
+    """Password logins, which are dominated by the password hash."""
+
+    name = 'login_storm'
+    login = False
+
+    def step(self):
+        username = self.rng.choice(self.usernames)
+        status, _, _ = self.transport.request('POST', '/auth/login', {'username': username, 'password': self.password})
+        return status == 200
+
+
+class PollingReads(Scenario):
+    """Clients polling their product list and single products with If-None-Match."""
+
+    name = 'polling_reads'
+
+    def step(self):
+        session = self.session()
+        if self.rng.random() < 0.5:
+            path = '/stock/'
+        else:
+            path = f"/stock/{self.rng.choice(session['products'])}"
+
+        headers = dict(session['headers'])
+        etag = session['etags'].get(path)
+        if etag:
+            headers['If-None-Match'] = etag
+        status, response_headers, _ = self.transport.request('GET', path, headers=headers)
+        if response_headers.get('ETag'):
+            session['etags'][path] = response_headers['ETag']
+        return status in (200, 304)
+
+
+class MixedMutations(Scenario):
+    """Stock added and removed one product at a time or through /stock/batch.
+
+    Removals that find too little stock answer 400, which is a normal outcome
+    here and not counted as an error.
+    """
+
+    name = 'mixed_mutations'
+
+    def step(self):
+        session = self.session()
+        draw = self.rng.random()
+        if draw < 0.1:
+            items = [
+                {'product_id': product_id, 'action': self.rng.choice(('add', 'remove')), 'quantity': self.rng.randint(1, 5)}
+                for product_id in self.rng.sample(session['products'], min(5, len(session['products'])))
+            ]
+            status, _, _ = self.transport.request('POST', '/stock/batch', {'items': items}, session['headers'])
+            return status == 200
+
+        operation = 'add' if draw < 0.6 else 'remove'
+        path = f"/stock/{self.rng.choice(session['products'])}/stock/{operation}"
+        status, _, _ = self.transport.request('PATCH', path, {'stock': self.rng.randint(1, 10)}, session['headers'])
+        return status == 200 or (operation == 'remove' and status == 400)
+
+
+class HistoryScans(Scenario):
+    """Paging through the history, per-product history and weekly rollups."""
+
+    name = 'history_scans'
+
+    def step(self):
+        session = self.session()
+        draw = self.rng.random()
+        if draw < 0.5:
+            path = '/stock/history?limit=100'
+            cursor = session.get('history_cursor')
+            if cursor:
+                path += f'&cursor={cursor}'
+            status, _, body = self.transport.request('GET', path, headers=session['headers'])
+            # Walk forward page by page and start over at the end, like a client syncing
+            session['history_cursor'] = body.get('next_cursor') if status == 200 and body else None
+            return status == 200
+
+        if draw < 0.8:
+            path = f"/stock/{self.rng.choice(session['products'])}/history"
+            status, _, _ = self.transport.request('GET', path, headers=session['headers'])
+            return status in (200, 404)
+
+        status, _, _ = self.transport.request('GET', '/stock/history/rollup?bucket=week', headers=session['headers'])
+        return status == 200
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (LoginStorm, PollingReads, MixedMutations, HistoryScans)
+}
@@ -0,0 +1,81 @@
+"""Synthetic users, products and history for benchmarks."""
+import random
+from datetime import datetime, timedelta
+
+from shoptrack.db import execute_many, get_db
+from shoptrack.hashing import get_hasher
+from shoptrack.queries import run_query, statement_sql
+
+DEFAULT_PREFIX = 'bench'
+DEFAULT_PASSWORD = 'benchpass'
+
+
+def bench_usernames(prefix=DEFAULT_PREFIX):
+    """(id, username) of every seeded user whose name starts with ``prefix``."""
+    rows = run_query('users_by_username_prefix', (f'{prefix}%',)).fetchall()
+    return [(row['id'], row['username']) for row in rows if row['username'][len(prefix):].isdigit()]
+
+def _history_rows(rng, product, owner_id, count, now, days):
+    """``count`` buy/sell rows for one product, oldest first, and the stock they leave.
+
+    Sells never take more than is on hand, so the product's stock always
+    matches its history.
+    """
+    stamps = sorted(now - timedelta(seconds=rng.randrange(days * 86400)) for _ in range(count))
+    stock = 0
+    rows = []
+    for created in stamps:
+        quantity = rng.randint(1, 20)
+        if stock >= quantity and rng.random() < 0.4:
+            action = 'sell'
+            stock -= quantity
+        else:
+            action = 'buy'
+            stock += quantity
+        rows.append((product['id'], product['name'], owner_id, product['price'], quantity, action, created))
+    return rows, stock
+
+def seed_data(users, products, history, prefix=DEFAULT_PREFIX, password=DEFAULT_PASSWORD, days=90, seed=None):
+    """Add ``users`` users with ``products`` products each and ``history`` history rows per product.
+
+    Usernames continue after the ones already seeded with ``prefix``, so
+    seeding twice adds more data. All users share ``password``, which is
+    hashed once. Each user's rows are inserted in bulk and committed together.
+    Returns the number of rows added per table.
+    """
+    rng = random.Random(seed)
+    db = get_db()
+    now = datetime.now().replace(microsecond=0)
+
+    start = len(bench_usernames(prefix))
+    pwhash = get_hasher().hash(password)
+    usernames = [f'{prefix}{start + index + 1}' for index in range(users)]
+    execute_many(statement_sql('insert_user'), [(username, pwhash) for username in usernames])
+    db.commit()
+
+    created = set(usernames)
+    user_ids = [user_id for user_id, username in bench_usernames(prefix) if username in created]
+
+    counts = {'users': len(user_ids), 'products': 0, 'history': 0}
+    for user_id in user_ids:
+        # Products start empty; their stock is set to what the generated history leaves
+        execute_many(statement_sql('insert_product'), [
+            (f'Bench product {index + 1}', 0, round(rng.uniform(1, 500), 2), f'Synthetic product of {prefix}', user_id)
+            for index in range(products)
+        ])
+        product_rows = run_query('products_by_owner', (user_id,)).fetchall()
+
+        history_rows = []
+        stock_rows = []
+        for product in product_rows:
+            rows, stock = _history_rows(rng, product, user_id, history, now, days)
+            history_rows.extend(rows)
+            stock_rows.append((stock, product['id'], user_id))
+
+        execute_many(statement_sql('insert_history_at'), history_rows)
+        execute_many(statement_sql('set_product_stock'), stock_rows)
+        db.commit()
+
+        counts['products'] += len(product_rows)
+        counts['history'] += len(history_rows)
+    return counts
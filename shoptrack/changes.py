@@ -0,0 +1,128 @@
+"""Delta sync: the products changed and deleted since a client's last sync.
+
+A sync token wraps the owner's inventory version (see the 0006 and 0009
+migrations). Every product write records its version in product_change,
+so the changes between two tokens are found through an index on
+``(owner_id, version)`` and cost O(changes), whatever the catalog size.
+
+The versions are kept in a side table rather than in a column on product
+because a deleted product must still be reported: its row in
+product_change becomes a tombstone, which a column on the deleted row
+could not hold. Triggers maintain it, so no write path has to.
+"""
+import base64
+import binascii
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from shoptrack.db import get_db, get_placeholder, execute_query, begin_write
+from shoptrack.queries import run_query
+from shoptrack.serialize import RowSet
+
+
+def encode_token(version):
+    return base64.urlsafe_b64encode(f'v{version}'.encode()).decode().rstrip('=')
+
+def decode_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        text = base64.urlsafe_b64decode(padded.encode()).decode()
+        if not text.startswith('v'):
+            raise ValueError
+        version = int(text[1:])
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid sync token')
+    if version < 0:
+        raise ValueError('Invalid sync token')
+    return version
+
+def validate_changes_args(args):
+    """Parse the ``since`` query parameter; returns ``(True, version or None)`` or ``(False, message)``."""
+    if not args.get('since'):
+        return True, None
+    try:
+        return True, decode_token(args['since'])
+    except ValueError as e:
+        return False, str(e)
+
+def sync_plan(version, pruned, since):
+    """The response for a sync from ``since`` before its changes are filled in,
+    and the version to read changes after, or None when nothing changed.
+
+    ``version`` and ``pruned`` are the owner's current inventory version and
+    the newest version whose tombstones were pruned.
+    """
+    response = {'reset': False, 'upserts': RowSet([]), 'deletions': [], 'token': encode_token(version)}
+    if since is None or since < pruned or since > version:
+        response['reset'] = True
+        return response, -1
+    if since == version:
+        # Nothing changed: the common case for a client polling an idle catalog
+        return response, None
+    return response, since
+
+def get_changes(owner_id, since=None):
+    """Products written and ids deleted after version ``since``, plus the token to sync from next.
+
+    Without ``since``, or when the token is older than the tombstones kept
+    (see prune_tombstones) or from before a database reset, every product
+    is returned with ``reset`` set and the client replaces its copy.
+    """
+    row = run_query('sync_versions', (owner_id,)).fetchone()
+    version, pruned = (row['version'], row['pruned']) if row else (0, 0)
+    response, since = sync_plan(version, pruned, since)
+    if since is None:
+        return response
+
+    # Only versions up to the one read above: changes committed meanwhile
+    # are left to the next sync, whose token would otherwise skip them
+    response['upserts'] = RowSet.from_cursor(run_query('changed_products', (owner_id, since, version)))
+    if not response['reset']:
+        cursor = run_query('deleted_products', (owner_id, since, version))
+        response['deletions'] = [row['product_id'] for row in cursor.fetchall()]
+    return response
+
+def prune_tombstones(days, now=None):
+    """Forget products deleted more than ``days`` days ago.
+
+    Clients holding a token from before a pruned deletion get a full
+    resync instead of its tombstone. Returns the number of tombstones
+    removed and the elapsed time in seconds.
+    """
+    started = time.monotonic()
+    cutoff = (now or datetime.now()) - timedelta(days=days)
+    placeholder = get_placeholder()
+
+    begin_write()
+    execute_query(f'''
+        INSERT INTO product_change_pruned (owner_id, version)
+        SELECT owner_id, MAX(version) FROM product_change
+        WHERE deleted < {placeholder}
+        GROUP BY owner_id
+        ON CONFLICT (owner_id) DO UPDATE SET version = CASE
+            WHEN excluded.version > product_change_pruned.version THEN excluded.version
+            ELSE product_change_pruned.version
+        END
+    ''', (cutoff,))
+    removed = execute_query(
+        f'DELETE FROM product_change WHERE deleted < {placeholder}', (cutoff,)
+    ).rowcount
+    get_db().commit()
+    return {'removed': removed, 'elapsed': time.monotonic() - started}
+
+
+changes_cli = AppGroup('changes', help='Manage the product change log used by delta sync.')
+
+@changes_cli.command('prune')
+@click.option('--days', type=int, default=None, help='Keep tombstones of products deleted within this many days.')
+def prune_command(days):
+    """Delete old tombstones of deleted products."""
+    result = prune_tombstones(current_app.config['TOMBSTONE_RETENTION_DAYS'] if days is None else days)
+    click.echo(f"Removed {result['removed']} tombstones in {result['elapsed'] * 1000:.1f} ms.")
+
+def init_app(app):
+    app.cli.add_command(changes_cli)
@@ -1,19 +1,86 @@
 import os
+import secrets
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
 import click
 from flask import current_app, g
 
+from shoptrack.metrics import record_query
+from shoptrack.pool import ConnectionPool
+
 # Add PostgreSQL support
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import RealDictCursor, execute_batch
     POSTGRESQL_AVAILABLE = True
 
 except ImportError as e:
     POSTGRESQL_AVAILABLE = False
 
+# One pool per worker process; see get_pool()
+_pool = None
+_pool_pid = None
+# Opening a pool connects DB_POOL_MIN times; concurrent first requests share one
+_pool_lock = threading.Lock()
+# Pools (and SQLite connections) inherited across fork() are parked here instead
+# of being closed or garbage collected, because closing them would terminate the
+# parent's sessions.
+_abandoned_pools = []
+
+
+def _forget_pool_after_fork():
+    global _pool, _pool_pid, _pool_lock
+    if _pool is not None:
+        _abandoned_pools.append(_pool)
+    _pool = None
+    _pool_pid = None
+    # Another thread of the parent may have held it across the fork
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+SQLITE_PROFILES = ('default', 'production')
+
+# Long-lived SQLite connections of the 'production' profile, one per thread
+# and database file; see _get_sqlite_connection()
+_sqlite_local = threading.local()
+
+
+def get_pool():
+    """Return this process's PostgreSQL connection pool, creating it on first use."""
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid != os.getpid():
+        _forget_pool_after_fork()
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                database_url = os.environ.get('DATABASE_URL')
+                config = current_app.config
+                _pool = ConnectionPool(
+                    lambda: psycopg2.connect(database_url, cursor_factory=RealDictCursor),
+                    minconn=config['DB_POOL_MIN'],
+                    maxconn=config['DB_POOL_MAX'],
+                    timeout=config['DB_POOL_TIMEOUT'],
+                    max_idle=config['DB_POOL_MAX_IDLE'],
+                    max_lifetime=config['DB_POOL_MAX_LIFETIME'],
+                    check_interval=config['DB_POOL_CHECK_INTERVAL'],
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def pool_stats():
+    """Connection pool counters for this worker, or None when no pool is in use."""
+    if _pool is None or _pool_pid != os.getpid():
+        return None
+    stats = _pool.stats()
+    stats['pid'] = _pool_pid
+    return stats
+
 
 def get_db():
     if 'db' not in g:
@@ -24,56 +91,154 @@ def get_db():
         
         try:
             if database_url and POSTGRESQL_AVAILABLE:
-                # PostgreSQL connection
-                g.db = psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+                # PostgreSQL connection borrowed from the worker's pool
+                g.db = get_pool().getconn()
                 g.is_postgresql = True
             else:
-                # SQLite connection (development)
-                g.db = sqlite3.connect(
-                    current_app.config['DATABASE'],
-                    detect_types=sqlite3.PARSE_DECLTYPES
-                )
-                g.db.row_factory = sqlite3.Row
+                # SQLite connection (development, or small stores with SQLITE_PROFILE=production)
+                g.db = _get_sqlite_connection()
                 g.is_postgresql = False
         except Exception as e:
             raise
     return g.db
 
+def _connect_sqlite(config):
+    db = sqlite3.connect(config['DATABASE'], detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    if config['SQLITE_PROFILE'] == 'production':
+        # WAL lets readers run alongside the single writer; NORMAL sync is
+        # durable across application crashes and only risks the last
+        # commits on power loss.
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute(f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT'])}")
+        db.execute(f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}")
+        db.execute(f"PRAGMA cache_size = {int(config['SQLITE_CACHE_SIZE'])}")
+        db.execute('PRAGMA foreign_keys = ON')
+    return db
+
+def _get_sqlite_connection():
+    """A new connection per request, or this thread's long-lived one in the production profile."""
+    config = current_app.config
+    if config['SQLITE_PROFILE'] != 'production':
+        return _connect_sqlite(config)
+
+    if getattr(_sqlite_local, 'pid', None) != os.getpid():
+        # Connections must not cross fork(); park the parent's like its pool
+        _abandoned_pools.extend(getattr(_sqlite_local, 'connections', {}).values())
+        _sqlite_local.connections = {}
+        _sqlite_local.pid = os.getpid()
+
+    db = _sqlite_local.connections.get(config['DATABASE'])
+    if db is None:
+        db = _sqlite_local.connections[config['DATABASE']] = _connect_sqlite(config)
+    return db
+
+def close_sqlite_connections():
+    """Close the long-lived SQLite connections held by the calling thread."""
+    connections = getattr(_sqlite_local, 'connections', {})
+    if getattr(_sqlite_local, 'pid', None) == os.getpid():
+        for db in connections.values():
+            db.close()
+    else:
+        _abandoned_pools.extend(connections.values())
+    connections.clear()
+
 def execute_query(query, params=None):
     """Execute a query and return results, handling both SQLite and PostgreSQL"""
     db = get_db()
     
+    started = time.perf_counter()
+    try:
+        if getattr(g, 'is_postgresql', False):
+            # PostgreSQL - use cursor
+            cursor = db.cursor()
+            cursor.execute(query, params)
+            return cursor
+        else:
+            # SQLite - execute directly on connection
+            return db.execute(query, params if params is not None else ())
+    finally:
+        record_query(query, time.perf_counter() - started)
+
+def supports_returning():
+    """Whether the active database accepts INSERT/UPDATE ... RETURNING."""
+    get_db()
+    return getattr(g, 'is_postgresql', False) or sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def execute_many(query, params_seq, page_size=500):
+    """Run one statement for every parameter tuple in as few round trips as possible."""
+    db = get_db()
+
+    started = time.perf_counter()
+    try:
+        if getattr(g, 'is_postgresql', False):
+            # psycopg2's executemany() is one round trip per row; execute_batch
+            # sends ``page_size`` statements at a time
+            cursor = db.cursor()
+            execute_batch(cursor, query, params_seq, page_size=page_size)
+            return cursor
+        else:
+            return db.executemany(query, params_seq)
+    finally:
+        record_query(query, time.perf_counter() - started)
+
+def begin_write():
+    """Start the request's transaction and take the write lock up front.
+
+    SQLite otherwise starts a DEFERRED transaction on the first write, which
+    lets another writer change rows between our reads and our writes. On
+    PostgreSQL rows are locked with SELECT ... FOR UPDATE instead.
+    """
+    db = get_db()
+    if not getattr(g, 'is_postgresql', False) and not db.in_transaction:
+        db.execute('BEGIN IMMEDIATE')
+
+def iter_query(query, params=None, name='stream', batch_size=1000):
+    """Yield the rows of a query without materialising the whole result.
+
+    On PostgreSQL this uses a named (server-side) cursor, so only
+    ``batch_size`` rows are held in the worker at a time. SQLite cursors
+    already step through results lazily and are read in batches.
+    """
+    db = get_db()
+
     if getattr(g, 'is_postgresql', False):
-        # PostgreSQL - use cursor
-        cursor = db.cursor()
-        cursor.execute(query, params)
-        return cursor
+        cursor = db.cursor(name=f'{name}_{secrets.token_hex(4)}')
+        cursor.itersize = batch_size
     else:
-        # SQLite - execute directly on connection
-        return db.execute(query, params)
+        cursor = db.cursor()
+
+    try:
+        started = time.perf_counter()
+        cursor.execute(query, params if params is not None else ())
+        record_query(query, time.perf_counter() - started)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
 
 def close_db(e=None):
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
-
-def convert_schema_for_postgresql(sql_script):
-    """Convert SQLite schema to PostgreSQL syntax."""
-    # Replace SQLite-specific syntax with PostgreSQL syntax
-    sql_script = sql_script.replace('INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY')
-    sql_script = sql_script.replace('DEFAULT CURRENT_TIMESTAMP', 'DEFAULT NOW()')
-    sql_script = sql_script.replace('REAL', 'DECIMAL(10,2)')
-    sql_script = sql_script.replace('TEXT', 'VARCHAR(255)')
-    
-    # Quote reserved keywords - 'user' is a reserved keyword in PostgreSQL
-    sql_script = sql_script.replace('DROP TABLE IF EXISTS user', 'DROP TABLE IF EXISTS "user"')
-    sql_script = sql_script.replace('CREATE TABLE user', 'CREATE TABLE "user"')
-    sql_script = sql_script.replace('REFERENCES user', 'REFERENCES "user"')
-    
-    return sql_script
+        if g.pop('is_postgresql', False):
+            # Hand the connection back; the pool rolls back anything left open
+            get_pool().putconn(db)
+        elif current_app.config['SQLITE_PROFILE'] == 'production':
+            # Keep the thread's connection, but never leak a transaction into the next request
+            if db.in_transaction:
+                db.rollback()
+        else:
+            db.close()
 
 def init_db():
+    """Drop every table and rebuild the schema from the migrations."""
+    from shoptrack.migrate import upgrade
+
     db = get_db()
     
     with current_app.open_resource('schema.sql') as f:
@@ -81,32 +246,37 @@ def init_db():
         
         # Check if we're using PostgreSQL
         if getattr(g, 'is_postgresql', False):  # PostgreSQL
-            # Convert schema for PostgreSQL
-            sql_script = convert_schema_for_postgresql(sql_script)
-            # Split SQL statements and execute one by one
-            statements = sql_script.split(';')
             cursor = db.cursor()
-            for statement in statements:
-                statement = statement.strip()
-                if statement:
-                    cursor.execute(statement)
+            cursor.execute(sql_script)
             db.commit()
         else:  # SQLite
             db.executescript(sql_script)
 
+    upgrade()
+
 @click.command('init-db')
 def init_db_command():
     init_db()
     click.echo('Initialized the database.')
 
+def get_dialect():
+    """'postgresql' or 'sqlite', for the connection get_db() actually opened."""
+    get_db()
+    return 'postgresql' if g.is_postgresql else 'sqlite'
+
 def get_placeholder():
     """Get the correct placeholder for the current database."""
-    database_url = os.environ.get('DATABASE_URL')
-    return '%s' if database_url and POSTGRESQL_AVAILABLE else '?'
+    return '%s' if get_dialect() == 'postgresql' else '?'
 
 def init_app(app):
+    if app.config['SQLITE_PROFILE'] not in SQLITE_PROFILES:
+        raise ValueError(f"SQLITE_PROFILE must be one of: {', '.join(SQLITE_PROFILES)}")
+
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+
+    from shoptrack import migrate
+    migrate.init_app(app)
     
     # Register SQLite timestamp converter only if using SQLite
     if not os.environ.get('DATABASE_URL'):
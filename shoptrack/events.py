@@ -0,0 +1,360 @@
+"""Live stock events for GET /stock/events (Server-Sent Events).
+
+Product creates, updates and deletes and stock adds and removes record an
+event inside their transaction, and subscribers receive it once that
+transaction commits. An event's id is the owner's inventory version after
+the write (see the 0006 migrations), so ids only grow, and every event
+also carries the version it follows. When a subscriber would skip over
+changes, because events were dropped or because it resumes with a
+Last-Event-ID this worker can no longer replay, it is sent a ``reset``
+event first and should reload GET /stock/.
+
+On PostgreSQL events go out with NOTIFY, which the database delivers at
+commit, and each worker LISTENs on one connection, so writes from any
+worker reach every subscriber. On SQLite they are handed to the worker's
+in-process broadcaster right after the commit, so subscribers only see
+writes of their own process: serve SQLite with a single threaded worker.
+"""
+import asyncio
+import os
+import select
+import threading
+import time
+from collections import deque
+
+from flask import current_app, g
+
+from shoptrack.db import get_db
+from shoptrack.etag import get_inventory_version
+from shoptrack.queries import run_query
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+CHANNEL = 'stock_events'
+# NOTIFY payloads must stay under 8000 bytes; bigger events only carry the product id
+MAX_DATA_BYTES = 7000
+# Milliseconds EventSource clients wait before reconnecting
+RETRY_MS = 3000
+# Seconds the LISTEN thread waits for a notification before polling again
+LISTEN_POLL_INTERVAL = 30
+
+
+class Event:
+    """One change to an owner's products, with ``data`` already encoded as JSON."""
+
+    __slots__ = ('owner_id', 'id', 'previous', 'type', 'data')
+
+    def __init__(self, owner_id, id, previous, type, data):
+        self.owner_id = owner_id
+        self.id = id
+        self.previous = previous
+        self.type = type
+        self.data = data
+
+    @classmethod
+    def reset(cls, owner_id, id):
+        return cls(owner_id, id, None, 'reset', '{}')
+
+    def encode(self):
+        """NOTIFY payload: ``owner id previous type data``."""
+        previous = '-' if self.previous is None else self.previous
+        return f'{self.owner_id} {self.id} {previous} {self.type} {self.data}'
+
+    @classmethod
+    def decode(cls, payload):
+        owner_id, id, previous, type, data = payload.split(' ', 4)
+        return cls(int(owner_id), int(id), None if previous == '-' else int(previous), type, data)
+
+    def format(self):
+        """The event as a Server-Sent Events message."""
+        return f'id: {self.id}\nevent: {self.type}\ndata: {self.data}\n\n'
+
+
+def product_change(event_type, product_id, data):
+    """``product.created`` or ``product.updated`` from a validated product body."""
+    return event_type, {
+        'id': product_id,
+        'name': data['name'],
+        'stock': data['stock'],
+        'price': data['price'],
+        'description': data.get('description'),
+    }
+
+def stock_change(product_id, product, quantity):
+    """``stock.added`` or ``stock.removed`` for a signed ``quantity``; ``product`` is the updated row."""
+    return 'stock.added' if quantity >= 0 else 'stock.removed', {
+        'id': product_id,
+        'name': product['name'],
+        'price': product['price'],
+        'stock': product['stock'],
+        'quantity': abs(quantity),
+    }
+
+def build_events(owner_id, version, changes, dumps):
+    """Events for ``changes``, ``(type, data)`` per product row in the order a
+    transaction wrote them, given the inventory version it left behind."""
+    events = []
+    first = version - len(changes) + 1
+    for offset, (event_type, data) in enumerate(changes):
+        encoded = dumps(data, separators=(',', ':'))
+        if len(encoded.encode()) > MAX_DATA_BYTES:
+            encoded = dumps({'id': data['id']}, separators=(',', ':'))
+        events.append(Event(owner_id, first + offset, first + offset - 1, event_type, encoded))
+    return events
+
+
+class EventStream:
+    """Renders one subscriber's events as SSE text, resuming after ``last_id``.
+
+    Events the subscriber already has are skipped. An event that does not
+    follow the last one sent is preceded by a ``reset``, so the client knows
+    to reload the products it may have missed.
+    """
+
+    def __init__(self, owner_id, last_id=None):
+        self.owner_id = owner_id
+        self.last_id = last_id
+
+    def start(self, replay, version):
+        """Render what a resuming client missed: the ``replay`` events from the
+        broadcaster, checked against ``version``, the inventory version read
+        before subscribing."""
+        if self.last_id is not None and not replay and version != self.last_id:
+            # Nothing to replay from this worker, so start over from the current version
+            self.last_id = None
+            replay = [Event.reset(self.owner_id, version)]
+        return f'retry: {RETRY_MS}\n\n' + self.render(replay)
+
+    def render(self, events):
+        chunks = []
+        for event in events:
+            if self.last_id is not None and event.id <= self.last_id:
+                continue
+            if self.last_id is not None and event.previous is not None and event.previous != self.last_id:
+                chunks.append(Event.reset(self.owner_id, event.previous).format())
+            chunks.append(event.format())
+            self.last_id = event.id
+        return ''.join(chunks)
+
+
+class _Subscription:
+    """Events waiting to be written to one subscriber's stream."""
+
+    def __init__(self, owner_id, max_queue):
+        self.owner_id = owner_id
+        self.max_queue = max_queue
+        self._events = deque()
+
+    def _push(self, event):
+        if len(self._events) >= self.max_queue:
+            # The client is not keeping up; have it reload instead of
+            # buffering without bound
+            self._events.clear()
+            event = Event.reset(event.owner_id, event.id)
+        self._events.append(event)
+
+    def _drain(self):
+        events = list(self._events)
+        self._events.clear()
+        return events
+
+
+class Subscription(_Subscription):
+    """A subscriber served from a worker thread."""
+
+    def __init__(self, owner_id, max_queue):
+        super().__init__(owner_id, max_queue)
+        self._ready = threading.Condition()
+
+    def deliver(self, event):
+        with self._ready:
+            self._push(event)
+            self._ready.notify()
+
+    def get(self, timeout):
+        """Wait up to ``timeout`` seconds for events; returns a possibly empty list."""
+        with self._ready:
+            if not self._events:
+                self._ready.wait(timeout)
+            return self._drain()
+
+
+class AsyncSubscription(_Subscription):
+    """A subscriber served from an event loop; deliver() must be called on that loop."""
+
+    def __init__(self, owner_id, max_queue):
+        super().__init__(owner_id, max_queue)
+        self._ready = asyncio.Event()
+
+    def deliver(self, event):
+        self._push(event)
+        self._ready.set()
+
+    async def get(self, timeout):
+        if not self._events:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._ready.clear()
+        return self._drain()
+
+
+class Broadcaster:
+    """Fans events out to this worker's subscribers.
+
+    The last ``backlog`` events, across all owners, are kept so a client that
+    reconnects with Last-Event-ID gets what it missed.
+    """
+
+    def __init__(self, backlog):
+        self._recent = deque(maxlen=backlog)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            self._recent.append(event)
+            for subscription in self._subscribers.get(event.owner_id, ()):
+                subscription.deliver(event)
+
+    def subscribe(self, subscription, last_id=None):
+        """Start delivering to ``subscription``; returns the recent events after ``last_id``.
+
+        Nothing published concurrently is lost or delivered twice: each event
+        is either among those returned or delivered afterwards.
+        """
+        with self._lock:
+            self._subscribers.setdefault(subscription.owner_id, set()).add(subscription)
+            if last_id is None:
+                return []
+            return [e for e in self._recent if e.owner_id == subscription.owner_id and e.id > last_id]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.owner_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.owner_id]
+
+    def forget(self):
+        """Drop the recent events, for when some may have been missed."""
+        with self._lock:
+            self._recent.clear()
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+def _listen_connection(database_url):
+    conn = psycopg2.connect(database_url)
+    conn.autocommit = True
+    conn.cursor().execute(f'LISTEN {CHANNEL}')
+    return conn
+
+
+class EventHub:
+    """This worker's broadcaster and, on PostgreSQL, the LISTEN thread feeding it."""
+
+    def __init__(self, backlog, max_queue, logger):
+        self.broadcaster = Broadcaster(backlog)
+        self.max_queue = max_queue
+        self.logger = logger
+        # Orders SQLite commits with publishing; see commit_and_publish()
+        self.commit_lock = threading.Lock()
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def listen(self, database_url):
+        """Start LISTENing in this worker unless it already is.
+
+        The first connection is made by the caller, so a subscriber is only
+        accepted once notifications are actually being received.
+        """
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            conn = _listen_connection(database_url)
+            threading.Thread(
+                target=self._listen, args=(database_url, conn), name='shoptrack-events', daemon=True
+            ).start()
+            self._listener_pid = os.getpid()
+
+    def _listen(self, database_url, conn):
+        while True:
+            try:
+                if conn is None:
+                    conn = _listen_connection(database_url)
+                    # Notifications sent while disconnected are gone
+                    self.broadcaster.forget()
+                if select.select([conn], [], [], LISTEN_POLL_INTERVAL) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self.broadcaster.publish(Event.decode(conn.notifies.pop(0).payload))
+            except psycopg2.Error as e:
+                self.logger.warning(f'Stock event listener disconnected: {e}')
+                if conn is not None:
+                    conn.close()
+                conn = None
+                time.sleep(1)
+
+
+def get_hub():
+    return current_app.extensions['stock_events']
+
+def _stage(events):
+    if getattr(g, 'is_postgresql', False):
+        # Delivered by the database to every LISTENing worker when the transaction commits
+        run_query('notify_stock_events', ([event.encode() for event in events],))
+    else:
+        g.setdefault('stock_events', []).extend(events)
+
+def record_events(owner_id, changes):
+    """Record ``(type, data)`` for each product row the open transaction wrote, in order.
+
+    Call it after the writes, then commit with commit_and_publish().
+    """
+    version = get_inventory_version(owner_id)
+    _stage(build_events(owner_id, version, changes, current_app.json.dumps))
+
+def record_reset(owner_id):
+    """Tell ``owner_id``'s subscribers to reload, after writes too many to send one by one."""
+    _stage([Event.reset(owner_id, get_inventory_version(owner_id))])
+
+def staged_event_count():
+    return len(g.get('stock_events', ()))
+
+def discard_staged_events(count):
+    """Drop the events staged after the first ``count``, for writes rolled back to a savepoint.
+
+    On PostgreSQL their NOTIFYs are rolled back with the savepoint.
+    """
+    if 'stock_events' in g:
+        del g.stock_events[count:]
+
+def commit_and_publish():
+    """Commit the request's transaction and publish the events it recorded."""
+    db = get_db()
+    events = g.pop('stock_events', None)
+    if not events:
+        db.commit()
+        return
+
+    hub = get_hub()
+    # The next SQLite writer can only commit once these events are out, so
+    # subscribers get them in commit order
+    with hub.commit_lock:
+        db.commit()
+        for event in events:
+            hub.broadcaster.publish(event)
+
+def init_app(app):
+    app.extensions['stock_events'] = EventHub(
+        app.config['EVENTS_BACKLOG'], app.config['EVENTS_QUEUE_SIZE'], app.logger
+    )
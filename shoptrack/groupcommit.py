@@ -0,0 +1,169 @@
+"""Group commit: stock writes of concurrent requests share one transaction.
+
+With ``GROUP_COMMIT`` on, product creates and stock adds and removes are
+not committed by the request thread. They are queued to a single writer
+thread per worker, which applies everything queued within
+``GROUP_COMMIT_WINDOW_MS`` (at most ``GROUP_COMMIT_MAX_OPS`` writes) in one
+transaction and commits once, so a burst of sales costs one fsync and one
+SQLite write lock instead of one each. Each write runs in its own
+SAVEPOINT: one that fails is rolled back alone and its request gets the
+same error as without group commit, and no request is answered before
+the commit that makes its write durable.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app, g
+
+from shoptrack.db import get_db, execute_query, begin_write, close_db
+from shoptrack.events import commit_and_publish, staged_event_count, discard_staged_events
+
+
+class _Write:
+    __slots__ = ('user_id', 'fn', 'args', 'future')
+
+    def __init__(self, user_id, fn, args):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+
+
+class GroupCommitter:
+    """Queues writes to this worker's writer thread and waits for their commit.
+
+    A write is a function returning ``(True, result)`` to keep its changes
+    or ``(False, message)`` to roll them back, like the validators; it runs
+    with ``g.user_id`` set to the submitting user.
+    """
+
+    def __init__(self, app, window_ms=2, max_ops=64):
+        self.app = app
+        self.window = window_ms / 1000
+        self.max_ops = max(max_ops, 1)
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._groups = 0
+        self._writes = 0
+
+    def submit(self, user_id, fn, *args):
+        """Run ``fn(*args)`` in the next group; returns its result once committed.
+
+        Exceptions raised by ``fn``, or by the commit, are re-raised here.
+        """
+        self._ensure_writer()
+        write = _Write(user_id, fn, args)
+        self._queue.put(write)
+        return write.future.result()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'groups': self._groups,
+                'writes': self._writes,
+                'queued': self._queue.qsize(),
+            }
+
+    def _ensure_writer(self):
+        with self._lock:
+            # A writer inherited through fork() does not run in this worker
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='shoptrack-group-commit', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _collect(self):
+        writes = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(writes) < self.max_ops:
+            try:
+                writes.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return writes
+
+    def _run(self):
+        while True:
+            writes = self._collect()
+            try:
+                with self.app.app_context():
+                    results = self._apply(writes)
+            except Exception as e:
+                self.app.logger.error(f'Group commit of {len(writes)} writes failed: {e}')
+                for write in writes:
+                    if not write.future.done():
+                        write.future.set_exception(e)
+                continue
+
+            with self._lock:
+                self._groups += 1
+                self._writes += len(writes)
+            for write, (ok, outcome) in zip(writes, results):
+                if ok:
+                    write.future.set_result(outcome)
+                else:
+                    write.future.set_exception(outcome)
+
+    def _apply(self, writes):
+        """Run ``writes`` in one transaction; returns ``(True, result)`` or
+        ``(False, exception)`` for each, in order."""
+        results = []
+        begin_write()
+        try:
+            for write in writes:
+                g.user_id = write.user_id
+                staged = staged_event_count()
+                execute_query('SAVEPOINT group_write')
+                try:
+                    result = write.fn(*write.args)
+                    outcome = (True, result)
+                    keep = result[0]
+                except Exception as e:
+                    outcome = (False, e)
+                    keep = False
+                if not keep:
+                    execute_query('ROLLBACK TO SAVEPOINT group_write')
+                    discard_staged_events(staged)
+                execute_query('RELEASE SAVEPOINT group_write')
+                results.append(outcome)
+            commit_and_publish()
+        except Exception:
+            get_db().rollback()
+            raise
+        return results
+
+
+def get_group_committer():
+    return current_app.extensions['group_commit']
+
+def run_write(fn, *args):
+    """Apply ``fn(*args)`` for the current user and commit it.
+
+    ``fn`` returns ``(True, result)`` or ``(False, message)``; on failure,
+    or when it raises, its changes are rolled back. With GROUP_COMMIT the
+    write joins the worker's next group, otherwise it commits on its own.
+    """
+    if current_app.config['GROUP_COMMIT']:
+        # The writer borrows a connection from the same pool; waiting on it
+        # while holding ours could exhaust the pool
+        close_db()
+        return get_group_committer().submit(g.user_id, fn, *args)
+
+    try:
+        result = fn(*args)
+    except Exception:
+        get_db().rollback()
+        raise
+    if result[0]:
+        commit_and_publish()
+    else:
+        get_db().rollback()
+    return result
+
+def init_app(app):
+    app.extensions['group_commit'] = GroupCommitter(
+        app, app.config['GROUP_COMMIT_WINDOW_MS'], app.config['GROUP_COMMIT_MAX_OPS']
+    )
@@ -0,0 +1,98 @@
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be shed."""
+
+
+@functools.lru_cache(maxsize=None)
+def _method_prefix(method):
+    # Werkzeug fills in default parameters (e.g. 'scrypt' -> 'scrypt:32768:8:1'),
+    # so derive the stored prefix from a real hash instead of guessing it.
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+class PasswordHasher:
+    """Runs password hashing on a bounded process pool owned by this worker.
+
+    At most ``workers`` hashes run at once and at most ``max_queue`` more
+    wait for a free process; anything beyond that raises HashingBusy right
+    away instead of tying up the request. With ``workers`` set to 0 hashing
+    runs inline in the request thread.
+    """
+
+    def __init__(self, method='scrypt', salt_length=16, workers=0, max_queue=8, timeout=10.0):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._slots = threading.BoundedSemaphore(max(workers + max_queue, 1))
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """Whether ``pwhash`` was made with different parameters than the configured ones."""
+        # Stored as 'method$salt$hash'; the method prefix does not include the salt length
+        parts = pwhash.split('$', 2)
+        if len(parts) != 3:
+            return True
+        return parts[0] != _method_prefix(self.method) or len(parts[1]) != self.salt_length
+
+    def _get_executor(self):
+        with self._lock:
+            # A pool inherited through fork() has no live processes in this worker
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('Password hashing pool is saturated')
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy(f'Password hashing took longer than {self.timeout}s')
+
+
+def get_hasher():
+    return current_app.extensions['password_hasher']
+
+def init_app(app):
+    config = app.config
+    app.extensions['password_hasher'] = PasswordHasher(
+        method=config['PASSWORD_HASH_METHOD'],
+        salt_length=config['PASSWORD_SALT_LENGTH'],
+        workers=config['HASH_POOL_WORKERS'],
+        max_queue=config['HASH_POOL_MAX_QUEUE'],
+        timeout=config['HASH_POOL_TIMEOUT'],
+    )
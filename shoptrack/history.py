@@ -0,0 +1,71 @@
+from datetime import datetime, time, timedelta
+
+from shoptrack.pagination import paginate_query
+from shoptrack.queries import OWNED_PRODUCT_HISTORY
+from shoptrack.rollup import parse_date_arg
+
+HISTORY_ACTIONS = ('buy', 'sell')
+
+
+def validate_history_args(args):
+    """Parse ``from``, ``to``, ``action`` and ``product_id`` query parameters.
+
+    Returns ``(True, filters)`` or ``(False, message)``. ``from`` and ``to``
+    are inclusive dates and every filter may be omitted.
+    """
+    try:
+        start = parse_date_arg(args['from'], 'from') if args.get('from') else None
+        end = parse_date_arg(args['to'], 'to') if args.get('to') else None
+    except ValueError as e:
+        return False, str(e)
+
+    if start and end and start > end:
+        return False, "from must not be after to"
+
+    action = args.get('action') or None
+    if action is not None and action not in HISTORY_ACTIONS:
+        return False, f"Action must be one of: {', '.join(HISTORY_ACTIONS)}"
+
+    product_id = args.get('product_id')
+    if product_id is not None:
+        try:
+            product_id = int(product_id)
+        except ValueError:
+            return False, "product_id must be an integer"
+
+    return True, {'start': start, 'end': end, 'action': action, 'product_id': product_id}
+
+def has_filters(filters):
+    return any(value is not None for value in filters.values())
+
+def history_query(user_id, filters, page=None, product_id=None, placeholder='?'):
+    """SQL and parameters for the user's history, newest first.
+
+    With ``product_id`` the query is shoptrack.queries.OWNED_PRODUCT_HISTORY;
+    see there for how to tell an unknown product from one without history.
+    Every filter is an equality or range on the leading columns of one of
+    the history indexes, so the database reads only the matching rows.
+    """
+    if product_id is None:
+        query = f'SELECT * FROM history WHERE user_id = {placeholder}'
+        params = [user_id]
+    else:
+        query = OWNED_PRODUCT_HISTORY.replace('?', placeholder)
+        params = [product_id, user_id, user_id]
+
+    if filters['product_id'] is not None and product_id is None:
+        query += f' AND product_id = {placeholder}'
+        params.append(filters['product_id'])
+    if filters['action'] is not None:
+        query += f' AND action = {placeholder}'
+        params.append(filters['action'])
+    if filters['start'] is not None:
+        query += f' AND created >= {placeholder}'
+        params.append(datetime.combine(filters['start'], time.min))
+    if filters['end'] is not None:
+        query += f' AND created < {placeholder}'
+        params.append(datetime.combine(filters['end'] + timedelta(days=1), time.min))
+
+    if page is not None:
+        return paginate_query(query, params, page, placeholder)
+    return query + ' ORDER BY created DESC, id DESC', tuple(params)
@@ -0,0 +1,205 @@
+"""Bulk product import from CSV or NDJSON.
+
+Rows are validated one at a time with validate_product_data() and inserted
+in batches of IMPORT_BATCH_SIZE. Every product with stock gets its initial
+'buy' history row, written for the whole batch by one INSERT ... SELECT.
+A row that fails validation is reported with its row number and skipped.
+It does not stop the import.
+"""
+import csv
+import io
+import json
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from shoptrack.db import get_db, get_dialect, execute_many, begin_write
+from shoptrack.events import record_reset, commit_and_publish
+from shoptrack.queries import run_query, statement_sql
+from shoptrack.validation import validate_product_data
+
+IMPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+IMPORT_COLUMNS = ('name', 'stock', 'price', 'description')
+# Row errors listed in the response; later ones are only counted
+IMPORT_MAX_ERRORS = 1000
+
+
+def import_format(mimetype, requested=None):
+    """The import format named by ``requested`` or implied by the body's mimetype, or None."""
+    if requested:
+        return requested if requested in IMPORT_FORMATS else None
+    for name, format_mimetype in IMPORT_FORMATS.items():
+        if mimetype == format_mimetype:
+            return name
+    return None
+
+def _csv_product(row):
+    """Convert the text fields of a CSV row to the types validate_product_data() expects."""
+    data = {column: row[column] for column in IMPORT_COLUMNS if row.get(column) is not None}
+    if 'stock' in data:
+        try:
+            data['stock'] = int(data['stock'])
+        except ValueError:
+            return False, "Stock must be a non-negative integer"
+    if 'price' in data:
+        try:
+            data['price'] = float(data['price'])
+        except ValueError:
+            return False, "Price must be a positive number"
+    if data.get('description') == '':
+        data['description'] = None
+    return True, data
+
+def parse_rows(stream, import_format):
+    """Yield ``(row_number, ok, product_or_error)`` for each row of a binary stream.
+
+    Rows are numbered from 1, not counting the CSV header or blank NDJSON lines.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='' if import_format == 'csv' else None)
+    try:
+        if import_format == 'csv':
+            for number, row in enumerate(csv.DictReader(text), start=1):
+                yield (number, *_csv_product(row))
+            return
+
+        number = 0
+        for line in text:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                data = json.loads(line)
+            except ValueError:
+                yield number, False, "Invalid JSON format"
+                continue
+            if not isinstance(data, dict):
+                yield number, False, "Row must be a JSON object"
+                continue
+            yield number, True, data
+    except UnicodeDecodeError:
+        yield None, False, "Body must be UTF-8 encoded"
+    finally:
+        text.detach()
+
+def import_columns(products, owner_id):
+    """Parameters of the ``import_products`` statement: one list per product column."""
+    return (
+        [product['name'] for product in products],
+        [product['stock'] for product in products],
+        [product['price'] for product in products],
+        [product.get('description') for product in products],
+        [owner_id] * len(products),
+    )
+
+def _insert_batch(products, owner_id):
+    """Insert one batch of validated products and their initial 'buy' history."""
+    if get_dialect() == 'postgresql':
+        # One INSERT for the whole batch; history is then filled from the rows it returned
+        cursor = run_query('import_products', import_columns(products, owner_id))
+        product_ids = [row['id'] for row in cursor.fetchall()]
+        run_query('import_history_by_ids', (product_ids,))
+        return
+
+    params = [
+        (product['name'], product['stock'], product['price'], product.get('description'), owner_id)
+        for product in products
+    ]
+
+    # The write lock is held from here to the commit, so every product id
+    # above the current maximum belongs to this batch
+    begin_write()
+    last_id = run_query('max_product_id').fetchone()['id']
+    execute_many(statement_sql('insert_product'), params)
+    run_query('import_history_after_id', (owner_id, last_id))
+
+def import_batches(rows, batch_size, result):
+    """Validate the rows yielded by parse_rows() and yield them in batches of valid products.
+
+    Each batch is a list of ``(row_number, product)``. Invalid rows are
+    counted in ``result``, a dict made by new_import_result().
+    """
+    batch = []
+    for number, is_valid, data in rows:
+        if is_valid:
+            is_valid, error = validate_product_data(data)
+        else:
+            error = data
+        if not is_valid:
+            import_failed(result, number, error)
+            continue
+
+        batch.append((number, data))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def new_import_result():
+    return {'imported': 0, 'failed': 0, 'errors': []}
+
+def import_failed(result, number, error):
+    result['failed'] += 1
+    if len(result['errors']) < IMPORT_MAX_ERRORS:
+        result['errors'].append({'row': number, 'error': error})
+
+def import_products(rows, owner_id, batch_size):
+    """Validate and insert the products yielded by parse_rows(), committing each batch.
+
+    Returns ``{'imported', 'failed', 'errors'}``; ``errors`` lists the first
+    IMPORT_MAX_ERRORS bad rows as ``{'row', 'error'}``.
+    """
+    db = get_db()
+    result = new_import_result()
+
+    for batch in import_batches(rows, batch_size, result):
+        try:
+            _insert_batch([product for _, product in batch], owner_id)
+            db.commit()
+            result['imported'] += len(batch)
+        except Exception as e:
+            db.rollback()
+            current_app.logger.error(f'Product import batch failed: {e}')
+            for number, _ in batch:
+                import_failed(result, number, "Failed to import product")
+
+    if result['imported']:
+        # Too many products to stream as events; live subscribers reload instead
+        record_reset(owner_id)
+        commit_and_publish()
+    return result
+
+
+products_cli = AppGroup('products', help='Manage products.')
+
+@products_cli.command('import')
+@click.argument('file', type=click.File('rb'))
+@click.option('--username', required=True, help='Owner of the imported products.')
+@click.option('--format', 'file_format', type=click.Choice(list(IMPORT_FORMATS)), default=None,
+              help='Defaults to the file extension.')
+@click.option('--batch-size', type=int, default=None, help='Products inserted per transaction.')
+def import_command(file, username, file_format, batch_size):
+    """Import products from a CSV or NDJSON file."""
+    if file_format is None:
+        file_format = import_format(None, file.name.rsplit('.', 1)[-1].lower())
+        if file_format is None:
+            raise click.BadParameter('cannot tell the format from the file name', param_hint='--format')
+
+    user = run_query('user_by_username', (username,)).fetchone()
+    if user is None:
+        raise click.ClickException(f'No user named {username}.')
+
+    result = import_products(
+        parse_rows(file, file_format), user['id'], batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    )
+    for error in result['errors']:
+        click.echo(f"Row {error['row']}: {error['error']}", err=True)
+    click.echo(f"Imported {result['imported']} products, {result['failed']} rows failed.")
+
+def init_app(app):
+    app.cli.add_command(products_cli)
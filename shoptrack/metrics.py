@@ -0,0 +1,356 @@
+"""Query and request metrics in Prometheus text format.
+
+Every worker keeps its own counters in memory. When METRICS_DIR is set,
+each worker also writes a snapshot to ``METRICS_DIR/metrics-<pid>.json``,
+at most once per METRICS_FLUSH_INTERVAL seconds. /metrics merges all the
+snapshots, so whichever gunicorn worker answers it reports totals for the
+whole server.
+
+Counters must never go backwards while the server runs, so the counts of
+a worker that exits are folded into ``metrics-exited.json`` and its own
+file is removed; a later worker that reuses the PID starts a file of its
+own. gunicorn.conf.py does this in the ``child_exit`` hook, and empties
+the directory in ``on_starting`` so a restarted server starts from zero.
+"""
+import functools
+import hmac
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from flask import current_app, g, jsonify, request
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'shoptrack_db_query_duration_seconds': (
+        'histogram', 'Time spent executing each SQL statement.', LATENCY_BUCKETS
+    ),
+    'shoptrack_db_slow_queries_total': (
+        'counter', 'SQL statements slower than SLOW_QUERY_MS.', None
+    ),
+    'shoptrack_http_request_duration_seconds': (
+        'histogram', 'Time spent serving each request.', LATENCY_BUCKETS
+    ),
+    'shoptrack_http_request_queries': (
+        'histogram', 'SQL statements run while serving one request.', QUERY_COUNT_BUCKETS
+    ),
+}
+
+# Longest statement text kept in the ``statement`` label
+STATEMENT_LABEL_LENGTH = 200
+# A parenthesised list of two or more placeholders in any paramstyle, and
+# repeats of the collapsed list, as in IN lists and multi-row VALUES
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%s|\$\d+)\s*,)+\s*(?:\?|%s|\$\d+)\s*\)')
+_REPEATED_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+
+# Counts of exited workers, within METRICS_DIR
+EXITED_FILENAME = 'metrics-exited.json'
+LOCK_FILENAME = 'metrics.lock'
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(query):
+    """Collapse the whitespace of a SQL statement so it can be used as a label value.
+
+    Placeholder lists become ``(...)``, so an IN list or a multi-row INSERT
+    gets one label whatever its length.
+    """
+    label = _REPEATED_LISTS.sub('(...)', _PLACEHOLDER_LIST.sub('(...)', ' '.join(query.split())))
+    return label[:STATEMENT_LABEL_LENGTH]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+def _is_snapshot(filename):
+    return filename.startswith('metrics-') and filename.endswith('.json')
+
+@contextmanager
+def _directory_lock(directory, shared=False):
+    """Serialise moving counts between files with reading them, across processes."""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK_FILENAME), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _read_snapshot(path):
+    with open(path, encoding='utf8') as f:
+        return json.load(f)
+
+def _write_snapshot(path, snapshot):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf8') as f:
+        json.dump(snapshot, f)
+    os.replace(temp_path, path)
+
+def merge_snapshots(snapshots):
+    """Sum snapshots; returns ``(histograms, counters)`` keyed by ``(name, labels)``."""
+    histograms = {}
+    counters = {}
+    for snapshot in snapshots:
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            merged = histograms.setdefault(key, [0] * len(series))
+            for index, value in enumerate(series):
+                merged[index] += value
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+    return histograms, counters
+
+def archive_worker(directory, pid):
+    """Fold the snapshot of worker ``pid``, which has exited, into the exited workers' counts."""
+    path = _snapshot_path(directory, pid)
+    with _directory_lock(directory):
+        try:
+            snapshot = _read_snapshot(path)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # Died mid-write; os.replace() makes this rare, and nothing can be recovered
+            snapshot = None
+
+        if snapshot is not None:
+            exited_path = os.path.join(directory, EXITED_FILENAME)
+            try:
+                exited = _read_snapshot(exited_path)
+            except (FileNotFoundError, ValueError):
+                exited = {'histograms': [], 'counters': []}
+            histograms, counters = merge_snapshots([exited, snapshot])
+            _write_snapshot(exited_path, {
+                'histograms': [[name, labels, series] for (name, labels), series in histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            })
+        os.remove(path)
+
+def clear_directory(directory):
+    """Remove every snapshot from METRICS_DIR, for when the server starts."""
+    if not os.path.isdir(directory):
+        return
+    with _directory_lock(directory):
+        for filename in os.listdir(directory):
+            if _is_snapshot(filename) or filename.endswith('.json.tmp'):
+                os.remove(os.path.join(directory, filename))
+
+
+class MetricsRegistry:
+    """Histograms and counters of this worker, optionally shared through METRICS_DIR."""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # (name, labels) -> [per-bucket counts..., overflow count, sum]
+        self._histograms = {}
+        # (name, labels) -> value
+        self._counters = {}
+        self._pid = os.getpid()
+        self._flushed = 0.0
+        # Whether a file left by an earlier process with our PID has been archived
+        self._claimed = False
+
+    def _check_pid(self):
+        # Counts inherited through fork() belong to the parent's snapshot
+        if self._pid != os.getpid():
+            self._reset()
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, tuple(labels))
+        with self._lock:
+            self._check_pid()
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    break
+            else:
+                index = len(buckets)
+            series[index] += 1
+            series[-1] += value
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self._check_pid()
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                'histograms': [[name, labels, list(series)] for (name, labels), series in self._histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this worker's snapshot to METRICS_DIR, at most once per flush interval."""
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed < self.flush_interval:
+            return
+        self._flushed = now
+
+        snapshot = self.snapshot()
+        if not self._claimed:
+            # A dead worker with our PID that child_exit never saw; keep its counts
+            archive_worker(self.directory, os.getpid())
+            self._claimed = True
+        _write_snapshot(_snapshot_path(self.directory, os.getpid()), snapshot)
+
+    def collect(self):
+        """Merge this worker's live counters with the snapshots of the others."""
+        snapshots = [self.snapshot()]
+        if self.directory and os.path.isdir(self.directory):
+            own = os.path.basename(_snapshot_path(self.directory, os.getpid()))
+            # Not while an exited worker's counts are being moved to the archive
+            with _directory_lock(self.directory, shared=True):
+                for filename in os.listdir(self.directory):
+                    if filename == own or not _is_snapshot(filename):
+                        continue
+                    try:
+                        snapshots.append(_read_snapshot(os.path.join(self.directory, filename)))
+                    except (OSError, ValueError):
+                        # A worker died mid-write; take the next scrape
+                        continue
+        return merge_snapshots(snapshots)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        histograms, counters = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            if kind == 'counter':
+                for (series_name, labels), value in sorted(counters.items()):
+                    if series_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+                continue
+
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    bucket_labels = labels + (('le', _format_number(float(bound))),)
+                    lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+                cumulative += series[len(buckets)]
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(series[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics():
+    return current_app.extensions['metrics']
+
+def observe_query(registry, query, elapsed, slow_query_ms, logger):
+    """Record one statement's latency, counting and logging it when it is slow."""
+    label = statement_label(query)
+    registry.observe('shoptrack_db_query_duration_seconds', (('statement', label),), elapsed)
+    if elapsed * 1000 >= slow_query_ms:
+        registry.inc('shoptrack_db_slow_queries_total', (('statement', label),))
+        logger.warning(f'Slow query ({elapsed * 1000:.1f} ms): {label}')
+
+def observe_request(registry, endpoint, method, status, elapsed, queries):
+    """Record one served request; ``endpoint`` is its route rule."""
+    labels = (('endpoint', endpoint), ('method', method), ('status', str(status)))
+    registry.observe('shoptrack_http_request_duration_seconds', labels, elapsed)
+    registry.observe('shoptrack_http_request_queries', (('endpoint', endpoint), ('method', method)), queries)
+    registry.flush()
+
+def record_query(query, elapsed):
+    """Called by shoptrack.db for every statement it executes."""
+    registry = current_app.extensions.get('metrics')
+    if registry is None:
+        return
+    if 'query_count' in g:
+        g.query_count += 1
+    observe_query(registry, query, elapsed, current_app.config['SLOW_QUERY_MS'], current_app.logger)
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.query_count = 0
+
+def _finish_request(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+
+    _observe_flask_request(response.status_code, started)
+    return response
+
+def _abort_request(exc):
+    # after_request is skipped when an exception escapes the view unhandled
+    started = g.pop('request_started', None)
+    if started is not None:
+        _observe_flask_request(500, started)
+
+def _observe_flask_request(status, started):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    observe_request(
+        get_metrics(), endpoint, request.method, status, time.perf_counter() - started, g.pop('query_count', 0)
+    )
+
+def metrics_authorized(authorization, token):
+    """Whether an Authorization header carries METRICS_TOKEN; without a token /metrics is off."""
+    if not token or not authorization or not authorization.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(authorization[len('Bearer '):].encode(), token.encode())
+
+def init_app(app):
+    app.extensions['metrics'] = MetricsRegistry(
+        directory=app.config['METRICS_DIR'],
+        flush_interval=app.config['METRICS_FLUSH_INTERVAL'],
+    )
+    if app.config['METRICS_DIR']:
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_abort_request)
+
+    @app.route('/metrics')
+    def metrics():
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            return jsonify({'error': 'Not found'}), 404
+        if not metrics_authorized(request.headers.get('Authorization'), token):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return app.response_class(get_metrics().render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,130 @@
+import os
+import re
+
+import click
+from flask.cli import AppGroup
+
+from shoptrack.db import get_db, get_dialect, execute_query
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+
+# Arbitrary key for pg_advisory_lock so concurrent deploys apply migrations one at a time
+ADVISORY_LOCK_KEY = 0x5709_7124
+
+VERSION_TABLE = {
+    'sqlite': '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    'postgresql': '''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    ''',
+}
+
+
+def available_migrations(dialect):
+    """Return (version, name, path) for every migration file of ``dialect``, oldest first."""
+    directory = os.path.join(MIGRATIONS_DIR, dialect)
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+    return migrations
+
+def applied_versions():
+    dialect = get_dialect()
+    execute_query(VERSION_TABLE[dialect])
+    get_db().commit()
+    cursor = execute_query('SELECT version FROM schema_version')
+    return {row['version'] for row in cursor.fetchall()}
+
+def current_version():
+    return max(applied_versions(), default=0)
+
+def _apply(dialect, version, name, sql):
+    db = get_db()
+    if dialect == 'postgresql':
+        try:
+            cursor = db.cursor()
+            cursor.execute(sql)
+            cursor.execute('INSERT INTO schema_version (version, name) VALUES (%s, %s)', (version, name))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    else:
+        # executescript() runs outside the sqlite3 module's transaction
+        # handling, so the migration wraps itself in one explicitly.
+        try:
+            db.executescript(
+                f"BEGIN;\n{sql}\n;"
+                f"INSERT INTO schema_version (version, name) VALUES ({version}, '{name}');\n"
+                "COMMIT;"
+            )
+        except Exception:
+            if db.in_transaction:
+                db.rollback()
+            raise
+
+def upgrade(target=None):
+    """Apply pending migrations up to ``target`` (default: all).
+
+    Each migration runs in its own transaction together with its
+    schema_version row. Returns the list of (version, name) applied.
+    """
+    dialect = get_dialect()
+    db = get_db()
+
+    if dialect == 'postgresql':
+        execute_query('SELECT pg_advisory_lock(%s)', (ADVISORY_LOCK_KEY,))
+    try:
+        applied = applied_versions()
+        done = []
+        for version, name, path in available_migrations(dialect):
+            if version in applied:
+                continue
+            if target is not None and version > target:
+                break
+            with open(path, encoding='utf8') as f:
+                _apply(dialect, version, name, f.read())
+            done.append((version, name))
+        return done
+    finally:
+        if dialect == 'postgresql':
+            execute_query('SELECT pg_advisory_unlock(%s)', (ADVISORY_LOCK_KEY,))
+            db.commit()
+
+
+db_cli = AppGroup('db', help='Manage the database schema.')
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help='Stop after this migration version.')
+def upgrade_command(target):
+    """Apply pending schema migrations."""
+    done = upgrade(target)
+    for version, name in done:
+        click.echo(f'Applied {version:04d}_{name}')
+    click.echo(f'Database is at version {current_version()}.')
+
+@db_cli.command('current')
+def current_command():
+    """Show the schema version of the database."""
+    dialect = get_dialect()
+    applied = applied_versions()
+    click.echo(f'Database is at version {max(applied, default=0)}.')
+    pending = [v for v, _, _ in available_migrations(dialect) if v not in applied]
+    if pending:
+        click.echo(f'Pending migrations: {", ".join(str(v) for v in pending)}')
+
+def init_app(app):
+    app.cli.add_command(db_cli)
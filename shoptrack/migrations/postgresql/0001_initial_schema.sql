@@ -0,0 +1,40 @@
+-- Baseline schema. IF NOT EXISTS lets databases created by the old
+-- init-db be adopted without a wipe.
+
+CREATE TABLE IF NOT EXISTS "user" (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(255) UNIQUE NOT NULL,
+    password VARCHAR(255) NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS product (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    stock INTEGER NOT NULL CHECK (stock >= 0),
+    price DECIMAL(10,2) NOT NULL CHECK (price > 0),
+    description VARCHAR(255),
+    owner_id INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT NOW(),
+    FOREIGN KEY (owner_id) REFERENCES "user" (id)
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    id SERIAL PRIMARY KEY,
+    product_id INTEGER,
+    product_name VARCHAR(255) NOT NULL,
+    user_id INTEGER NOT NULL,
+    price DECIMAL(10,2) NOT NULL CHECK (price > 0),
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    action VARCHAR(255) NOT NULL CHECK (action IN ('buy', 'sell')),
+    created TIMESTAMP NOT NULL DEFAULT NOW(),
+    FOREIGN KEY (user_id) REFERENCES "user" (id)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id VARCHAR(255) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT NOW(),
+    expires TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES "user" (id)
+);
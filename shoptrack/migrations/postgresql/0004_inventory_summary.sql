@@ -0,0 +1,96 @@
+-- One row per owner, kept current by triggers in the same transaction as
+-- every product and history write, so GET /stock/summary is a key lookup.
+
+CREATE TABLE IF NOT EXISTS inventory_summary (
+    owner_id INTEGER PRIMARY KEY,
+    product_count INTEGER NOT NULL DEFAULT 0,
+    units_on_hand BIGINT NOT NULL DEFAULT 0,
+    inventory_value DECIMAL(16,2) NOT NULL DEFAULT 0,
+    units_bought BIGINT NOT NULL DEFAULT 0,
+    buy_total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    units_sold BIGINT NOT NULL DEFAULT 0,
+    sell_total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    updated TIMESTAMP NOT NULL DEFAULT NOW(),
+    FOREIGN KEY (owner_id) REFERENCES "user" (id)
+);
+
+CREATE OR REPLACE FUNCTION product_summary() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE inventory_summary SET
+            product_count = product_count - 1,
+            units_on_hand = units_on_hand - OLD.stock,
+            inventory_value = inventory_value - OLD.stock * OLD.price,
+            updated = NOW()
+        WHERE owner_id = OLD.owner_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO inventory_summary (owner_id, product_count, units_on_hand, inventory_value)
+        VALUES (NEW.owner_id, 1, NEW.stock, NEW.stock * NEW.price)
+        ON CONFLICT (owner_id) DO UPDATE SET
+            product_count = inventory_summary.product_count + 1,
+            units_on_hand = inventory_summary.units_on_hand + EXCLUDED.units_on_hand,
+            inventory_value = inventory_summary.inventory_value + EXCLUDED.inventory_value,
+            updated = NOW();
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_summary_insert_delete ON product;
+CREATE TRIGGER product_summary_insert_delete AFTER INSERT OR DELETE ON product
+    FOR EACH ROW EXECUTE FUNCTION product_summary();
+
+DROP TRIGGER IF EXISTS product_summary_update ON product;
+CREATE TRIGGER product_summary_update AFTER UPDATE OF stock, price, owner_id ON product
+    FOR EACH ROW EXECUTE FUNCTION product_summary();
+
+CREATE OR REPLACE FUNCTION history_summary() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO inventory_summary (owner_id, units_bought, buy_total, units_sold, sell_total)
+    VALUES (
+        NEW.user_id,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity * NEW.price ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity * NEW.price ELSE 0 END
+    )
+    ON CONFLICT (owner_id) DO UPDATE SET
+        units_bought = inventory_summary.units_bought + EXCLUDED.units_bought,
+        buy_total = inventory_summary.buy_total + EXCLUDED.buy_total,
+        units_sold = inventory_summary.units_sold + EXCLUDED.units_sold,
+        sell_total = inventory_summary.sell_total + EXCLUDED.sell_total,
+        updated = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS history_summary_insert ON history;
+CREATE TRIGGER history_summary_insert AFTER INSERT ON history
+    FOR EACH ROW EXECUTE FUNCTION history_summary();
+
+-- Backfill owners that already have data
+INSERT INTO inventory_summary (
+    owner_id, product_count, units_on_hand, inventory_value,
+    units_bought, buy_total, units_sold, sell_total
+)
+SELECT u.id,
+       COALESCE(p.product_count, 0), COALESCE(p.units_on_hand, 0), COALESCE(p.inventory_value, 0),
+       COALESCE(h.units_bought, 0), COALESCE(h.buy_total, 0), COALESCE(h.units_sold, 0), COALESCE(h.sell_total, 0)
+FROM "user" u
+LEFT JOIN (
+    SELECT owner_id, COUNT(*) AS product_count, SUM(stock) AS units_on_hand, SUM(stock * price) AS inventory_value
+    FROM product GROUP BY owner_id
+) p ON p.owner_id = u.id
+LEFT JOIN (
+    SELECT user_id,
+           SUM(CASE WHEN action = 'buy' THEN quantity ELSE 0 END) AS units_bought,
+           SUM(CASE WHEN action = 'buy' THEN quantity * price ELSE 0 END) AS buy_total,
+           SUM(CASE WHEN action = 'sell' THEN quantity ELSE 0 END) AS units_sold,
+           SUM(CASE WHEN action = 'sell' THEN quantity * price ELSE 0 END) AS sell_total
+    FROM history GROUP BY user_id
+) h ON h.user_id = u.id
+WHERE p.owner_id IS NOT NULL OR h.user_id IS NOT NULL
+ON CONFLICT (owner_id) DO NOTHING;
@@ -0,0 +1,58 @@
+-- Daily buy/sell totals per user and product, kept current by a trigger on
+-- history inserts. Week and month buckets are summed from the day rows.
+
+CREATE TABLE IF NOT EXISTS history_rollup (
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    units_bought INTEGER NOT NULL DEFAULT 0,
+    buy_total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    sell_total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, product_id, day),
+    FOREIGN KEY (user_id) REFERENCES "user" (id)
+);
+
+CREATE INDEX IF NOT EXISTS history_rollup_user_day_idx ON history_rollup (user_id, day);
+
+CREATE OR REPLACE FUNCTION history_rollup() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO history_rollup (user_id, product_id, day, units_bought, buy_total, units_sold, sell_total, transactions)
+    VALUES (
+        NEW.user_id,
+        COALESCE(NEW.product_id, 0),
+        NEW.created::date,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity * NEW.price ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity * NEW.price ELSE 0 END,
+        1
+    )
+    ON CONFLICT (user_id, product_id, day) DO UPDATE SET
+        units_bought = history_rollup.units_bought + EXCLUDED.units_bought,
+        buy_total = history_rollup.buy_total + EXCLUDED.buy_total,
+        units_sold = history_rollup.units_sold + EXCLUDED.units_sold,
+        sell_total = history_rollup.sell_total + EXCLUDED.sell_total,
+        transactions = history_rollup.transactions + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS history_rollup_insert ON history;
+CREATE TRIGGER history_rollup_insert AFTER INSERT ON history
+    FOR EACH ROW EXECUTE FUNCTION history_rollup();
+
+-- Backfill from existing history
+INSERT INTO history_rollup (user_id, product_id, day, units_bought, buy_total, units_sold, sell_total, transactions)
+SELECT user_id,
+       COALESCE(product_id, 0),
+       created::date,
+       SUM(CASE WHEN action = 'buy' THEN quantity ELSE 0 END),
+       SUM(CASE WHEN action = 'buy' THEN quantity * price ELSE 0 END),
+       SUM(CASE WHEN action = 'sell' THEN quantity ELSE 0 END),
+       SUM(CASE WHEN action = 'sell' THEN quantity * price ELSE 0 END),
+       COUNT(*)
+FROM history
+GROUP BY user_id, COALESCE(product_id, 0), created::date
+ON CONFLICT (user_id, product_id, day) DO NOTHING;
@@ -0,0 +1,32 @@
+-- Per-owner counter bumped by every product insert, update and delete.
+-- Product reads use it as their ETag. It lives apart from inventory_summary
+-- so `flask summary rebuild` can never reset it to a value already handed out.
+
+CREATE TABLE IF NOT EXISTS inventory_version (
+    owner_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    FOREIGN KEY (owner_id) REFERENCES "user" (id)
+);
+
+CREATE OR REPLACE FUNCTION bump_inventory_version(owner INTEGER) RETURNS void AS $$
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (owner, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = inventory_version.version + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_inventory_version(NEW.owner_id);
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.owner_id <> NEW.owner_id) THEN
+        PERFORM bump_inventory_version(OLD.owner_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS product_version ON product;
+CREATE TRIGGER product_version AFTER INSERT OR UPDATE OR DELETE ON product
+    FOR EACH ROW EXECUTE FUNCTION product_version();
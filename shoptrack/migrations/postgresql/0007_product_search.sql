@@ -0,0 +1,14 @@
+-- Full-text index over product names and descriptions for /stock/search.
+-- The index is on an expression rather than a stored tsvector column, so
+-- `SELECT * FROM product` is unchanged, and PostgreSQL maintains it with
+-- every insert, update and delete. The 'simple' configuration does no
+-- stemming, matching the unicode61 tokenizer used on SQLite. Name matches
+-- carry weight A and outrank description matches (weight B).
+
+CREATE OR REPLACE FUNCTION product_search_document(name TEXT, description TEXT) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', COALESCE(name, '')), 'A')
+        || setweight(to_tsvector('simple', COALESCE(description, '')), 'B');
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX IF NOT EXISTS product_search_idx ON product
+    USING GIN (product_search_document(name, description));
@@ -0,0 +1,4 @@
+-- History filtered by action: WHERE user_id = ? AND action = ? [AND created range]
+-- ORDER BY created DESC, id DESC. Date ranges alone use history_user_created_idx
+-- and product filters history_product_user_created_idx (both in 0002).
+CREATE INDEX IF NOT EXISTS history_user_action_created_idx ON history (user_id, action, created, id);
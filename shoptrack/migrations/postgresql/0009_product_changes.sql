@@ -0,0 +1,49 @@
+-- Delta sync for GET /stock/changes. product_change has a row per product
+-- and owner holding the inventory version (see 0006) of the product's last
+-- write; deleting the product turns it into a tombstone. The changes after
+-- a version are then one range scan of product_change_owner_version_idx.
+
+CREATE TABLE IF NOT EXISTS product_change (
+    owner_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    version BIGINT NOT NULL,
+    deleted TIMESTAMP,
+    PRIMARY KEY (owner_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS product_change_owner_version_idx ON product_change (owner_id, version);
+CREATE INDEX IF NOT EXISTS product_change_deleted_idx ON product_change (deleted) WHERE deleted IS NOT NULL;
+
+-- Highest tombstone version pruned per owner; older tokens get a full resync
+CREATE TABLE IF NOT EXISTS product_change_pruned (
+    owner_id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+
+-- Existing products start at their owner's current version
+INSERT INTO product_change (owner_id, product_id, version)
+SELECT product.owner_id, product.id, COALESCE(inventory_version.version, 0)
+FROM product LEFT JOIN inventory_version ON inventory_version.owner_id = product.owner_id
+ON CONFLICT (owner_id, product_id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION next_inventory_version(owner INTEGER) RETURNS BIGINT AS $$
+    INSERT INTO inventory_version (owner_id, version) VALUES (owner, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = inventory_version.version + 1
+    RETURNING version;
+$$ LANGUAGE sql;
+
+-- The 0006 trigger function, now also recording the version of each product write
+CREATE OR REPLACE FUNCTION product_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO product_change (owner_id, product_id, version)
+        VALUES (NEW.owner_id, NEW.id, next_inventory_version(NEW.owner_id))
+        ON CONFLICT (owner_id, product_id) DO UPDATE SET version = EXCLUDED.version, deleted = NULL;
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.owner_id <> NEW.owner_id) THEN
+        INSERT INTO product_change (owner_id, product_id, version, deleted)
+        VALUES (OLD.owner_id, OLD.id, next_inventory_version(OLD.owner_id), NOW())
+        ON CONFLICT (owner_id, product_id) DO UPDATE SET version = EXCLUDED.version, deleted = EXCLUDED.deleted;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
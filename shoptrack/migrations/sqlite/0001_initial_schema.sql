@@ -0,0 +1,40 @@
+-- Baseline schema. IF NOT EXISTS lets databases created by the old
+-- init-db be adopted without a wipe.
+
+CREATE TABLE IF NOT EXISTS user (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS product (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    stock INTEGER NOT NULL CHECK (stock >= 0),
+    price REAL NOT NULL CHECK (price > 0),
+    description TEXT,
+    owner_id INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (owner_id) REFERENCES user (id)
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER,
+    product_name TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    price REAL NOT NULL CHECK (price > 0),
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    action TEXT NOT NULL CHECK (action IN ('buy', 'sell')),
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
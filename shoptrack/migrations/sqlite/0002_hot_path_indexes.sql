@@ -0,0 +1,11 @@
+-- Product listing: WHERE owner_id = ? ORDER BY created DESC, id DESC
+CREATE INDEX IF NOT EXISTS product_owner_created_idx ON product (owner_id, created, id);
+
+-- History listing: WHERE user_id = ? ORDER BY created DESC, id DESC
+CREATE INDEX IF NOT EXISTS history_user_created_idx ON history (user_id, created, id);
+
+-- Product history: WHERE product_id = ? AND user_id = ? ORDER BY created DESC
+CREATE INDEX IF NOT EXISTS history_product_user_created_idx ON history (product_id, user_id, created);
+
+-- Login: WHERE LOWER(username) = LOWER(?)
+CREATE INDEX IF NOT EXISTS user_username_lower_idx ON user (LOWER(username));
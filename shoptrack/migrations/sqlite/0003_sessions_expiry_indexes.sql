@@ -0,0 +1,5 @@
+-- Expired-session purge: WHERE expires < ? ORDER BY expires LIMIT ?
+CREATE INDEX IF NOT EXISTS sessions_expires_idx ON sessions (expires);
+
+-- Per-user session cap: PARTITION BY user_id ORDER BY expires DESC
+CREATE INDEX IF NOT EXISTS sessions_user_expires_idx ON sessions (user_id, expires);
@@ -0,0 +1,95 @@
+-- One row per owner, kept current by triggers in the same transaction as
+-- every product and history write, so GET /stock/summary is a key lookup.
+
+CREATE TABLE IF NOT EXISTS inventory_summary (
+    owner_id INTEGER PRIMARY KEY,
+    product_count INTEGER NOT NULL DEFAULT 0,
+    units_on_hand INTEGER NOT NULL DEFAULT 0,
+    inventory_value REAL NOT NULL DEFAULT 0,
+    units_bought INTEGER NOT NULL DEFAULT 0,
+    buy_total REAL NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    sell_total REAL NOT NULL DEFAULT 0,
+    updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (owner_id) REFERENCES user (id)
+);
+
+CREATE TRIGGER IF NOT EXISTS product_summary_insert AFTER INSERT ON product
+BEGIN
+    INSERT INTO inventory_summary (owner_id, product_count, units_on_hand, inventory_value)
+    VALUES (NEW.owner_id, 1, NEW.stock, NEW.stock * NEW.price)
+    ON CONFLICT (owner_id) DO UPDATE SET
+        product_count = product_count + 1,
+        units_on_hand = units_on_hand + excluded.units_on_hand,
+        inventory_value = inventory_value + excluded.inventory_value,
+        updated = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_summary_update AFTER UPDATE OF stock, price, owner_id ON product
+BEGIN
+    UPDATE inventory_summary SET
+        product_count = product_count - 1,
+        units_on_hand = units_on_hand - OLD.stock,
+        inventory_value = inventory_value - OLD.stock * OLD.price,
+        updated = CURRENT_TIMESTAMP
+    WHERE owner_id = OLD.owner_id;
+
+    INSERT INTO inventory_summary (owner_id, product_count, units_on_hand, inventory_value)
+    VALUES (NEW.owner_id, 1, NEW.stock, NEW.stock * NEW.price)
+    ON CONFLICT (owner_id) DO UPDATE SET
+        product_count = product_count + 1,
+        units_on_hand = units_on_hand + excluded.units_on_hand,
+        inventory_value = inventory_value + excluded.inventory_value,
+        updated = CURRENT_TIMESTAMP;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_summary_delete AFTER DELETE ON product
+BEGIN
+    UPDATE inventory_summary SET
+        product_count = product_count - 1,
+        units_on_hand = units_on_hand - OLD.stock,
+        inventory_value = inventory_value - OLD.stock * OLD.price,
+        updated = CURRENT_TIMESTAMP
+    WHERE owner_id = OLD.owner_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS history_summary_insert AFTER INSERT ON history
+BEGIN
+    INSERT INTO inventory_summary (owner_id, units_bought, buy_total, units_sold, sell_total)
+    VALUES (
+        NEW.user_id,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity * NEW.price ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity * NEW.price ELSE 0 END
+    )
+    ON CONFLICT (owner_id) DO UPDATE SET
+        units_bought = units_bought + excluded.units_bought,
+        buy_total = buy_total + excluded.buy_total,
+        units_sold = units_sold + excluded.units_sold,
+        sell_total = sell_total + excluded.sell_total,
+        updated = CURRENT_TIMESTAMP;
+END;
+
+-- Backfill owners that already have data
+INSERT OR REPLACE INTO inventory_summary (
+    owner_id, product_count, units_on_hand, inventory_value,
+    units_bought, buy_total, units_sold, sell_total
+)
+SELECT u.id,
+       COALESCE(p.product_count, 0), COALESCE(p.units_on_hand, 0), COALESCE(p.inventory_value, 0),
+       COALESCE(h.units_bought, 0), COALESCE(h.buy_total, 0), COALESCE(h.units_sold, 0), COALESCE(h.sell_total, 0)
+FROM user u
+LEFT JOIN (
+    SELECT owner_id, COUNT(*) AS product_count, SUM(stock) AS units_on_hand, SUM(stock * price) AS inventory_value
+    FROM product GROUP BY owner_id
+) p ON p.owner_id = u.id
+LEFT JOIN (
+    SELECT user_id,
+           SUM(CASE WHEN action = 'buy' THEN quantity ELSE 0 END) AS units_bought,
+           SUM(CASE WHEN action = 'buy' THEN quantity * price ELSE 0 END) AS buy_total,
+           SUM(CASE WHEN action = 'sell' THEN quantity ELSE 0 END) AS units_sold,
+           SUM(CASE WHEN action = 'sell' THEN quantity * price ELSE 0 END) AS sell_total
+    FROM history GROUP BY user_id
+) h ON h.user_id = u.id
+WHERE p.owner_id IS NOT NULL OR h.user_id IS NOT NULL;
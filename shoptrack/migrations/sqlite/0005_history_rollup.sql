@@ -0,0 +1,51 @@
+-- Daily buy/sell totals per user and product, kept current by a trigger on
+-- history inserts. Week and month buckets are summed from the day rows.
+
+CREATE TABLE IF NOT EXISTS history_rollup (
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    units_bought INTEGER NOT NULL DEFAULT 0,
+    buy_total REAL NOT NULL DEFAULT 0,
+    units_sold INTEGER NOT NULL DEFAULT 0,
+    sell_total REAL NOT NULL DEFAULT 0,
+    transactions INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, product_id, day),
+    FOREIGN KEY (user_id) REFERENCES user (id)
+);
+
+CREATE INDEX IF NOT EXISTS history_rollup_user_day_idx ON history_rollup (user_id, day);
+
+CREATE TRIGGER IF NOT EXISTS history_rollup_insert AFTER INSERT ON history
+BEGIN
+    INSERT INTO history_rollup (user_id, product_id, day, units_bought, buy_total, units_sold, sell_total, transactions)
+    VALUES (
+        NEW.user_id,
+        COALESCE(NEW.product_id, 0),
+        date(NEW.created),
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'buy' THEN NEW.quantity * NEW.price ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity ELSE 0 END,
+        CASE WHEN NEW.action = 'sell' THEN NEW.quantity * NEW.price ELSE 0 END,
+        1
+    )
+    ON CONFLICT (user_id, product_id, day) DO UPDATE SET
+        units_bought = units_bought + excluded.units_bought,
+        buy_total = buy_total + excluded.buy_total,
+        units_sold = units_sold + excluded.units_sold,
+        sell_total = sell_total + excluded.sell_total,
+        transactions = transactions + 1;
+END;
+
+-- Backfill from existing history
+INSERT OR REPLACE INTO history_rollup (user_id, product_id, day, units_bought, buy_total, units_sold, sell_total, transactions)
+SELECT user_id,
+       COALESCE(product_id, 0),
+       date(created),
+       SUM(CASE WHEN action = 'buy' THEN quantity ELSE 0 END),
+       SUM(CASE WHEN action = 'buy' THEN quantity * price ELSE 0 END),
+       SUM(CASE WHEN action = 'sell' THEN quantity ELSE 0 END),
+       SUM(CASE WHEN action = 'sell' THEN quantity * price ELSE 0 END),
+       COUNT(*)
+FROM history
+GROUP BY user_id, COALESCE(product_id, 0), date(created);
@@ -0,0 +1,30 @@
+-- Per-owner counter bumped by every product insert, update and delete.
+-- Product reads use it as their ETag. It lives apart from inventory_summary
+-- so `flask summary rebuild` can never reset it to a value already handed out.
+
+CREATE TABLE IF NOT EXISTS inventory_version (
+    owner_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (owner_id) REFERENCES user (id)
+);
+
+CREATE TRIGGER IF NOT EXISTS product_version_insert AFTER INSERT ON product
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (NEW.owner_id, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_version_update AFTER UPDATE ON product
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (NEW.owner_id, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = version + 1;
+
+    UPDATE inventory_version SET version = version + 1
+    WHERE owner_id = OLD.owner_id AND OLD.owner_id <> NEW.owner_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_version_delete AFTER DELETE ON product
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (OLD.owner_id, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = version + 1;
+END;
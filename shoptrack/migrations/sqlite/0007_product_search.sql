@@ -0,0 +1,34 @@
+-- Full-text index over product names and descriptions for /stock/search.
+-- An external-content FTS5 table: it stores only the index and reads the
+-- text from product, and the triggers below keep it in step. Stock changes
+-- do not touch name or description, so they never fire the update trigger.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS product_search USING fts5(
+    name,
+    description,
+    content = 'product',
+    content_rowid = 'id',
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS product_search_insert AFTER INSERT ON product
+BEGIN
+    INSERT INTO product_search (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_search_update AFTER UPDATE OF name, description ON product
+BEGIN
+    INSERT INTO product_search (product_search, rowid, name, description)
+    VALUES ('delete', OLD.id, OLD.name, OLD.description);
+    INSERT INTO product_search (rowid, name, description) VALUES (NEW.id, NEW.name, NEW.description);
+END;
+
+CREATE TRIGGER IF NOT EXISTS product_search_delete AFTER DELETE ON product
+BEGIN
+    INSERT INTO product_search (product_search, rowid, name, description)
+    VALUES ('delete', OLD.id, OLD.name, OLD.description);
+END;
+
+-- Index the existing products
+INSERT INTO product_search (product_search) VALUES ('rebuild');
@@ -0,0 +1,70 @@
+-- Delta sync for GET /stock/changes. product_change has a row per product
+-- and owner holding the inventory version (see 0006) of the product's last
+-- write; deleting the product turns it into a tombstone. The changes after
+-- a version are then one range scan of product_change_owner_version_idx.
+
+CREATE TABLE IF NOT EXISTS product_change (
+    owner_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    deleted TIMESTAMP,
+    PRIMARY KEY (owner_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS product_change_owner_version_idx ON product_change (owner_id, version);
+CREATE INDEX IF NOT EXISTS product_change_deleted_idx ON product_change (deleted) WHERE deleted IS NOT NULL;
+
+-- Highest tombstone version pruned per owner; older tokens get a full resync
+CREATE TABLE IF NOT EXISTS product_change_pruned (
+    owner_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+-- Existing products start at their owner's current version
+INSERT INTO product_change (owner_id, product_id, version)
+SELECT product.owner_id, product.id, COALESCE(inventory_version.version, 0)
+FROM product LEFT JOIN inventory_version ON inventory_version.owner_id = product.owner_id
+WHERE true
+ON CONFLICT (owner_id, product_id) DO NOTHING;
+
+-- The 0006 triggers, now also recording the version of each product write
+DROP TRIGGER IF EXISTS product_version_insert;
+DROP TRIGGER IF EXISTS product_version_update;
+DROP TRIGGER IF EXISTS product_version_delete;
+
+CREATE TRIGGER product_version_insert AFTER INSERT ON product
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (NEW.owner_id, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = version + 1;
+
+    INSERT INTO product_change (owner_id, product_id, version)
+    SELECT NEW.owner_id, NEW.id, version FROM inventory_version WHERE owner_id = NEW.owner_id
+    ON CONFLICT (owner_id, product_id) DO UPDATE SET version = excluded.version, deleted = NULL;
+END;
+
+CREATE TRIGGER product_version_update AFTER UPDATE ON product
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (NEW.owner_id, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = version + 1;
+
+    INSERT INTO product_change (owner_id, product_id, version)
+    SELECT NEW.owner_id, NEW.id, version FROM inventory_version WHERE owner_id = NEW.owner_id
+    ON CONFLICT (owner_id, product_id) DO UPDATE SET version = excluded.version, deleted = NULL;
+
+    -- A product moved to another owner is deleted for the old one
+    UPDATE inventory_version SET version = version + 1
+    WHERE owner_id = OLD.owner_id AND OLD.owner_id <> NEW.owner_id;
+
+    UPDATE product_change SET deleted = CURRENT_TIMESTAMP,
+        version = (SELECT version FROM inventory_version WHERE owner_id = OLD.owner_id)
+    WHERE owner_id = OLD.owner_id AND product_id = OLD.id AND OLD.owner_id <> NEW.owner_id;
+END;
+
+CREATE TRIGGER product_version_delete AFTER DELETE ON product
+BEGIN
+    INSERT INTO inventory_version (owner_id, version) VALUES (OLD.owner_id, 1)
+    ON CONFLICT (owner_id) DO UPDATE SET version = version + 1;
+
+    INSERT INTO product_change (owner_id, product_id, version, deleted)
+    SELECT OLD.owner_id, OLD.id, version, CURRENT_TIMESTAMP FROM inventory_version WHERE owner_id = OLD.owner_id
+    ON CONFLICT (owner_id, product_id) DO UPDATE SET version = excluded.version, deleted = excluded.deleted;
+END;
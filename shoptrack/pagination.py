@@ -0,0 +1,77 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from shoptrack.serialize import RowSet
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def encode_cursor(row):
+    """Opaque cursor pointing just past ``row`` in (created DESC, id DESC) order."""
+    payload = json.dumps([row['created'].isoformat(), row['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the (created, id) pair encoded by encode_cursor, or raise ValueError."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(row_id, int):
+            raise ValueError
+        return datetime.fromisoformat(created), row_id
+    except (binascii.Error, TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def validate_page_args(args):
+    """Parse ``limit``/``cursor`` query parameters.
+
+    Returns ``(True, None)`` when neither is given, so callers can keep the
+    legacy unpaginated response, ``(True, page)`` with ``page['limit']`` and
+    ``page['after']`` otherwise, or ``(False, message)`` for bad input.
+    """
+    if 'limit' not in args and 'cursor' not in args:
+        return True, None
+
+    limit = args.get('limit', DEFAULT_LIMIT)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return False, "Limit must be an integer"
+
+    if limit < 1 or limit > MAX_LIMIT:
+        return False, f"Limit must be between 1 and {MAX_LIMIT}"
+
+    after = None
+    if args.get('cursor'):
+        try:
+            after = decode_cursor(args['cursor'])
+        except ValueError as e:
+            return False, str(e)
+
+    return True, {'limit': limit, 'after': after}
+
+def paginate_query(query, params, page, placeholder):
+    """Add the keyset condition, ordering and LIMIT for ``page`` to ``query``.
+
+    ``query`` must end in a WHERE clause over a table with ``created`` and
+    ``id`` columns. One extra row is fetched so the caller can tell whether
+    another page exists; see page_response().
+    """
+    params = list(params)
+    if page['after'] is not None:
+        query += f' AND (created, id) < ({placeholder}, {placeholder})'
+        params.extend(page['after'])
+    query += f' ORDER BY created DESC, id DESC LIMIT {placeholder}'
+    params.append(page['limit'] + 1)
+    return query, tuple(params)
+
+def page_response(rows, page):
+    """Split a paginate_query() result into the page items and the next cursor."""
+    items = rows[:page['limit']]
+    next_cursor = None
+    if len(rows) > page['limit']:
+        next_cursor = encode_cursor(items[-1])
+    return {'items': RowSet(items), 'next_cursor': next_cursor}
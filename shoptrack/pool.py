@@ -0,0 +1,227 @@
+import threading
+import time
+from collections import deque
+
+
+class PoolExhausted(Exception):
+    """Raised when no connection frees up before the checkout timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections owned by a single process.
+
+    ``minconn`` connections are opened with the pool, so it should be created
+    in the process that uses it (after a fork), and more are created lazily
+    up to ``maxconn``. Idle connections above
+    ``minconn`` are closed after ``max_idle`` seconds, and every connection is
+    recycled once it is older than ``max_lifetime``. A connection that sat idle
+    for longer than ``check_interval`` seconds is pinged before it is handed
+    out again, so a server restart costs one reconnect instead of a 500.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=5.0,
+                 max_idle=300.0, max_lifetime=3600.0, check_interval=30.0):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError('Pool sizes must satisfy 0 <= minconn <= maxconn and maxconn >= 1')
+
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+
+        self._cond = threading.Condition()
+        # (connection, returned_at) pairs; the most recently used connection
+        # is reused first so the rest can age out.
+        self._idle = deque()
+        self._born = {}
+        self._size = 0
+        self._closed = False
+        self._counters = {
+            'created': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'recycled': 0,
+            'discarded': 0,
+        }
+        self._fill()
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._cond:
+                conn, idle_for = self._take(deadline)
+
+            if conn is None:
+                return self._open()
+
+            if idle_for < self.check_interval or self._ping(conn):
+                with self._cond:
+                    self._counters['checkouts'] += 1
+                return conn
+
+            self._discard(conn)
+
+    def putconn(self, conn, close=False):
+        if not close:
+            try:
+                if getattr(conn, 'closed', False):
+                    close = True
+                else:
+                    # Never hand a half-finished transaction to the next request
+                    conn.rollback()
+            except Exception:
+                close = True
+
+        if close or self._closed:
+            self._discard(conn)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            self._idle.append((conn, now))
+            stale = self._prune(now)
+            self._cond.notify()
+        self._close_all(stale)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            conns = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(conns)
+            for conn in conns:
+                self._born.pop(id(conn), None)
+            self._cond.notify_all()
+        self._close_all(conns)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min': self.minconn,
+                'max': self.maxconn,
+            })
+        return stats
+
+    def _fill(self):
+        """Open the ``minconn`` connections the first requests would otherwise wait for."""
+        while self._size < self.minconn:
+            try:
+                conn = self._connect()
+            except Exception:
+                self.closeall()
+                raise
+            now = time.monotonic()
+            self._born[id(conn)] = now
+            self._idle.append((conn, now))
+            self._size += 1
+            self._counters['created'] += 1
+
+    def _take(self, deadline):
+        """Pop a usable idle connection or reserve a slot for a new one.
+
+        Must be called with the condition held. Returns ``(conn, idle_for)``
+        or ``(None, 0)`` when the caller should open a new connection.
+        """
+        waited = False
+        while True:
+            if self._closed:
+                raise PoolExhausted('Connection pool is closed')
+
+            now = time.monotonic()
+            while self._idle:
+                conn, returned_at = self._idle.pop()
+                if now - self._born.get(id(conn), now) >= self.max_lifetime:
+                    self._forget(conn)
+                    self._counters['recycled'] += 1
+                    self._close_all([conn])
+                    continue
+                return conn, now - returned_at
+
+            if self._size < self.maxconn:
+                self._size += 1
+                return None, 0
+
+            remaining = deadline - now
+            if remaining <= 0:
+                self._counters['timeouts'] += 1
+                raise PoolExhausted(
+                    f'No database connection available within {self.timeout}s '
+                    f'({self.maxconn} in use)'
+                )
+            if not waited:
+                self._counters['waits'] += 1
+                waited = True
+            self._cond.wait(remaining)
+
+    def _open(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._counters['created'] += 1
+            self._counters['checkouts'] += 1
+        return conn
+
+    def _ping(self, conn):
+        try:
+            if getattr(conn, 'closed', False):
+                return False
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._forget(conn)
+            self._counters['discarded'] += 1
+            self._cond.notify()
+        self._close_all([conn])
+
+    def _forget(self, conn):
+        self._born.pop(id(conn), None)
+        self._size -= 1
+
+    def _prune(self, now):
+        """Drop idle connections past their idle or lifetime limits."""
+        stale = []
+        keep = deque()
+        # Oldest entries sit at the left; keep at least ``minconn`` around
+        for conn, returned_at in self._idle:
+            too_old = now - self._born.get(id(conn), now) >= self.max_lifetime
+            too_idle = now - returned_at >= self.max_idle
+            if too_old or (too_idle and self._size - len(stale) > self.minconn):
+                stale.append(conn)
+            else:
+                keep.append((conn, returned_at))
+
+        for conn in stale:
+            self._forget(conn)
+            self._counters['recycled'] += 1
+        self._idle = keep
+        return stale
+
+    @staticmethod
+    def _close_all(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
@@ -0,0 +1,244 @@
+"""Named SQL statements, compiled once per dialect when the app starts.
+
+Statements are written once with ``?`` placeholders and compiled to the
+paramstyle of each backend. Those marked ``prepare=True`` are the hot
+request-path statements: on PostgreSQL they become server-side prepared
+statements, created on first use on each pooled connection, so later
+requests skip parsing and planning. Set DB_PREPARE_STATEMENTS=0 behind a
+transaction-mode pgbouncer, which does not keep prepared statements.
+"""
+import re
+import weakref
+
+from flask import current_app
+
+from shoptrack.db import get_db, get_dialect, execute_query
+
+DIALECTS = ('sqlite', 'postgresql')
+
+# Prefix for server-side prepared statement names
+PREPARED_PREFIX = 'shoptrack_'
+
+_INSERT_HISTORY = (
+    'INSERT INTO history (product_id, product_name, user_id, price, quantity, action) '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+_IMPORT_HISTORY = (
+    'INSERT INTO history (product_id, product_name, user_id, price, quantity, action) '
+    "SELECT id, name, owner_id, price, stock, 'buy' FROM product "
+)
+# History of one product, only if the user owns it. The product is matched
+# on its primary key and its history joined to it, so an owned product
+# without (matching) history still yields one all-NULL row and an unknown or
+# foreign product yields none. Filters are appended to the join condition.
+OWNED_PRODUCT_HISTORY = (
+    'SELECT history.* FROM (SELECT id AS owned_id FROM product WHERE id = ? AND owner_id = ?) AS owned '
+    'LEFT JOIN history ON history.product_id = owned_id AND history.user_id = ?'
+)
+_INSERT_PRODUCT = 'INSERT INTO product (name, stock, price, description, owner_id) VALUES (?, ?, ?, ?, ?)'
+_ADD_STOCK = 'UPDATE product SET stock = stock + ? WHERE id = ? AND owner_id = ?'
+_REMOVE_STOCK = 'UPDATE product SET stock = stock - ? WHERE id = ? AND owner_id = ? AND stock >= ?'
+
+# name -> (sql, prepare); sql is a string or a {dialect: sql} dict
+STATEMENTS = {
+    # Sessions
+    'session_by_token': ('SELECT user_id, expires FROM sessions WHERE id = ?', True),
+    'session_full_by_token': ('SELECT * FROM sessions WHERE id = ?', False),
+    'insert_session': ('INSERT INTO sessions (id, user_id, expires) VALUES (?, ?, ?)', False),
+    'delete_session': ('DELETE FROM sessions WHERE id = ?', False),
+
+    # Users
+    'insert_user': ('INSERT INTO "user" (username, password) VALUES (?, ?)', False),
+    'user_by_username': ('SELECT * FROM "user" WHERE LOWER(username) = LOWER(?)', True),
+    'update_user_password': ('UPDATE "user" SET password = ? WHERE id = ?', False),
+    'users_by_username_prefix': ('SELECT id, username FROM "user" WHERE username LIKE ? ORDER BY id', False),
+
+    # Products
+    'products_by_owner': ('SELECT * FROM product WHERE owner_id = ? ORDER BY created DESC, id DESC', True),
+    'product_by_id': ('SELECT * FROM product WHERE id = ? AND owner_id = ?', True),
+    'product_stock_by_id': ('SELECT stock FROM product WHERE id = ? AND owner_id = ?', False),
+    'product_row_by_id': ('SELECT name, price, stock FROM product WHERE id = ?', False),
+    'insert_product': (_INSERT_PRODUCT, False),
+    'insert_product_returning': (_INSERT_PRODUCT + ' RETURNING id', False),
+    'update_product': (
+        'UPDATE product SET name = ?, stock = ?, price = ?, description = ? WHERE id = ? AND owner_id = ?', False
+    ),
+    'delete_product': ('DELETE FROM product WHERE id = ? AND owner_id = ?', False),
+    'delete_product_returning': ('DELETE FROM product WHERE id = ? AND owner_id = ? RETURNING id', False),
+    'set_product_stock': ('UPDATE product SET stock = ? WHERE id = ? AND owner_id = ?', False),
+    # The products of a stock batch, locked until it commits; see POST /stock/batch
+    'products_for_batch': ({'postgresql': (
+        'SELECT id, name, price, stock FROM product WHERE owner_id = ? AND id = ANY(?) FOR UPDATE'
+    )}, False),
+    # A batch of imported products in one statement, one array per column; see shoptrack.importer
+    'import_products': ({'postgresql': (
+        'INSERT INTO product (name, stock, price, description, owner_id) '
+        'SELECT * FROM unnest(?::text[], ?::int[], ?::numeric[], ?::text[], ?::int[]) RETURNING id'
+    )}, False),
+    # Ranked full-text search; see shoptrack.search and the 0007 migrations.
+    # bm25() is lower for better matches, ts_rank() higher.
+    'search_products': ({
+        'sqlite': '''
+            SELECT product.* FROM product_search
+            JOIN product ON product.id = product_search.rowid
+            WHERE product_search MATCH ? AND product.owner_id = ?
+            ORDER BY bm25(product_search, 10.0, 1.0), product.id
+            LIMIT ? OFFSET ?
+        ''',
+        'postgresql': '''
+            SELECT product.* FROM product, to_tsquery('simple', ?) AS terms
+            WHERE product.owner_id = ? AND product_search_document(product.name, product.description) @@ terms
+            ORDER BY ts_rank(product_search_document(product.name, product.description), terms) DESC, product.id
+            LIMIT ? OFFSET ?
+        ''',
+    }, True),
+    'max_product_id': ('SELECT COALESCE(MAX(id), 0) AS id FROM product', False),
+
+    # Stock changes
+    'add_stock': (_ADD_STOCK, False),
+    'add_stock_returning': (_ADD_STOCK + ' RETURNING name, price, stock', True),
+    'remove_stock': (_REMOVE_STOCK, False),
+    'remove_stock_returning': (_REMOVE_STOCK + ' RETURNING name, price, stock', True),
+    # Remove stock on PostgreSQL in one round trip: the UPDATE only matches
+    # when enough stock is left, and the outer SELECT still sees the product
+    # row, so "not found" and "insufficient stock" can be told apart.
+    'remove_stock_checked': ({'postgresql': '''
+        WITH target AS (
+            SELECT id, stock FROM product WHERE id = ? AND owner_id = ?
+        ), updated AS (
+            UPDATE product SET stock = product.stock - ?
+            FROM target
+            WHERE product.id = target.id AND product.stock >= ?
+            RETURNING product.name, product.price, product.stock
+        )
+        SELECT target.stock AS available, updated.name, updated.price, updated.stock
+        FROM target LEFT JOIN updated ON TRUE
+    '''}, True),
+
+    # History
+    'insert_history': (_INSERT_HISTORY, True),
+    # Backdated rows, for the synthetic data of shoptrack.bench
+    'insert_history_at': (
+        'INSERT INTO history (product_id, product_name, user_id, price, quantity, action, created) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', False
+    ),
+    'history_by_user': ('SELECT * FROM history WHERE user_id = ? ORDER BY created DESC, id DESC', True),
+    'history_by_owned_product': (OWNED_PRODUCT_HISTORY + ' ORDER BY created DESC, id DESC', True),
+    # Initial 'buy' rows for a batch of imported products; see shoptrack.importer
+    'import_history_by_ids': ({'postgresql': _IMPORT_HISTORY + 'WHERE id = ANY(?) AND stock > 0 ORDER BY id'}, False),
+    'import_history_after_id': ({'sqlite': _IMPORT_HISTORY + 'WHERE owner_id = ? AND id > ? AND stock > 0 ORDER BY id'}, False),
+    'history_export': (
+        'SELECT id, product_id, product_name, user_id, price, quantity, action, created FROM history '
+        'WHERE user_id = ? ORDER BY created, id', False
+    ),
+
+    # Derived tables
+    'inventory_version': ('SELECT version FROM inventory_version WHERE owner_id = ?', True),
+    'inventory_summary': (
+        'SELECT product_count, units_on_hand, inventory_value, units_bought, buy_total, units_sold, sell_total, '
+        'updated FROM inventory_summary WHERE owner_id = ?', True
+    ),
+
+    # Delta sync; see shoptrack.changes and the 0009 migrations
+    'sync_versions': (
+        'SELECT inventory_version.version, COALESCE(product_change_pruned.version, 0) AS pruned '
+        'FROM inventory_version LEFT JOIN product_change_pruned '
+        'ON product_change_pruned.owner_id = inventory_version.owner_id '
+        'WHERE inventory_version.owner_id = ?', True
+    ),
+    'changed_products': (
+        'SELECT product.* FROM product_change '
+        'JOIN product ON product.id = product_change.product_id AND product.owner_id = product_change.owner_id '
+        'WHERE product_change.owner_id = ? AND product_change.version > ? AND product_change.version <= ? '
+        'AND product_change.deleted IS NULL ORDER BY product_change.version', True
+    ),
+    'deleted_products': (
+        'SELECT product_id FROM product_change WHERE owner_id = ? AND version > ? AND version <= ? '
+        'AND deleted IS NOT NULL ORDER BY version', True
+    ),
+
+    # Live events, NOTIFYed in order; see shoptrack.events
+    'notify_stock_events': (
+        {'postgresql': "SELECT pg_notify('stock_events', payload) FROM unnest(?::text[]) AS payload"}, False
+    ),
+}
+
+
+class Statement:
+    """One named statement compiled for one dialect."""
+
+    __slots__ = ('name', 'sql', 'prepare_sql', 'execute_sql')
+
+    def __init__(self, name, sql, prepare_sql=None, execute_sql=None):
+        self.name = name
+        self.sql = sql
+        self.prepare_sql = prepare_sql
+        self.execute_sql = execute_sql
+
+
+def numbered_placeholders(sql):
+    """Replace ``?`` placeholders with PostgreSQL's ``$1``, ``$2``, ..."""
+    counter = iter(range(1, sql.count('?') + 1))
+    return re.sub(r'\?', lambda match: f'${next(counter)}', sql)
+
+def compile_statements(dialect, prepare=True):
+    """Compile STATEMENTS for ``dialect``; statements written for other dialects only are skipped."""
+    compiled = {}
+    for name, (sql, prepared) in STATEMENTS.items():
+        if isinstance(sql, dict):
+            if dialect not in sql:
+                continue
+            sql = sql[dialect]
+        sql = ' '.join(sql.split())
+
+        if dialect == 'sqlite':
+            compiled[name] = Statement(name, sql)
+            continue
+
+        # psycopg2 interpolates with %, so literal percent signs must be doubled
+        pg_sql = sql.replace('%', '%%').replace('?', '%s')
+        if not (prepare and prepared):
+            compiled[name] = Statement(name, pg_sql)
+            continue
+
+        params = sql.count('?')
+        arguments = f" ({', '.join(['%s'] * params)})" if params else ''
+        compiled[name] = Statement(
+            name,
+            pg_sql,
+            prepare_sql=f'PREPARE {PREPARED_PREFIX}{name} AS {numbered_placeholders(sql).replace("%", "%%")}',
+            execute_sql=f'EXECUTE {PREPARED_PREFIX}{name}{arguments}',
+        )
+    return compiled
+
+# Prepared statement names per pooled PostgreSQL connection
+_prepared = weakref.WeakKeyDictionary()
+
+def statement_sql(name):
+    """Plain SQL of the named statement for the active dialect, for execute_many() and iter_query()."""
+    return current_app.extensions['queries'][get_dialect()][name].sql
+
+def asyncpg_sql(name):
+    """PostgreSQL SQL of the named statement with ``$1``-style placeholders, for the ASGI mode."""
+    sql = STATEMENTS[name][0]
+    if isinstance(sql, dict):
+        sql = sql['postgresql']
+    return numbered_placeholders(' '.join(sql.split()))
+
+def run_query(name, params=()):
+    """Execute the named statement on the request's connection and return the cursor."""
+    db = get_db()
+    statement = current_app.extensions['queries'][get_dialect()][name]
+    if statement.prepare_sql is None:
+        return execute_query(statement.sql, params)
+
+    prepared = _prepared.setdefault(db, set())
+    if name not in prepared:
+        # PREPARE is not transactional, so a later rollback does not undo it
+        execute_query(statement.prepare_sql, ())
+        prepared.add(name)
+    return execute_query(statement.execute_sql, params)
+
+def init_app(app):
+    prepare = app.config['DB_PREPARE_STATEMENTS']
+    app.extensions['queries'] = {dialect: compile_statements(dialect, prepare) for dialect in DIALECTS}
@@ -0,0 +1,196 @@
+"""Token-bucket rate limiting shared by every worker on a host.
+
+Each blueprint can have its own limit, written as ``N/period`` (for
+example ``10/minute``): a bucket holds up to N tokens, each request takes
+one, and tokens come back at N per period. /auth is limited per client IP
+before the request is handled, so login floods never reach the password
+hash. Other blueprints are limited per user, right after login_required
+has resolved the token and before the view touches the database.
+
+Buckets live in a small SQLite file (RATE_LIMIT_STORE, by default in the
+instance folder) that all gunicorn workers share. ``memory`` keeps them in
+the worker instead, which is only right for a single process.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, jsonify, request
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+# Blueprints limited per client IP rather than per user
+IP_SCOPES = ('auth',)
+# Takes between two sweeps of buckets that are full again
+PRUNE_EVERY = 1000
+
+
+def parse_rate(value):
+    """``'10/minute'`` -> ``(capacity, tokens per second)``; None or '' or '0' -> None."""
+    if value is None or str(value).strip() in ('', '0'):
+        return None
+    try:
+        count, period = str(value).split('/')
+        count = int(count)
+        seconds = PERIODS[period.strip().rstrip('s')]
+    except (KeyError, ValueError):
+        raise ValueError(f"Rate limit must look like 10/minute, not {value!r}")
+    if count <= 0:
+        raise ValueError(f"Rate limit must allow at least one request, not {value!r}")
+    return count, count / seconds
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + max(now - updated, 0) * rate)
+
+
+class MemoryBucketStore:
+    """Buckets in this process only."""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        # key -> (tokens, updated, full_at)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, capacity, rate):
+        """Take one token from ``key``'s bucket; return 0, or the seconds until one is available."""
+        now = self.clock()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            wait = 0
+            if tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                # A missing bucket is a full one
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+            return wait
+
+
+class SQLiteBucketStore:
+    """Buckets in a SQLite file, so every worker process sees the same counts.
+
+    A bucket without a row is full. Rows are removed once their bucket has
+    refilled, which keeps the table as small as the set of active clients.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connect(self):
+        # One connection per thread, and never one inherited through fork()
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            # The counts are disposable, so durability is traded for speed
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = OFF')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, full_at REAL NOT NULL)'
+            )
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def take(self, key, capacity, rate):
+        """Take one token from ``key``'s bucket; return 0, or the seconds until one is available."""
+        db = self._connect()
+        now = self.clock()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            wait = 0
+            if tokens < 1:
+                wait = (1 - tokens) / rate
+            else:
+                tokens -= 1
+            db.execute(
+                'INSERT INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET '
+                'tokens = excluded.tokens, updated = excluded.updated, full_at = excluded.full_at',
+                (key, tokens, now, now + (capacity - tokens) / rate)
+            )
+
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                db.execute('DELETE FROM buckets WHERE full_at <= ?', (now,))
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return wait
+
+
+class RateLimiter:
+    """The configured limit per blueprint and the store holding the buckets."""
+
+    def __init__(self, limits, store):
+        self.limits = limits
+        self.store = store
+
+    def check(self, scope, identity):
+        """Charge one request to ``identity`` within ``scope``; return 0 or the seconds to wait."""
+        limit = self.limits.get(scope)
+        if limit is None:
+            return 0
+        capacity, rate = limit
+        return self.store.take(f'{scope}:{identity}', capacity, rate)
+
+
+TOO_MANY_REQUESTS = 'Too many requests, please retry later.'
+
+def retry_after(wait):
+    """Retry-After header value for a wait returned by RateLimiter.check()."""
+    return str(max(math.ceil(wait), 1))
+
+def client_ip(remote_addr, forwarded_for, hops):
+    """The client address as ProxyFix(x_for=hops) sees it, for the async serving mode."""
+    if hops and forwarded_for:
+        values = [value.strip() for value in forwarded_for.split(',')]
+        if len(values) >= hops:
+            return values[-hops]
+    return remote_addr
+
+def _too_many_requests(wait):
+    return jsonify({'error': TOO_MANY_REQUESTS}), 429, {'Retry-After': retry_after(wait)}
+
+def limit_user(user_id):
+    """Called by login_required; returns a 429 response when ``user_id`` is over its limit."""
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is None or request.blueprint in IP_SCOPES:
+        return None
+    wait = limiter.check(request.blueprint, f'user:{user_id}')
+    return _too_many_requests(wait) if wait else None
+
+def _limit_ip():
+    limiter = current_app.extensions['rate_limiter']
+    # CORS preflights are answered without any work and are not charged
+    if request.blueprint not in IP_SCOPES or request.method == 'OPTIONS':
+        return None
+    wait = limiter.check(request.blueprint, f'ip:{request.remote_addr}')
+    return _too_many_requests(wait) if wait else None
+
+def init_app(app):
+    limits = {}
+    for scope, value in app.config['RATE_LIMITS'].items():
+        limit = parse_rate(value)
+        if limit is not None:
+            limits[scope] = limit
+    if not limits:
+        return
+
+    path = app.config['RATE_LIMIT_STORE'] or os.path.join(app.instance_path, 'ratelimit.sqlite')
+    store = MemoryBucketStore() if path == 'memory' else SQLiteBucketStore(path)
+    app.extensions['rate_limiter'] = RateLimiter(limits, store)
+    app.before_request(_limit_ip)
@@ -0,0 +1,105 @@
+from datetime import date
+
+from shoptrack.db import get_dialect, get_placeholder, execute_query
+
+BUCKETS = ('day', 'week', 'month')
+ROLLUP_COLUMNS = ('units_bought', 'buy_total', 'units_sold', 'sell_total', 'transactions')
+MONEY_COLUMNS = ('buy_total', 'sell_total')
+
+# Start date of the bucket each history_rollup day falls in. Weeks start on Monday.
+BUCKET_EXPRESSIONS = {
+    'sqlite': {
+        'day': 'day',
+        'week': "date(day, '-' || ((CAST(strftime('%w', day) AS INTEGER) + 6) % 7) || ' days')",
+        'month': "date(day, 'start of month')",
+    },
+    'postgresql': {
+        'day': 'day',
+        'week': "date_trunc('week', day)::date",
+        'month': "date_trunc('month', day)::date",
+    },
+}
+
+
+def parse_date_arg(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+
+def validate_rollup_args(args):
+    """Parse ``bucket``, ``from``, ``to`` and ``product_id`` query parameters.
+
+    Returns ``(True, options)`` or ``(False, message)``. ``from`` and ``to``
+    are inclusive and either may be omitted.
+    """
+    bucket = args.get('bucket', 'day')
+    if bucket not in BUCKETS:
+        return False, f"Bucket must be one of: {', '.join(BUCKETS)}"
+
+    try:
+        start = parse_date_arg(args['from'], 'from') if args.get('from') else None
+        end = parse_date_arg(args['to'], 'to') if args.get('to') else None
+    except ValueError as e:
+        return False, str(e)
+
+    if start and end and start > end:
+        return False, "from must not be after to"
+
+    product_id = args.get('product_id')
+    if product_id is not None:
+        try:
+            product_id = int(product_id)
+        except ValueError:
+            return False, "product_id must be an integer"
+
+    return True, {'bucket': bucket, 'start': start, 'end': end, 'product_id': product_id}
+
+def rollup_query(user_id, dialect, bucket='day', start=None, end=None, product_id=None, placeholder='?'):
+    """SQL and parameters of get_rollup() for ``dialect``."""
+    period = BUCKET_EXPRESSIONS[dialect][bucket]
+
+    conditions = [f'user_id = {placeholder}']
+    params = [user_id]
+    if product_id is not None:
+        conditions.append(f'product_id = {placeholder}')
+        params.append(product_id)
+    # SQLite stores days as text
+    if start is not None:
+        conditions.append(f'day >= {placeholder}')
+        params.append(start if dialect == 'postgresql' else start.isoformat())
+    if end is not None:
+        conditions.append(f'day <= {placeholder}')
+        params.append(end if dialect == 'postgresql' else end.isoformat())
+
+    totals = ', '.join(f'SUM({column}) AS {column}' for column in ROLLUP_COLUMNS)
+    query = (
+        f'SELECT {period} AS period, {totals} FROM history_rollup '
+        f'WHERE {" AND ".join(conditions)} GROUP BY period ORDER BY period'
+    )
+    return query, tuple(params)
+
+def rollup_rows(rows):
+    """The rows of a rollup query as response items."""
+    items = []
+    for row in rows:
+        row = dict(row)
+        if isinstance(row['period'], date):
+            row['period'] = row['period'].isoformat()
+        for column in MONEY_COLUMNS:
+            # SQLite keeps money in REAL columns; hide the float drift of running sums
+            if isinstance(row[column], float):
+                row[column] = round(row[column], 2)
+        items.append(row)
+    return items
+
+def get_rollup(user_id, bucket='day', start=None, end=None, product_id=None):
+    """Buy/sell totals per ``bucket`` for one user, oldest bucket first.
+
+    Reads the day rows that the history insert trigger maintains, so the
+    current bucket already includes the newest transactions.
+    """
+    query, params = rollup_query(
+        user_id, get_dialect(), bucket, start, end, product_id, placeholder=get_placeholder()
+    )
+    return rollup_rows(execute_query(query, params).fetchall())
@@ -1,42 +1,15 @@
+-- Reset script used by `flask init-db`. Tables, indexes and their later
+-- changes live in the versioned migrations under migrations/<dialect>/,
+-- which init-db applies right after this script.
+
 DROP TABLE IF EXISTS history;
 DROP TABLE IF EXISTS sessions;
 DROP TABLE IF EXISTS product;
+DROP TABLE IF EXISTS product_search;
+DROP TABLE IF EXISTS inventory_summary;
+DROP TABLE IF EXISTS history_rollup;
+DROP TABLE IF EXISTS inventory_version;
+DROP TABLE IF EXISTS product_change;
+DROP TABLE IF EXISTS product_change_pruned;
 DROP TABLE IF EXISTS "user";
-
-CREATE TABLE user (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL,
-    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
-);
-
-CREATE TABLE product (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT NOT NULL,
-    stock INTEGER NOT NULL CHECK (stock >= 0),
-    price REAL NOT NULL CHECK (price > 0),
-    description TEXT,
-    owner_id INTEGER NOT NULL,
-    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (owner_id) REFERENCES user (id)
-);
-
-CREATE TABLE history (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    product_id INTEGER,
-    product_name TEXT NOT NULL,
-    user_id INTEGER NOT NULL,
-    price REAL NOT NULL CHECK (price > 0),
-    quantity INTEGER NOT NULL CHECK (quantity > 0),
-    action TEXT NOT NULL CHECK (action IN ('buy', 'sell')),
-    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES user (id)
-);
-
-CREATE TABLE sessions (
-    id TEXT PRIMARY KEY,
-    user_id INTEGER NOT NULL,
-    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
-    expires TIMESTAMP NOT NULL,
-    FOREIGN KEY (user_id) REFERENCES user (id)
-);
\ No newline at end of file
+DROP TABLE IF EXISTS schema_version;
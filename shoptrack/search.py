@@ -0,0 +1,84 @@
+import base64
+import binascii
+import re
+
+from shoptrack.db import get_dialect
+from shoptrack.queries import run_query
+from shoptrack.serialize import RowSet
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Words of ``q`` used in the search; the rest are ignored
+MAX_TERMS = 10
+# Matches stop being paged after this many, like most search engines
+MAX_OFFSET = 1000
+
+# Letters and digits; punctuation and underscores separate words, as in the
+# unicode61 tokenizer and PostgreSQL's 'simple' parser
+WORD = re.compile(r'[^\W_]+')
+
+
+def search_terms(text):
+    return WORD.findall(text.lower())[:MAX_TERMS]
+
+def match_expression(terms, dialect):
+    """Search expression matching products that contain every term, each as a word prefix."""
+    if dialect == 'postgresql':
+        return ' & '.join(f'{term}:*' for term in terms)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def _encode_offset(offset):
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip('=')
+
+def _decode_offset(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        offset = int(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    if offset < 0 or offset > MAX_OFFSET:
+        raise ValueError('Invalid cursor')
+    return offset
+
+def validate_search_args(args):
+    """Parse ``q``, ``limit`` and ``cursor`` query parameters.
+
+    Returns ``(True, options)`` or ``(False, message)``.
+    """
+    terms = search_terms(args.get('q', ''))
+    if not terms:
+        return False, "q must contain at least one word"
+
+    try:
+        limit = int(args.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        return False, "Limit must be an integer"
+    if limit < 1 or limit > MAX_LIMIT:
+        return False, f"Limit must be between 1 and {MAX_LIMIT}"
+
+    offset = 0
+    if args.get('cursor'):
+        try:
+            offset = _decode_offset(args['cursor'])
+        except ValueError as e:
+            return False, str(e)
+
+    return True, {'terms': terms, 'limit': limit, 'offset': offset}
+
+def search_products(owner_id, terms, limit=DEFAULT_LIMIT, offset=0):
+    """One page of ``owner_id``'s products matching ``terms``, best match first.
+
+    Matches in the name weigh more than matches in the description. Returns the
+    same ``{'items', 'next_cursor'}`` shape as the paginated list endpoints.
+    """
+    expression = match_expression(terms, get_dialect())
+    # One extra row tells whether there is another page
+    rows = run_query('search_products', (expression, owner_id, limit + 1, offset)).fetchall()
+    return search_page(rows, limit, offset)
+
+def search_page(rows, limit, offset):
+    """The response for up to ``limit + 1`` matches fetched from ``offset``."""
+    next_cursor = None
+    if len(rows) > limit and offset + limit <= MAX_OFFSET:
+        next_cursor = _encode_offset(offset + limit)
+    return {'items': RowSet(rows[:limit]), 'next_cursor': next_cursor}
@@ -0,0 +1,129 @@
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DATETIME_FORMATS = ('http', 'iso')
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_datetime(value):
+    """RFC 822 date as produced by werkzeug's http_date(), without its generic parsing path."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        hour, minute, second = value.hour, value.minute, value.second
+    else:
+        hour = minute = second = 0
+    return (
+        f'{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} '
+        f'{hour:02d}:{minute:02d}:{second:02d} GMT'
+    )
+
+
+class RowSet:
+    """Query rows plus their column names, computed once for the whole result.
+
+    Accepts sqlite3.Row, psycopg2 RealDictRow and asyncpg Record rows.
+    ShopTrackJSONProvider encodes it as a list of objects: RealDictRows are
+    dicts already and are encoded as they are, the other rows are zipped
+    with the column names.
+    """
+
+    __slots__ = ('columns', 'rows')
+
+    def __init__(self, rows, columns=None):
+        self.rows = rows
+        if columns is None:
+            columns = tuple(rows[0].keys()) if rows else ()
+        self.columns = tuple(columns)
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        return cls(cursor.fetchall(), [column[0] for column in cursor.description or ()])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.records())
+
+    def records(self):
+        # A RealDictRow is a dict subclass, which both encoders write natively
+        if not self.rows or isinstance(self.rows[0], dict):
+            return self.rows
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in self.rows]
+
+
+class ShopTrackJSONProvider(DefaultJSONProvider):
+    """JSON provider with a fast path for query results.
+
+    Decimal and datetime values are encoded by type lookup instead of
+    Flask's isinstance chain, RowSet results are encoded without copying
+    PostgreSQL rows, and orjson, which does most of the speedup, is used
+    when it is installed. ``datetime_format``
+    is ``'http'`` (RFC 822, Flask's format) or ``'iso'`` (ISO 8601, which
+    orjson writes natively).
+
+    Settings are read from the app config, so create it after the config
+    is loaded.
+    """
+
+    datetime_format = 'http'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.compact = app.config.get('JSON_COMPACT', self.compact)
+        self.datetime_format = app.config.get('JSON_DATETIME_FORMAT', self.datetime_format)
+        if self.datetime_format not in DATETIME_FORMATS:
+            raise ValueError(f"JSON_DATETIME_FORMAT must be one of: {', '.join(DATETIME_FORMATS)}")
+
+        if self.datetime_format == 'http':
+            format_datetime = format_date = http_datetime
+        else:
+            format_datetime, format_date = datetime.isoformat, date.isoformat
+        self._encoders = {
+            Decimal: str,
+            datetime: format_datetime,
+            date: format_date,
+            RowSet: RowSet.records,
+        }
+
+        self._orjson_option = None
+        if orjson is not None:
+            self._orjson_option = orjson.OPT_NON_STR_KEYS
+            if self.sort_keys:
+                self._orjson_option |= orjson.OPT_SORT_KEYS
+            if self.datetime_format == 'http':
+                self._orjson_option |= orjson.OPT_PASSTHROUGH_DATETIME
+
+    def default(self, o):
+        encoder = self._encoders.get(type(o))
+        if encoder is not None:
+            return encoder(o)
+        return DefaultJSONProvider.default(o)
+
+    def is_compact(self):
+        return self.compact or (self.compact is None and not self._app.debug)
+
+    def encode(self, obj):
+        """Serialize ``obj`` to UTF-8 bytes in the configured compact or indented layout."""
+        compact = self.is_compact()
+        if self._orjson_option is not None:
+            option = self._orjson_option if compact else self._orjson_option | orjson.OPT_INDENT_2
+            return orjson.dumps(obj, default=self.default, option=option)
+        if compact:
+            return self.dumps(obj, separators=(',', ':')).encode()
+        return self.dumps(obj, indent=2).encode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.encode(obj) + b'\n', mimetype=self.mimetype)
@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from shoptrack.db import get_db, get_placeholder, execute_query
+
+
+def purge_sessions(batch_size=1000, max_per_user=0, now=None):
+    """Delete expired sessions, then sessions beyond ``max_per_user`` per user.
+
+    Rows are removed ``batch_size`` at a time with a commit after each
+    batch, so the purge never holds locks on the whole table. A
+    ``max_per_user`` of 0 disables the cap. Returns the number of rows
+    removed for each reason and the elapsed time in seconds.
+    """
+    started = time.monotonic()
+    now = now or datetime.now()
+    placeholder = get_placeholder()
+    db = get_db()
+
+    expired = 0
+    while True:
+        cursor = execute_query(f'''
+            DELETE FROM sessions WHERE id IN (
+                SELECT id FROM sessions WHERE expires < {placeholder} ORDER BY expires LIMIT {placeholder}
+            )
+        ''', (now, batch_size))
+        removed = cursor.rowcount
+        db.commit()
+        expired += removed
+        if removed < batch_size:
+            break
+
+    over_cap = 0
+    if max_per_user > 0:
+        # Keep each user's sessions that expire last; older logins go first
+        cache = current_app.extensions.get('token_cache')
+        while True:
+            cursor = execute_query(f'''
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY expires DESC, id DESC) AS position
+                    FROM sessions
+                ) ranked
+                WHERE position > {placeholder}
+                LIMIT {placeholder}
+            ''', (max_per_user, batch_size))
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                break
+
+            execute_query(
+                f'DELETE FROM sessions WHERE id IN ({", ".join([placeholder] * len(ids))})', tuple(ids)
+            )
+            db.commit()
+            over_cap += len(ids)
+            if cache is not None:
+                for token in ids:
+                    cache.pop(token)
+            if len(ids) < batch_size:
+                break
+
+    return {'expired': expired, 'over_cap': over_cap, 'elapsed': time.monotonic() - started}
+
+def _purge_from_config():
+    config = current_app.config
+    return purge_sessions(
+        batch_size=config['SESSION_PURGE_BATCH'],
+        max_per_user=config['SESSION_MAX_PER_USER'],
+    )
+
+def _format_result(result):
+    return (
+        f"Removed {result['expired']} expired and {result['over_cap']} over-cap sessions "
+        f"in {result['elapsed'] * 1000:.1f} ms."
+    )
+
+def start_reaper(app):
+    """Purge sessions every ``SESSION_REAPER_INTERVAL`` seconds on a daemon thread."""
+    interval = app.config['SESSION_REAPER_INTERVAL']
+    stop = threading.Event()
+
+    def run():
+        # Spread the first run so workers started together don't purge in lockstep
+        if stop.wait(random.uniform(0, interval)):
+            return
+        while True:
+            try:
+                with app.app_context():
+                    result = _purge_from_config()
+                if result['expired'] or result['over_cap']:
+                    app.logger.info(_format_result(result))
+            except Exception as e:
+                app.logger.error(f'Session reaper failed: {e}')
+            if stop.wait(interval):
+                return
+
+    thread = threading.Thread(target=run, name='shoptrack-session-reaper', daemon=True)
+    thread.start()
+    return stop
+
+
+sessions_cli = AppGroup('sessions', help='Manage login sessions.')
+
+@sessions_cli.command('purge')
+@click.option('--batch-size', type=int, default=None, help='Rows deleted per transaction.')
+@click.option('--max-per-user', type=int, default=None, help='Live sessions kept per user (0 = unlimited).')
+def purge_command(batch_size, max_per_user):
+    """Delete expired sessions and enforce the per-user session cap."""
+    config = current_app.config
+    result = purge_sessions(
+        batch_size=batch_size or config['SESSION_PURGE_BATCH'],
+        max_per_user=config['SESSION_MAX_PER_USER'] if max_per_user is None else max_per_user,
+    )
+    click.echo(_format_result(result))
+
+def init_app(app):
+    app.cli.add_command(sessions_cli)
+    if app.config['SESSION_REAPER_INTERVAL'] > 0:
+        app.extensions['session_reaper'] = start_reaper(app)
@@ -1,36 +1,144 @@
+import csv
+import io
 import os
-from flask import Blueprint, jsonify, request, g
+from flask import Blueprint, Response, current_app, jsonify, request, g, stream_with_context
 from shoptrack.auth import login_required
-from shoptrack.db import get_db, get_placeholder, execute_query
+from shoptrack.db import (
+    get_db, get_dialect, get_placeholder, execute_query, execute_many, iter_query, begin_write,
+    supports_returning
+)
+from shoptrack import importer
+from shoptrack.changes import validate_changes_args, get_changes
+from shoptrack.etag import inventory_conditional, get_inventory_version
+from shoptrack.groupcommit import run_write
+from shoptrack.events import (
+    EventStream, Subscription, get_hub, record_events, commit_and_publish, product_change, stock_change
+)
+from shoptrack.history import validate_history_args, has_filters, history_query
+from shoptrack.pagination import validate_page_args, paginate_query, page_response
+from shoptrack.queries import run_query, statement_sql
+from shoptrack.rollup import validate_rollup_args, get_rollup
+from shoptrack.search import validate_search_args, search_products
+from shoptrack.serialize import RowSet
+from shoptrack.summary import get_summary
 from shoptrack.validation import (
     validate_product_data, 
     validate_product_ownership,
-    validate_stock_operation, 
     validate_json_request,
-    validate_stock_data
+    validate_stock_data,
+    validate_batch_data,
+    validate_batch_item
 )
 
 bp = Blueprint('stock', __name__, url_prefix='/stock')
 
+HISTORY_COLUMNS = ('id', 'product_id', 'product_name', 'user_id', 'price', 'quantity', 'action', 'created')
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# Rows buffered into each chunk written to the client
+EXPORT_CHUNK_ROWS = 500
+
 @bp.route('/', methods=['GET'])
 @login_required
+@inventory_conditional
 def get_stock():
-    placeholder = get_placeholder()
-    cursor = execute_query(f'SELECT * FROM product WHERE owner_id = {placeholder} ORDER BY created DESC', (g.user_id,))
-    products = cursor.fetchall()
+    is_valid, page = validate_page_args(request.args)
+    if not is_valid:
+        return jsonify({'error': page}), 400
+    
+    if page is not None:
+        placeholder = get_placeholder()
+        query, params = paginate_query(
+            f'SELECT * FROM product WHERE owner_id = {placeholder}', (g.user_id,), page, placeholder
+        )
+        return jsonify(page_response(execute_query(query, params).fetchall(), page))
+    
+    cursor = run_query('products_by_owner', (g.user_id,))
+    products = RowSet.from_cursor(cursor)
 
     if not products:
         return jsonify({'error': 'No products found'}), 404
     
-    # Convert SQLite Row objects to dictionaries
-    products_list = [dict(product) for product in products]
-    return jsonify(products_list)
+    return jsonify(products)
+
+@bp.route('/summary', methods=['GET'])
+@login_required
+def get_inventory_summary():
+    return jsonify(get_summary(g.user_id))
+
+@bp.route('/changes', methods=['GET'])
+@login_required
+def get_stock_changes():
+    is_valid, since = validate_changes_args(request.args)
+    if not is_valid:
+        return jsonify({'error': since}), 400
+    
+    return jsonify(get_changes(g.user_id, since))
+
+@bp.route('/events', methods=['GET'])
+@login_required
+def stock_events():
+    last_id = request.headers.get('Last-Event-ID')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({'error': 'Last-Event-ID must be an integer'}), 400
+    
+    # Each stream holds a worker thread for as long as the client stays
+    # connected; a single-threaded (sync) worker would serve nothing else
+    if not request.environ.get('wsgi.multithread'):
+        return jsonify({'error': 'Event streams need a threaded worker or the async serving mode'}), 503
+    hub = get_hub()
+    if hub.broadcaster.subscriber_count() >= current_app.config['EVENTS_MAX_SUBSCRIBERS']:
+        return jsonify({'error': 'Too many event streams, please retry shortly.'}), 503, {'Retry-After': '5'}
+    if get_dialect() == 'postgresql':
+        hub.listen(os.environ.get('DATABASE_URL'))
+    version = get_inventory_version(g.user_id) if last_id is not None else None
+    
+    # The body is produced after the request context, and with it the
+    # database connection, has been released, but the worker thread stays
+    # busy until the client disconnects; EVENTS_MAX_SUBSCRIBERS keeps some
+    # threads free for other requests.
+    return Response(
+        _event_stream(hub, EventStream(g.user_id, last_id), version, current_app.config['EVENTS_HEARTBEAT']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _event_stream(hub, stream, version, heartbeat):
+    subscription = Subscription(stream.owner_id, hub.max_queue)
+    replay = hub.broadcaster.subscribe(subscription, stream.last_id)
+    try:
+        yield stream.start(replay, version)
+        while True:
+            events = subscription.get(heartbeat)
+            if not events:
+                # A comment line keeps proxies from timing out an idle stream
+                yield ': keep-alive\n\n'
+                continue
+            text = stream.render(events)
+            if text:
+                yield text
+    finally:
+        hub.broadcaster.unsubscribe(subscription)
+
+@bp.route('/search', methods=['GET'])
+@login_required
+@inventory_conditional
+def search_stock():
+    is_valid, options = validate_search_args(request.args)
+    if not is_valid:
+        return jsonify({'error': options}), 400
+    
+    return jsonify(search_products(g.user_id, **options))
 
 @bp.route('/<int:id>', methods=['GET'])
 @login_required
+@inventory_conditional
 def get_product(id):
-    placeholder = get_placeholder()
-    cursor = execute_query(f'SELECT * FROM product WHERE id = {placeholder} AND owner_id = {placeholder}', (id, g.user_id))
+    cursor = run_query('product_by_id', (id, g.user_id))
     product = cursor.fetchone()
 
     if not product:
@@ -53,37 +161,43 @@ def create_product():
         return jsonify({'error': error}), 400
     
     try:
-        # Insert the product
-        placeholder = get_placeholder()
-        # Check if we're using PostgreSQL
-        database_url = os.environ.get('DATABASE_URL')
-        if database_url:
-            # PostgreSQL - use RETURNING
-            cursor = execute_query(
-                f'INSERT INTO product (name, stock, price, description, owner_id) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}) RETURNING id',
-                (data['name'], data['stock'], data['price'], data.get('description'), g.user_id)
-            )
-            product_id = cursor.fetchone()['id']
-        else:
-            # SQLite - use lastrowid
-            cursor = execute_query(
-                f'INSERT INTO product (name, stock, price, description, owner_id) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})',
-                (data['name'], data['stock'], data['price'], data.get('description'), g.user_id)
-            )
-            product_id = cursor.lastrowid
-        
-        # Record initial stock as a 'buy' transaction if stock > 0
-        if data['stock'] > 0:
-            execute_query(
-                f'INSERT INTO history (product_id, product_name, user_id, price, quantity, action) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})',
-                (product_id, data['name'], g.user_id, data['price'], data['stock'], 'buy')
-            )
-        
-        get_db().commit()
+        run_write(write_product, data)
         return jsonify({'message': 'Product created successfully.'}), 201
     except Exception as e:
         return jsonify({'error': 'Failed to create product'}), 500
 
+def write_product(data):
+    """Insert a validated product for the current user; returns ``(True, product_id)``."""
+    params = (data['name'], data['stock'], data['price'], data.get('description'), g.user_id)
+    if supports_returning():
+        product_id = run_query('insert_product_returning', params).fetchone()['id']
+    else:
+        # SQLite < 3.35 - use lastrowid
+        product_id = run_query('insert_product', params).lastrowid
+    
+    # Record initial stock as a 'buy' transaction if stock > 0
+    if data['stock'] > 0:
+        run_query(
+            'insert_history',
+            (product_id, data['name'], g.user_id, data['price'], data['stock'], 'buy')
+        )
+    
+    record_events(g.user_id, [product_change('product.created', product_id, data)])
+    return True, product_id
+
+@bp.route('/import', methods=['POST'])
+@login_required
+def import_stock():
+    body_format = importer.import_format(request.mimetype, request.args.get('format'))
+    if body_format is None:
+        formats = ', '.join(f'{name} ({mimetype})' for name, mimetype in importer.IMPORT_FORMATS.items())
+        return jsonify({'error': f"Body must be one of: {formats}"}), 400
+
+    # The body is parsed as it streams in, so large files are never held in memory
+    rows = importer.parse_rows(request.stream, body_format)
+    result = importer.import_products(rows, g.user_id, current_app.config['IMPORT_BATCH_SIZE'])
+    return jsonify(result), 200
+
 @bp.route('/<int:id>', methods=['PUT'])
 @login_required
 def update_product(id):
@@ -102,12 +216,12 @@ def update_product(id):
         return jsonify({'error': error}), 400
     
     try:
-        placeholder = get_placeholder()
-        execute_query(
-            f'UPDATE product SET name = {placeholder}, stock = {placeholder}, price = {placeholder}, description = {placeholder} WHERE id = {placeholder} AND owner_id = {placeholder}',
+        run_query(
+            'update_product',
             (data['name'], data['stock'], data['price'], data.get('description'), id, g.user_id)
         )
-        get_db().commit()
+        record_events(g.user_id, [product_change('product.updated', id, data)])
+        commit_and_publish()
         return jsonify({'message': 'Product updated successfully.'}), 200
     except Exception as e:
         return jsonify({'error': 'Failed to update product'}), 500
@@ -120,19 +234,81 @@ def delete_product(id):
         return jsonify({'error': product}), 404
     
     try:
-        placeholder = get_placeholder()
-        execute_query(
-            f'DELETE FROM product WHERE id = {placeholder} AND owner_id = {placeholder}',
-            (id, g.user_id)
-        )
-        get_db().commit()
+        run_query('delete_product', (id, g.user_id))
+        record_events(g.user_id, [('product.deleted', {'id': id})])
+        commit_and_publish()
         return jsonify({'message': 'Product deleted successfully.'}), 200
     except Exception as e:
         return jsonify({'error': 'Failed to delete product'}), 500
 
-@bp.route('/<int:id>/stock/add', methods=['PATCH'])
-@login_required
-def add_stock(id):
+def apply_stock_change(product_id, quantity, operation):
+    """Atomically add or remove stock for one of the current user's products.
+
+    The stock check and the update happen in a single conditional UPDATE, so
+    concurrent sales can never oversell or trip the CHECK constraint.
+    Returns ``(True, product)`` with the product's name, price and new stock,
+    or ``(False, message)``.
+    """
+    not_found = "Product not found or access denied"
+    
+    if operation == 'remove' and get_dialect() == 'postgresql':
+        # See remove_stock_checked in shoptrack.queries
+        cursor = run_query('remove_stock_checked', (product_id, g.user_id, quantity, quantity))
+        row = cursor.fetchone()
+        if row is None:
+            return False, not_found
+        if row['name'] is None:
+            return False, f"Insufficient stock. Available: {row['available']}, requested: {quantity}"
+        return True, row
+    
+    if operation == 'remove':
+        update = 'remove_stock'
+        params = (quantity, product_id, g.user_id, quantity)
+    else:
+        update = 'add_stock'
+        params = (quantity, product_id, g.user_id)
+    
+    if supports_returning():
+        row = run_query(f'{update}_returning', params).fetchone()
+    else:
+        # SQLite < 3.35: the UPDATE holds the write lock, so reading the row
+        # back inside the same transaction is still race free
+        cursor = run_query(update, params)
+        row = None
+        if cursor.rowcount:
+            row = run_query('product_row_by_id', (product_id,)).fetchone()
+    
+    if row is not None:
+        return True, row
+    
+    if operation == 'add':
+        return False, not_found
+    
+    # SQLite is in-process, so telling the two failures apart here costs no
+    # network round trip; the write lock taken by the UPDATE keeps it consistent.
+    current = run_query('product_stock_by_id', (product_id, g.user_id)).fetchone()
+    if current is None:
+        return False, not_found
+    return False, f"Insufficient stock. Available: {current['stock']}, requested: {quantity}"
+
+def write_stock_change(product_id, quantity, operation):
+    """Apply a stock change and record it in history; returns like apply_stock_change()."""
+    is_valid, product = apply_stock_change(product_id, quantity, operation)
+    if not is_valid:
+        return False, product
+    
+    # Record the transaction in history from the updated row
+    action = 'buy' if operation == 'add' else 'sell'
+    run_query(
+        'insert_history',
+        (product_id, product['name'], g.user_id, product['price'], quantity, action)
+    )
+    
+    change = quantity if operation == 'add' else -quantity
+    record_events(g.user_id, [stock_change(product_id, product, change)])
+    return True, product
+
+def _change_stock(id, operation):
     is_valid, result = validate_json_request()
     if not is_valid:
         return jsonify({'error': result}), 400
@@ -143,102 +319,273 @@ def add_stock(id):
     if not is_valid:
         return jsonify({'error': error}), 400
     
-    is_valid, product = validate_stock_operation(id, data['stock'], 'add')
-    if not is_valid:
-        return jsonify({'error': product}), 400
+    message, failure = {
+        'add': ('Stock added successfully.', 'Failed to add stock'),
+        'remove': ('Stock removed successfully.', 'Failed to remove stock'),
+    }[operation]
     
     try:
-        # Update stock
-        placeholder = get_placeholder()
-        execute_query(
-            f'UPDATE product SET stock = stock + {placeholder} WHERE id = {placeholder} AND owner_id = {placeholder}',
-            (data['stock'], id, g.user_id)
-        )
-        
-        # Record 'buy' transaction in history
-        execute_query(
-            f'INSERT INTO history (product_id, product_name, user_id, price, quantity, action) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})',
-            (id, product['name'], g.user_id, product['price'], data['stock'], 'buy')
-        )
-        
-        get_db().commit()
-        return jsonify({'message': 'Stock added successfully.'}), 200
+        is_valid, product = run_write(write_stock_change, id, data['stock'], operation)
+        if not is_valid:
+            return jsonify({'error': product}), 400
+        return jsonify({'message': message}), 200
     except Exception as e:
-        return jsonify({'error': 'Failed to add stock'}), 500
+        return jsonify({'error': failure}), 500
+
+@bp.route('/<int:id>/stock/add', methods=['PATCH'])
+@login_required
+def add_stock(id):
+    return _change_stock(id, 'add')
 
 @bp.route('/<int:id>/stock/remove', methods=['PATCH'])
 @login_required
 def remove_stock(id):
+    return _change_stock(id, 'remove')
+
+@bp.route('/batch', methods=['POST'])
+@login_required
+def batch_stock():
     is_valid, result = validate_json_request()
     if not is_valid:
         return jsonify({'error': result}), 400
     
     data = result
     
-    is_valid, error = validate_stock_data(data)
+    is_valid, error = validate_batch_data(data)
     if not is_valid:
         return jsonify({'error': error}), 400
     
-    is_valid, product = validate_stock_operation(id, data['stock'], 'remove')
-    if not is_valid:
-        return jsonify({'error': product}), 400
+    atomic = data.get('atomic', False)
+    items = data['items']
+    results = check_batch_items(items)
+    
+    if atomic and any(results):
+        return jsonify(batch_rejected(results)), 400
+    
+    product_ids = sorted({item['product_id'] for item, r in zip(items, results) if r is None})
     
     try:
-        # Update stock
-        placeholder = get_placeholder()
-        execute_query(
-            f'UPDATE product SET stock = stock - {placeholder} WHERE id = {placeholder} AND owner_id = {placeholder}',
-            (data['stock'], id, g.user_id)
-        )
+        # Lock the products for the whole batch, then check ownership and
+        # stock for every item with a single query.
+        begin_write()
+        products = {}
+        if product_ids and get_dialect() == 'postgresql':
+            cursor = run_query('products_for_batch', (g.user_id, product_ids))
+            products = {row['id']: dict(row) for row in cursor.fetchall()}
+        elif product_ids:
+            # BEGIN IMMEDIATE above already holds SQLite's write lock
+            placeholder = get_placeholder()
+            id_list = ', '.join([placeholder] * len(product_ids))
+            cursor = execute_query(
+                f'SELECT id, name, price, stock FROM product WHERE owner_id = {placeholder} AND id IN ({id_list})',
+                (g.user_id, *product_ids)
+            )
+            products = {row['id']: dict(row) for row in cursor.fetchall()}
+        original_stock = {product_id: product['stock'] for product_id, product in products.items()}
         
-        # Record 'sell' transaction in history
-        execute_query(
-            f'INSERT INTO history (product_id, product_name, user_id, price, quantity, action) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})',
-            (id, product['name'], g.user_id, product['price'], data['stock'], 'sell')
-        )
+        history_rows, changed = plan_batch(items, results, products, g.user_id)
         
-        get_db().commit()
-        return jsonify({'message': 'Stock removed successfully.'}), 200
+        failed = sum(1 for r in results if r['status'] == 'error')
+        if failed and atomic:
+            get_db().rollback()
+            return jsonify(batch_rejected(results)), 400
+        
+        if history_rows:
+            execute_many(
+                statement_sql('set_product_stock'),
+                [(product['stock'], product['id'], g.user_id) for product in changed]
+            )
+            execute_many(statement_sql('insert_history'), history_rows)
+            # One event per product, in the order set_product_stock updated them
+            record_events(g.user_id, [
+                stock_change(product['id'], product, product['stock'] - original_stock[product['id']])
+                for product in changed
+            ])
+        
+        commit_and_publish()
+        return jsonify({'applied': len(history_rows), 'failed': failed, 'results': results}), 200
     except Exception as e:
-        return jsonify({'error': 'Failed to remove stock'}), 500
+        get_db().rollback()
+        return jsonify({'error': 'Failed to apply batch'}), 500
+
+def check_batch_items(items):
+    """Validate each batch item; returns a result slot per item, None where valid."""
+    results = [None] * len(items)
+    for index, item in enumerate(items):
+        is_valid, error = validate_batch_item(item)
+        if not is_valid:
+            results[index] = {'index': index, 'status': 'error', 'error': error}
+    return results
+
+def plan_batch(items, results, products, user_id):
+    """Apply the batch in order to ``products`` (id -> locked row dict).
+
+    Fills in ``results`` for every item that passed check_batch_items() and
+    returns the history rows to insert plus the products whose stock changed.
+    """
+    history_rows = []
+    changed = {}
+    for index, item in enumerate(items):
+        if results[index] is not None:
+            continue
+        
+        product = products.get(item['product_id'])
+        if product is None:
+            results[index] = {'index': index, 'status': 'error', 'error': "Product not found or access denied"}
+            continue
+        
+        quantity = item['quantity']
+        if item['action'] == 'remove':
+            if product['stock'] < quantity:
+                results[index] = {
+                    'index': index,
+                    'status': 'error',
+                    'error': f"Insufficient stock. Available: {product['stock']}, requested: {quantity}"
+                }
+                continue
+            product['stock'] -= quantity
+            history_action = 'sell'
+        else:
+            product['stock'] += quantity
+            history_action = 'buy'
+        
+        changed[product['id']] = product
+        history_rows.append(
+            (product['id'], product['name'], user_id, product['price'], quantity, history_action)
+        )
+        results[index] = {'index': index, 'status': 'ok', 'product_id': product['id'], 'stock': product['stock']}
+    
+    return history_rows, list(changed.values())
+
+def batch_rejected(results):
+    """Response body for an all-or-nothing batch with at least one bad item.
+
+    Reports which items failed and marks the rest as skipped, since nothing
+    was written.
+    """
+    failed = 0
+    for index, result in enumerate(results):
+        if result is not None and result['status'] == 'error':
+            failed += 1
+        else:
+            results[index] = {'index': index, 'status': 'skipped'}
+    return {'applied': 0, 'failed': failed, 'results': results}
 
 @bp.route('/history', methods=['GET'])
 @login_required
 def get_history():
-    placeholder = get_placeholder()
-    cursor = execute_query(f'''
-        SELECT * FROM history 
-        WHERE user_id = {placeholder} 
-        ORDER BY created DESC
-    ''', (g.user_id,))
-    history = cursor.fetchall()
+    is_valid, page = validate_page_args(request.args)
+    if not is_valid:
+        return jsonify({'error': page}), 400
+    
+    is_valid, filters = validate_history_args(request.args)
+    if not is_valid:
+        return jsonify({'error': filters}), 400
+    
+    if page is not None:
+        query, params = history_query(g.user_id, filters, page, placeholder=get_placeholder())
+        return jsonify(page_response(execute_query(query, params).fetchall(), page))
+    
+    if has_filters(filters):
+        query, params = history_query(g.user_id, filters, placeholder=get_placeholder())
+        cursor = execute_query(query, params)
+    else:
+        cursor = run_query('history_by_user', (g.user_id,))
+    history = RowSet.from_cursor(cursor)
 
     if not history:
         return jsonify({'error': 'No transaction history found'}), 404
     
-    # Convert SQLite Row objects to dictionaries
-    history_list = [dict(record) for record in history]
-    return jsonify(history_list)
+    return jsonify(history)
+
+@bp.route('/history/rollup', methods=['GET'])
+@login_required
+def get_history_rollup():
+    is_valid, options = validate_rollup_args(request.args)
+    if not is_valid:
+        return jsonify({'error': options}), 400
+    
+    rollup = get_rollup(g.user_id, **options)
+    return jsonify({'bucket': options['bucket'], 'rollup': rollup})
 
 @bp.route('/<int:id>/history', methods=['GET'])
 @login_required
 def get_product_history(id):
-    # Validate product ownership
-    is_valid, product = validate_product_ownership(id)
+    is_valid, page = validate_page_args(request.args)
     if not is_valid:
-        return jsonify({'error': product}), 404
+        return jsonify({'error': page}), 400
     
-    placeholder = get_placeholder()
-    cursor = execute_query(f'''
-        SELECT * FROM history 
-        WHERE product_id = {placeholder} AND user_id = {placeholder} 
-        ORDER BY created DESC
-    ''', (id, g.user_id))
-    history = cursor.fetchall()
-
-    if not history:
+    is_valid, filters = validate_history_args(request.args)
+    if not is_valid:
+        return jsonify({'error': filters}), 400
+    
+    # Ownership is checked by the history query itself; see OWNED_PRODUCT_HISTORY
+    if page is None and not has_filters(filters):
+        rows = run_query('history_by_owned_product', (id, g.user_id, g.user_id)).fetchall()
+    else:
+        query, params = history_query(g.user_id, filters, page, product_id=id, placeholder=get_placeholder())
+        rows = execute_query(query, params).fetchall()
+    
+    if not rows:
+        return jsonify({'error': 'Product not found or access denied'}), 404
+    if rows[0]['id'] is None:
+        rows = []
+    
+    if page is not None:
+        return jsonify(page_response(rows, page))
+    
+    if not rows:
         return jsonify({'error': 'No transaction history found for this product'}), 404
     
-    # Convert SQLite Row objects to dictionaries
-    history_list = [dict(record) for record in history]
-    return jsonify(history_list)
+    return jsonify(RowSet(rows))
+
+
+@bp.route('/history/export', methods=['GET'])
+@login_required
+def export_history():
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'error': f"Format must be one of: {', '.join(EXPORT_MIMETYPES)}"}), 400
+    
+    rows = iter_query(statement_sql('history_export'), (g.user_id,), name='history_export')
+    
+    # Nothing is queried until the first chunk is requested, so the response
+    # starts immediately and memory stays flat however many rows there are.
+    if export_format == 'csv':
+        body = _csv_chunks(rows)
+    else:
+        body = _ndjson_chunks(rows)
+    
+    return Response(
+        stream_with_context(body),
+        mimetype=EXPORT_MIMETYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename=history.{export_format}'}
+    )
+
+def _ndjson_chunks(rows):
+    dumps = current_app.json.dumps
+    lines = []
+    for row in rows:
+        lines.append(dumps(dict(row), separators=(',', ':')))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HISTORY_COLUMNS)
+    pending = 0
+    for row in rows:
+        record = [row[column] for column in HISTORY_COLUMNS]
+        record[-1] = record[-1].isoformat(sep=' ')
+        writer.writerow(record)
+        pending += 1
+        if pending >= EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
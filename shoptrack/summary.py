@@ -0,0 +1,80 @@
+import time
+
+import click
+from flask import g
+from flask.cli import AppGroup
+
+from shoptrack.db import get_db, execute_query, begin_write
+from shoptrack.queries import run_query
+
+SUMMARY_COLUMNS = (
+    'product_count', 'units_on_hand', 'inventory_value',
+    'units_bought', 'buy_total', 'units_sold', 'sell_total',
+)
+MONEY_COLUMNS = ('inventory_value', 'buy_total', 'sell_total')
+
+# Recomputes every owner's row from the base tables. The same query
+# backfills the table in the migration that creates it.
+REBUILD_SUMMARY = '''
+    INSERT INTO inventory_summary (
+        owner_id, product_count, units_on_hand, inventory_value,
+        units_bought, buy_total, units_sold, sell_total
+    )
+    SELECT u.id,
+           COALESCE(p.product_count, 0), COALESCE(p.units_on_hand, 0), COALESCE(p.inventory_value, 0),
+           COALESCE(h.units_bought, 0), COALESCE(h.buy_total, 0), COALESCE(h.units_sold, 0), COALESCE(h.sell_total, 0)
+    FROM "user" u
+    LEFT JOIN (
+        SELECT owner_id, COUNT(*) AS product_count, SUM(stock) AS units_on_hand, SUM(stock * price) AS inventory_value
+        FROM product GROUP BY owner_id
+    ) p ON p.owner_id = u.id
+    LEFT JOIN (
+        SELECT user_id,
+               SUM(CASE WHEN action = 'buy' THEN quantity ELSE 0 END) AS units_bought,
+               SUM(CASE WHEN action = 'buy' THEN quantity * price ELSE 0 END) AS buy_total,
+               SUM(CASE WHEN action = 'sell' THEN quantity ELSE 0 END) AS units_sold,
+               SUM(CASE WHEN action = 'sell' THEN quantity * price ELSE 0 END) AS sell_total
+        FROM history GROUP BY user_id
+    ) h ON h.user_id = u.id
+    WHERE p.owner_id IS NOT NULL OR h.user_id IS NOT NULL
+'''
+
+
+def get_summary(owner_id):
+    """Inventory and buy/sell totals for one owner, read from the maintained summary row."""
+    row = run_query('inventory_summary', (owner_id,)).fetchone()
+    if row is None:
+        summary = {column: 0 for column in SUMMARY_COLUMNS}
+        summary['updated'] = None
+        return summary
+
+    summary = dict(row)
+    for column in MONEY_COLUMNS:
+        # SQLite keeps money in REAL columns; hide the float drift of running sums
+        if isinstance(summary[column], float):
+            summary[column] = round(summary[column], 2)
+    return summary
+
+def rebuild_summary():
+    """Recompute inventory_summary from product and history in one transaction."""
+    started = time.monotonic()
+    begin_write()
+    if getattr(g, 'is_postgresql', False):
+        # Writers wait for the rebuild and then apply their deltas on top of it
+        execute_query('LOCK TABLE inventory_summary IN EXCLUSIVE MODE')
+    execute_query('DELETE FROM inventory_summary')
+    owners = execute_query(REBUILD_SUMMARY).rowcount
+    get_db().commit()
+    return {'owners': owners, 'elapsed': time.monotonic() - started}
+
+
+summary_cli = AppGroup('summary', help='Manage the per-owner inventory summary.')
+
+@summary_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every owner's summary row from the base tables."""
+    result = rebuild_summary()
+    click.echo(f"Rebuilt summary for {result['owners']} owners in {result['elapsed'] * 1000:.1f} ms.")
+
+def init_app(app):
+    app.cli.add_command(summary_cli)
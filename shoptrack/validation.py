@@ -1,5 +1,5 @@
 from flask import g, request
-from shoptrack.db import get_db, get_placeholder, execute_query
+from shoptrack.queries import run_query
 
 def validate_product_data(data, required_fields=None):
     if required_fields is None:
@@ -27,11 +27,7 @@ def validate_product_data(data, required_fields=None):
     return True, None
 
 def validate_product_ownership(product_id):
-    placeholder = get_placeholder()
-    cursor = execute_query(
-        f'SELECT * FROM product WHERE id = {placeholder} AND owner_id = {placeholder}', 
-        (product_id, g.user_id)
-    )
+    cursor = run_query('product_by_id', (product_id, g.user_id))
     product = cursor.fetchone()
     
     if not product:
@@ -39,19 +35,6 @@ def validate_product_ownership(product_id):
     
     return True, product
 
-def validate_stock_operation(product_id, quantity, operation='add'):
-    is_valid, product = validate_product_ownership(product_id)
-    if not is_valid:
-        return False, product
-    
-    if not isinstance(quantity, int) or quantity <= 0:
-        return False, "Quantity must be a positive integer"
-    
-    if operation == 'remove' and product['stock'] < quantity:
-        return False, f"Insufficient stock. Available: {product['stock']}, requested: {quantity}"
-    
-    return True, product
-
 def validate_json_request():
     if not request.is_json:
         return False, "Content-Type must be application/json"
@@ -95,4 +78,41 @@ def validate_user_data(data):
     if not password:
         return False, "Password cannot be empty"
     
-    return True, None
\ No newline at end of file
+    return True, None
+
+BATCH_ACTIONS = ('add', 'remove')
+BATCH_MAX_ITEMS = 1000
+
+def validate_batch_data(data):
+    if 'items' not in data:
+        return False, "Missing required field: items"
+    
+    if not isinstance(data['items'], list) or len(data['items']) == 0:
+        return False, "Items must be a non-empty list"
+    
+    if len(data['items']) > BATCH_MAX_ITEMS:
+        return False, f"A batch can contain at most {BATCH_MAX_ITEMS} items"
+    
+    if 'atomic' in data and not isinstance(data['atomic'], bool):
+        return False, "Atomic must be a boolean"
+    
+    return True, None
+
+def validate_batch_item(item):
+    if not isinstance(item, dict):
+        return False, "Item must be an object"
+    
+    for field in ('product_id', 'action', 'quantity'):
+        if field not in item:
+            return False, f"Missing required field: {field}"
+    
+    if not isinstance(item['product_id'], int) or isinstance(item['product_id'], bool):
+        return False, "Product id must be an integer"
+    
+    if item['action'] not in BATCH_ACTIONS:
+        return False, f"Action must be one of: {', '.join(BATCH_ACTIONS)}"
+    
+    if not isinstance(item['quantity'], int) or isinstance(item['quantity'], bool) or item['quantity'] <= 0:
+        return False, "Quantity must be a positive integer"
+    
+    return True, None
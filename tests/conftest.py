@@ -4,8 +4,11 @@ import tempfile
 
 import pytest
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import g
+
 from shoptrack import create_app
-from shoptrack.db import get_db, init_db
+from shoptrack import db as shoptrack_db
+from shoptrack.db import POSTGRESQL_AVAILABLE, get_db, init_db
 
 
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
@@ -19,15 +22,46 @@ def app():
         'DATABASE': db_path,
     })
     
-    with app.app_context():
-        init_db()
-        get_db().executescript(_data_sql)
+    load_test_data(app)
 
     yield app
 
     os.close(db_fd)
     os.unlink(db_path)
 
+def load_test_data(app):
+    """Rebuild the schema of ``app``'s database and load data.sql into it."""
+    with app.app_context():
+        init_db()
+        db = get_db()
+        if g.is_postgresql:
+            db.cursor().execute(_data_sql.replace('INSERT INTO user ', 'INSERT INTO "user" '))
+            db.commit()
+        else:
+            db.executescript(_data_sql)
+
+@pytest.fixture
+def pg_app(monkeypatch):
+    """The app on the scratch PostgreSQL database named by TEST_DATABASE_URL, which is wiped."""
+    database_url = os.environ.get('TEST_DATABASE_URL')
+    if not database_url or not POSTGRESQL_AVAILABLE:
+        pytest.skip('set TEST_DATABASE_URL to a scratch PostgreSQL database')
+    monkeypatch.setenv('DATABASE_URL', database_url)
+
+    app = create_app({'TESTING': True})
+    load_test_data(app)
+    yield app
+
+    # Later tests run on SQLite and expect no pool
+    if shoptrack_db._pool is not None:
+        shoptrack_db._pool.closeall()
+        shoptrack_db._pool = None
+
+@pytest.fixture
+def reload_pg_data(pg_app):
+    """Call to wipe the PostgreSQL test database again, e.g. between two runs of one scenario."""
+    return lambda: load_test_data(pg_app)
+
 @pytest.fixture
 def client(app):
     return app.test_client()
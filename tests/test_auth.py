@@ -96,4 +96,71 @@ def test_logout(client):
 def test_invalid_token(client):
     response = client.get('/stock/', headers={'Authorization': 'Bearer invalid_token'})
     assert response.status_code == 401
-    assert b'Unauthorized' in response.data
\ No newline at end of file
+    assert b'Unauthorized' in response.data
+
+def test_token_lookup_is_cached(app, client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    cache = app.extensions['token_cache']
+
+    client.get('/stock/', headers=headers)
+    client.get('/stock/', headers=headers)
+    stats = cache.stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+
+    client.post('/auth/logout', headers=headers)
+    assert cache.get(token) is None
+
+def test_expired_session_rejected(app, client):
+    token = get_test_user_token(client)
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE sessions SET expires = '2000-01-01 00:00:00' WHERE id = ?", (token,))
+        db.commit()
+
+    response = client.get('/stock/', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
+
+def test_login_upgrades_password_hash(app, client):
+    app.extensions['password_hasher'].method = 'pbkdf2:sha256:1000'
+
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'testpass'})
+    assert response.status_code == 200
+
+    with app.app_context():
+        stored = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+    assert stored.startswith('pbkdf2:sha256:1000$')
+
+    # The upgraded hash still logs in
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'testpass'})
+    assert response.status_code == 200
+
+def test_login_rejected_when_hashing_saturated(app, client, monkeypatch):
+    from shoptrack.hashing import HashingBusy
+
+    def busy(*args):
+        raise HashingBusy('saturated')
+
+    monkeypatch.setattr(app.extensions['password_hasher'], 'verify', busy)
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'testpass'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+def test_hashing_process_pool():
+    from shoptrack.hashing import PasswordHasher
+
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1, max_queue=0)
+    pwhash = hasher.hash('secret')
+    assert hasher.verify(pwhash, 'secret')
+    assert not hasher.verify(pwhash, 'wrong')
+    assert not hasher.needs_rehash(pwhash)
+
+def test_salt_length_change_needs_rehash():
+    from shoptrack.hashing import PasswordHasher
+
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', salt_length=16)
+    pwhash = hasher.hash('secret')
+    assert not hasher.needs_rehash(pwhash)
+    assert PasswordHasher(method='pbkdf2:sha256:1000', salt_length=24).needs_rehash(pwhash)
+    assert PasswordHasher(method='pbkdf2:sha256:2000', salt_length=16).needs_rehash(pwhash)
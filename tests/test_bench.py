@@ -0,0 +1,71 @@
+import json
+
+from shoptrack.bench.runner import compare_reports, percentile
+from shoptrack.db import get_db
+
+
+def test_seed_generates_consistent_data(app, runner):
+    result = runner.invoke(args=['bench', 'seed', '--users', '2', '--products', '3', '--history', '4', '--seed', '1'])
+    assert 'Added 2 users, 6 products and 24 history rows.' in result.output
+
+    with app.app_context():
+        db = get_db()
+        users = db.execute("SELECT id FROM user WHERE username LIKE 'bench%' ORDER BY id").fetchall()
+        assert len(users) == 2
+        # Every product's stock is what its history leaves
+        rows = db.execute(
+            "SELECT p.stock, SUM(CASE WHEN h.action = 'buy' THEN h.quantity ELSE -h.quantity END) AS net "
+            "FROM product p JOIN history h ON h.product_id = p.id WHERE p.owner_id != 1 GROUP BY p.id"
+        ).fetchall()
+        assert len(rows) == 6
+        assert all(row['stock'] == row['net'] for row in rows)
+
+    # Seeding again continues the usernames
+    runner.invoke(args=['bench', 'seed', '--users', '1', '--products', '1', '--history', '1'])
+    with app.app_context():
+        names = [row['username'] for row in get_db().execute("SELECT username FROM user WHERE username LIKE 'bench%'")]
+    assert sorted(names) == ['bench1', 'bench2', 'bench3']
+
+def test_run_writes_report_and_checks_baseline(runner, tmp_path):
+    runner.invoke(args=['bench', 'seed', '--users', '1', '--products', '2', '--history', '3'])
+    output = tmp_path / 'report.json'
+    result = runner.invoke(args=[
+        'bench', 'run', '--requests', '5', '--seed', '3', '--output', str(output),
+        '--scenario', 'polling_reads', '--scenario', 'mixed_mutations', '--scenario', 'history_scans',
+    ])
+    assert result.exit_code == 0, result.output
+
+    report = json.loads(output.read_text())
+    assert report['meta']['mode'] == 'test_client'
+    assert set(report['scenarios']) == {'polling_reads', 'mixed_mutations', 'history_scans'}
+    for scenario in report['scenarios'].values():
+        assert scenario['requests'] == 5
+        assert scenario['errors'] == 0
+        assert scenario['p50_ms'] <= scenario['p95_ms'] <= scenario['p99_ms']
+
+    # An impossibly fast baseline fails the run
+    for scenario in report['scenarios'].values():
+        scenario.update(p50_ms=0.001, p95_ms=0.001, p99_ms=0.001)
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps(report))
+    result = runner.invoke(args=['bench', 'run', '--requests', '2', '--scenario', 'polling_reads', '--baseline', str(baseline)])
+    assert result.exit_code == 1
+    assert 'Regression: polling_reads: p95_ms' in result.output
+
+def test_run_requires_seeded_users(runner):
+    result = runner.invoke(args=['bench', 'run', '--requests', '1'])
+    assert result.exit_code != 0
+    assert 'flask bench seed' in result.output
+
+def test_compare_reports():
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 99) == 4
+
+    baseline = {'scenarios': {'reads': {'p50_ms': 1.0, 'p95_ms': 2.0, 'p99_ms': 3.0, 'throughput_rps': 100}}}
+    same = {'scenarios': {'reads': {'p50_ms': 1.1, 'p95_ms': 2.2, 'p99_ms': 3.0, 'throughput_rps': 90}}}
+    slower = {'scenarios': {'reads': {'p50_ms': 1.0, 'p95_ms': 3.0, 'p99_ms': 3.0, 'throughput_rps': 50}}}
+    assert compare_reports(same, baseline, 0.2) == []
+    assert compare_reports(slower, baseline, 0.2) == [
+        'reads: p95_ms 3.0 > baseline 2.0',
+        'reads: throughput_rps 50 < baseline 100',
+    ]
@@ -2,7 +2,7 @@ import sqlite3
 
 import pytest
 
-from shoptrack.db import get_db
+from shoptrack.db import get_db, close_sqlite_connections
 
 def test_get_close_db(app):
     with app.app_context():
@@ -27,4 +27,51 @@ def test_init_db_command(runner, monkeypatch):
     assert Recorder.called
     
     
-    
\ No newline at end of file
+    
+def test_upgrade_is_idempotent(app):
+    from shoptrack.migrate import available_migrations, current_version, upgrade
+
+    with app.app_context():
+        latest = available_migrations('sqlite')[-1][0]
+        assert current_version() == latest
+        assert upgrade() == []
+
+def test_upgrade_preserves_data(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute('DELETE FROM schema_version WHERE version > 1')
+        db.execute('DROP INDEX product_owner_created_idx')
+        db.commit()
+
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert 'Applied 0002_hot_path_indexes' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM product').fetchone()[0] == 1
+        plan = db.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM "user" WHERE LOWER(username) = LOWER(?)', ('Test',)
+        ).fetchall()
+        assert 'user_username_lower_idx' in str([tuple(row) for row in plan])
+
+def test_sqlite_production_profile(app):
+    app.config['SQLITE_PROFILE'] = 'production'
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert db.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+        # A transaction the request forgot to finish
+        db.execute("UPDATE product SET stock = 99 WHERE id = 1")
+
+    with app.app_context():
+        # Same connection for the next request on this thread, with the write rolled back
+        assert get_db() is db
+        assert not db.in_transaction
+        assert db.execute('SELECT stock FROM product WHERE id = 1').fetchone()[0] == 10
+
+    close_sqlite_connections()
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute('SELECT 1')
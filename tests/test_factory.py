@@ -6,4 +6,10 @@ def test_config():
 
 def test_hello(client):
     response = client.get('/hello')
-    assert response.data == b'Hello, World!'
\ No newline at end of file
+    assert response.data == b'Hello, World!'
+
+def test_stats(client):
+    response = client.get('/stats')
+    assert response.status_code == 200
+    # SQLite connections are not pooled
+    assert response.get_json()['pool'] is None
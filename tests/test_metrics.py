@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+
+import pytest
+
+from shoptrack.metrics import MetricsRegistry, archive_worker, clear_directory, statement_label
+
+SCRAPE = {'Authorization': 'Bearer scrape-secret'}
+
+def get_test_user_token(client):
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'testpass'})
+    return response.get_json()['token']
+
+def test_metrics_endpoint(app, client):
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+    token = get_test_user_token(client)
+    client.get('/stock/', headers={'Authorization': f'Bearer {token}'})
+
+    response = client.get('/metrics', headers=SCRAPE)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+
+    assert '# TYPE shoptrack_db_query_duration_seconds histogram' in text
+    assert 'shoptrack_db_query_duration_seconds_count{statement="SELECT * FROM product WHERE owner_id = ?' in text
+    assert 'shoptrack_http_request_duration_seconds_count{endpoint="/stock/",method="GET",status="200"} 1' in text
+    # Token lookup, inventory version and the product list
+    assert 'shoptrack_http_request_queries_bucket{endpoint="/stock/",method="GET",le="3"} 1' in text
+
+def test_metrics_requires_token(app, client):
+    assert client.get('/metrics').status_code == 404
+
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers=SCRAPE).status_code == 200
+
+def test_unhandled_errors_counted(app, client):
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+
+    @app.route('/boom')
+    def boom():
+        raise RuntimeError('boom')
+
+    # TESTING propagates the exception, so no response goes through after_request
+    with pytest.raises(RuntimeError):
+        client.get('/boom')
+    text = client.get('/metrics', headers=SCRAPE).get_data(as_text=True)
+    assert 'shoptrack_http_request_duration_seconds_count{endpoint="/boom",method="GET",status="500"} 1' in text
+
+def test_statement_label_collapses_lists():
+    assert statement_label('DELETE FROM sessions WHERE id IN (?, ?)') == statement_label(
+        'DELETE FROM sessions WHERE id IN (?, ?, ?, ?)'
+    ) == 'DELETE FROM sessions WHERE id IN (...)'
+    assert statement_label('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)') == 'INSERT INTO t (a, b) VALUES (...)'
+    assert statement_label('SELECT * FROM t WHERE id = $1') == 'SELECT * FROM t WHERE id = $1'
+
+def test_slow_query_log(app, client, caplog):
+    app.config['SLOW_QUERY_MS'] = 0
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+    with caplog.at_level(logging.WARNING):
+        client.post('/auth/login', json={'username': 'test', 'password': 'testpass'})
+    assert 'Slow query' in caplog.text
+    assert 'shoptrack_db_slow_queries_total{statement=' in client.get('/metrics', headers=SCRAPE).get_data(as_text=True)
+
+def test_metrics_aggregated_across_workers(tmp_path):
+    registry = MetricsRegistry(directory=str(tmp_path))
+    labels = (('statement', statement_label('SELECT  1\n')),)
+    registry.observe('shoptrack_db_query_duration_seconds', labels, 0.002)
+    registry.inc('shoptrack_db_slow_queries_total', labels)
+
+    # Snapshot left behind by another worker
+    other = registry.snapshot()
+    with open(os.path.join(tmp_path, 'metrics-999999.json'), 'w') as f:
+        json.dump(other, f)
+
+    registry.flush(force=True)
+    assert os.path.exists(os.path.join(tmp_path, f'metrics-{os.getpid()}.json'))
+
+    text = registry.render()
+    assert 'shoptrack_db_query_duration_seconds_count{statement="SELECT 1"} 2' in text
+    assert 'shoptrack_db_query_duration_seconds_bucket{statement="SELECT 1",le="0.001"} 0' in text
+    assert 'shoptrack_db_query_duration_seconds_bucket{statement="SELECT 1",le="0.0025"} 2' in text
+    assert 'shoptrack_db_slow_queries_total{statement="SELECT 1"} 2' in text
+
+def test_exited_workers_keep_counting(tmp_path):
+    registry = MetricsRegistry(directory=str(tmp_path))
+    labels = (('statement', 'SELECT 1'),)
+    registry.inc('shoptrack_db_slow_queries_total', labels, 3)
+    snapshot = registry.snapshot()
+    with open(os.path.join(tmp_path, 'metrics-999999.json'), 'w') as f:
+        json.dump(snapshot, f)
+    archive_worker(str(tmp_path), 999999)
+    assert not os.path.exists(os.path.join(tmp_path, 'metrics-999999.json'))
+
+    # A new worker reuses the PID: its file starts from zero, the old counts stay
+    with open(os.path.join(tmp_path, 'metrics-999999.json'), 'w') as f:
+        json.dump(MetricsRegistry().snapshot(), f)
+    archive_worker(str(tmp_path), 999999)
+    assert 'shoptrack_db_slow_queries_total{statement="SELECT 1"} 6' in registry.render()
+
+    clear_directory(str(tmp_path))
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.json')]
+    assert 'shoptrack_db_slow_queries_total{statement="SELECT 1"} 3' in registry.render()
+
+def test_stale_file_with_own_pid_is_archived(tmp_path):
+    labels = (('statement', 'SELECT 1'),)
+    stale = MetricsRegistry()
+    stale.inc('shoptrack_db_slow_queries_total', labels, 2)
+    with open(os.path.join(tmp_path, f'metrics-{os.getpid()}.json'), 'w') as f:
+        json.dump(stale.snapshot(), f)
+
+    registry = MetricsRegistry(directory=str(tmp_path))
+    registry.inc('shoptrack_db_slow_queries_total', labels)
+    registry.flush(force=True)
+    assert 'shoptrack_db_slow_queries_total{statement="SELECT 1"} 3' in registry.render()
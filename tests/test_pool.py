@@ -0,0 +1,91 @@
+import sqlite3
+import threading
+
+import pytest
+
+from shoptrack.pool import ConnectionPool, PoolExhausted
+
+
+def make_pool(**kwargs):
+    return ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), **kwargs)
+
+def test_connections_are_reused():
+    pool = make_pool(maxconn=2)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn
+
+    stats = pool.stats()
+    assert stats['created'] == 1
+    assert stats['checkouts'] == 2
+    assert stats['in_use'] == 1
+
+def test_checkout_times_out_when_exhausted():
+    pool = make_pool(maxconn=1, timeout=0.05)
+    pool.getconn()
+    with pytest.raises(PoolExhausted):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+def test_waiting_checkout_gets_returned_connection():
+    pool = make_pool(maxconn=1, timeout=2)
+    conn = pool.getconn()
+    timer = threading.Timer(0.05, pool.putconn, args=(conn,))
+    timer.start()
+    assert pool.getconn() is conn
+    timer.join()
+    assert pool.stats()['waits'] == 1
+
+def test_returned_connection_is_rolled_back():
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    pool.putconn(conn)
+
+    conn = pool.getconn()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+
+def test_broken_connection_is_replaced():
+    pool = make_pool(maxconn=1, check_interval=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.close()
+
+    fresh = pool.getconn()
+    assert fresh is not conn
+    assert pool.stats()['discarded'] == 1
+
+def test_old_connections_are_recycled():
+    pool = make_pool(minconn=0, maxconn=1, max_lifetime=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is not conn
+    assert pool.stats()['recycled'] == 1
+
+def test_minconn_opened_with_the_pool():
+    pool = make_pool(minconn=2, maxconn=3)
+    stats = pool.stats()
+    assert (stats['created'], stats['size'], stats['idle']) == (2, 2, 2)
+
+    pool.getconn()
+    assert pool.stats()['created'] == 2
+
+def test_failed_fill_closes_opened_connections():
+    opened = []
+
+    def connect():
+        if opened:
+            raise sqlite3.OperationalError('server down')
+        opened.append(sqlite3.connect(':memory:', check_same_thread=False))
+        return opened[-1]
+
+    with pytest.raises(sqlite3.OperationalError):
+        ConnectionPool(connect, minconn=2, maxconn=2)
+    with pytest.raises(sqlite3.ProgrammingError):
+        opened[0].execute('SELECT 1')
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        make_pool(minconn=3, maxconn=2)
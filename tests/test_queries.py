@@ -0,0 +1,31 @@
+from shoptrack.db import get_placeholder
+from shoptrack.queries import STATEMENTS, compile_statements, run_query
+
+def test_compile_sqlite():
+    statements = compile_statements('sqlite')
+    assert statements['product_by_id'].sql == 'SELECT * FROM product WHERE id = ? AND owner_id = ?'
+    assert statements['product_by_id'].prepare_sql is None
+    # PostgreSQL-only statements are not compiled for SQLite
+    assert 'remove_stock_checked' not in statements
+
+def test_compile_postgresql():
+    statements = compile_statements('postgresql')
+    product = statements['product_by_id']
+    assert product.sql == 'SELECT * FROM product WHERE id = %s AND owner_id = %s'
+    assert product.prepare_sql == 'PREPARE shoptrack_product_by_id AS SELECT * FROM product WHERE id = $1 AND owner_id = $2'
+    assert product.execute_sql == 'EXECUTE shoptrack_product_by_id (%s, %s)'
+    assert statements['delete_product'].prepare_sql is None
+    # Everything except the statements written for SQLite only
+    assert set(statements) == {
+        name for name, (sql, _) in STATEMENTS.items() if not isinstance(sql, dict) or 'postgresql' in sql
+    }
+
+    unprepared = compile_statements('postgresql', prepare=False)
+    assert all(statement.prepare_sql is None for statement in unprepared.values())
+
+def test_run_query(app):
+    with app.app_context():
+        assert get_placeholder() == '?'
+        user = run_query('user_by_username', ('TEST',)).fetchone()
+        assert user['username'] == 'test'
+        assert run_query('product_by_id', (1, user['id'])).fetchone()['name'] == 'Test Product'
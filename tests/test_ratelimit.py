@@ -0,0 +1,110 @@
+import pytest
+
+from shoptrack import create_app
+from shoptrack.ratelimit import MemoryBucketStore, SQLiteBucketStore, client_ip, parse_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def limited_app(app, tmp_path):
+    limited = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'RATE_LIMITS': {'auth': '3/minute', 'stock': '2/minute'},
+        'RATE_LIMIT_STORE': str(tmp_path / 'ratelimit.sqlite'),
+    })
+    return limited
+
+def test_parse_rate():
+    assert parse_rate('10/minute') == (10, 10 / 60)
+    assert parse_rate('5/seconds') == (5, 5)
+    assert parse_rate(None) is None
+    assert parse_rate('0') is None
+    for value in ('ten/minute', '10/fortnight', '-1/hour', '10'):
+        with pytest.raises(ValueError):
+            parse_rate(value)
+
+@pytest.mark.parametrize('store_class', [MemoryBucketStore, SQLiteBucketStore])
+def test_token_bucket(store_class, tmp_path):
+    clock = Clock()
+    if store_class is SQLiteBucketStore:
+        store = SQLiteBucketStore(str(tmp_path / 'buckets.sqlite'), clock=clock)
+    else:
+        store = MemoryBucketStore(clock=clock)
+
+    # A burst of the full capacity, then one token per 30 seconds
+    assert [store.take('a', 2, 1 / 30) for _ in range(2)] == [0, 0]
+    assert store.take('a', 2, 1 / 30) == pytest.approx(30)
+    assert store.take('b', 2, 1 / 30) == 0
+    clock.now += 15
+    assert store.take('a', 2, 1 / 30) == pytest.approx(15)
+    clock.now += 15
+    assert store.take('a', 2, 1 / 30) == 0
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / 'buckets.sqlite')
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take('a', 1, 0.01) == 0
+    assert second.take('a', 1, 0.01) > 0
+
+def test_login_limited_per_ip(limited_app):
+    client = limited_app.test_client()
+    credentials = {'username': 'test', 'password': 'wrongpass'}
+    for _ in range(3):
+        assert client.post('/auth/login', json=credentials).status_code == 401
+
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'testpass'})
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 20
+
+    other = client.post('/auth/login', json=credentials, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert other.status_code == 401
+
+def test_stock_limited_per_user(limited_app):
+    client = limited_app.test_client()
+    token = client.post('/auth/login', json={'username': 'test', 'password': 'testpass'}).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    assert client.get('/stock/', headers=headers).status_code == 200
+    assert client.get('/stock/1', headers=headers).status_code == 200
+    response = client.get('/stock/', headers=headers)
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+
+    # Requests without a valid token are rejected before they are charged
+    assert client.get('/stock/', headers={'Authorization': 'Bearer nope'}).status_code == 401
+
+def test_login_limited_per_forwarded_client(app, tmp_path):
+    proxied = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'RATE_LIMITS': {'auth': '1/minute'},
+        'RATE_LIMIT_STORE': 'memory',
+        'PROXY_FIX_X_FOR': 1,
+    })
+    client = proxied.test_client()
+    credentials = {'username': 'test', 'password': 'wrongpass'}
+
+    # Every request arrives from the proxy; the client is the last X-Forwarded-For hop
+    def login(forwarded_for):
+        return client.post('/auth/login', json=credentials, headers={'X-Forwarded-For': forwarded_for})
+
+    assert login('203.0.113.1').status_code == 401
+    assert login('203.0.113.2').status_code == 401
+    assert login('203.0.113.1').status_code == 429
+    # A spoofed entry ahead of the one the proxy appended is ignored
+    assert login('198.51.100.7, 203.0.113.2').status_code == 429
+
+def test_client_ip():
+    assert client_ip('10.0.0.1', '203.0.113.1, 10.0.0.2', 0) == '10.0.0.1'
+    assert client_ip('10.0.0.1', '203.0.113.1, 10.0.0.2', 1) == '10.0.0.2'
+    assert client_ip('10.0.0.1', '203.0.113.1, 10.0.0.2', 2) == '203.0.113.1'
+    assert client_ip('10.0.0.1', '203.0.113.1', 2) == '10.0.0.1'
+    assert client_ip('10.0.0.1', None, 1) == '10.0.0.1'
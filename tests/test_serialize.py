@@ -0,0 +1,67 @@
+import json
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+from werkzeug.http import http_date
+
+from shoptrack import create_app, serialize
+from shoptrack.serialize import RowSet, ShopTrackJSONProvider, http_datetime
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def encoder(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(serialize, 'orjson', None)
+
+    def make(**config):
+        app = create_app({'TESTING': True, **config})
+        return ShopTrackJSONProvider(app)
+    return make
+
+def test_http_datetime_matches_werkzeug():
+    start = datetime(2024, 2, 28, 23, 59, 59)
+    for days in range(0, 400, 13):
+        value = start + timedelta(days=days, seconds=days * 37)
+        assert http_datetime(value) == http_date(value)
+    aware = datetime(2026, 1, 5, 3, 4, 5, tzinfo=timezone(timedelta(hours=5)))
+    assert http_datetime(aware) == http_date(aware)
+    assert http_datetime(date(2024, 2, 29)) == http_date(date(2024, 2, 29))
+
+def test_encode_types(encoder):
+    payload = {'price': Decimal('2.50'), 'created': datetime(2026, 1, 5, 3, 4, 5), 'day': date(2026, 1, 5)}
+
+    data = json.loads(encoder().encode(payload))
+    assert data == {'price': '2.50', 'created': 'Mon, 05 Jan 2026 03:04:05 GMT', 'day': 'Mon, 05 Jan 2026 00:00:00 GMT'}
+
+    data = json.loads(encoder(JSON_DATETIME_FORMAT='iso').encode(payload))
+    assert data == {'price': '2.50', 'created': '2026-01-05T03:04:05', 'day': '2026-01-05'}
+
+    with pytest.raises(ValueError):
+        encoder(JSON_DATETIME_FORMAT='unix')
+
+def test_encode_rowset(encoder):
+    db = sqlite3.connect(':memory:')
+    db.row_factory = sqlite3.Row
+    db.execute('CREATE TABLE t (id INTEGER, name TEXT)')
+    db.executemany('INSERT INTO t VALUES (?, ?)', [(1, 'a'), (2, 'b')])
+
+    rows = RowSet.from_cursor(db.execute('SELECT * FROM t ORDER BY id'))
+    assert rows.columns == ('id', 'name')
+    assert json.loads(encoder().encode(rows)) == [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'}]
+
+    # psycopg2's RealDictRow is a dict subclass and is encoded without a copy
+    rows = RowSet([{'id': 3, 'name': 'c'}])
+    assert rows.records() is rows.rows
+    assert json.loads(encoder().encode({'items': rows})) == {'items': [{'id': 3, 'name': 'c'}]}
+
+    empty = RowSet.from_cursor(db.execute('SELECT * FROM t WHERE id > 5'))
+    assert not empty
+    assert encoder().encode(empty) == b'[]'
+
+def test_compact_mode(encoder):
+    assert encoder().encode({'a': [1, 2]}) == b'{"a":[1,2]}'
+    assert b'\n  ' in encoder(JSON_COMPACT=False).encode({'a': [1, 2]})
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+from shoptrack.db import get_db
+from shoptrack.sessions import purge_sessions
+
+
+def add_sessions(app, count, expires):
+    with app.app_context():
+        db = get_db()
+        start = db.execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+        db.executemany(
+            'INSERT INTO sessions (id, user_id, expires) VALUES (?, 1, ?)',
+            [(f'token-{start + i}', expires + timedelta(minutes=i)) for i in range(count)]
+        )
+        db.commit()
+
+def count_sessions(app):
+    with app.app_context():
+        return get_db().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+def test_purge_expired_in_batches(app):
+    add_sessions(app, 5, datetime.now() - timedelta(days=1))
+    add_sessions(app, 2, datetime.now() + timedelta(days=1))
+
+    with app.app_context():
+        result = purge_sessions(batch_size=2)
+    assert result['expired'] == 5
+    assert result['over_cap'] == 0
+    assert count_sessions(app) == 2
+
+def test_purge_caps_sessions_per_user(app):
+    add_sessions(app, 4, datetime.now() + timedelta(days=1))
+
+    with app.app_context():
+        result = purge_sessions(max_per_user=1)
+        remaining = get_db().execute('SELECT id FROM sessions').fetchall()
+    assert result['over_cap'] == 3
+    # The session that expires last survives
+    assert [row['id'] for row in remaining] == ['token-3']
+
+def test_purge_command(app, runner):
+    add_sessions(app, 3, datetime.now() - timedelta(days=1))
+
+    result = runner.invoke(args=['sessions', 'purge'])
+    assert 'Removed 3 expired and 0 over-cap sessions' in result.output
+    assert count_sessions(app) == 0
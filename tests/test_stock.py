@@ -1,5 +1,17 @@
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
 import pytest
-from shoptrack.db import get_db
+from flask import g
+from shoptrack import db as shoptrack_db
+from shoptrack.db import get_db, execute_query
+from shoptrack.groupcommit import GroupCommitter
+
+# Event streams are refused by single-threaded WSGI servers
+THREADED = {'wsgi.multithread': True}
 
 def get_test_user_token(client):
     """Get authentication token for the existing test user from data.sql."""
@@ -97,3 +109,603 @@ def test_get_product_history(client):
     data = response.get_json()
     assert isinstance(data, list)
     # Should have at least one history record for this product
+
+def test_history_filters(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/stock/', json={'name': 'Widget', 'stock': 4, 'price': 2}, headers=headers)
+    client.patch('/stock/1/stock/remove', json={'stock': 3}, headers=headers)
+    client.patch('/stock/2/stock/remove', json={'stock': 1}, headers=headers)
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE history SET created = '2024-01-10 12:00:00' WHERE id = 1")
+        db.commit()
+
+    def history(path='/stock/history', **args):
+        response = client.get(path, query_string=args, headers=headers)
+        return response.status_code, response.get_json()
+
+    status, rows = history(action='sell')
+    assert status == 200
+    assert {(row['product_id'], row['quantity']) for row in rows} == {(1, 3), (2, 1)}
+
+    status, rows = history(action='buy', product_id=2)
+    assert [(row['product_id'], row['quantity']) for row in rows] == [(2, 4)]
+
+    status, rows = history(**{'from': '2024-01-10', 'to': '2024-01-10'})
+    assert [row['id'] for row in rows] == [1]
+
+    status, page = history(action='sell', limit=1)
+    assert len(page['items']) == 1 and page['next_cursor']
+    status, page = history(action='sell', limit=1, cursor=page['next_cursor'])
+    assert len(page['items']) == 1 and page['next_cursor'] is None
+
+    assert history(to='2000-01-01')[0] == 404
+    assert history(action='refund')[0] == 400
+    assert history(product_id='x')[0] == 400
+    assert history(**{'from': '2024-02-01', 'to': '2024-01-01'})[0] == 400
+
+def test_product_history_filters(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.patch('/stock/1/stock/remove', json={'stock': 3}, headers=headers)
+
+    response = client.get('/stock/1/history?action=sell', headers=headers)
+    assert [row['action'] for row in response.get_json()] == ['sell']
+
+    # An owned product without matching history, and a product that is not ours
+    response = client.get('/stock/1/history?to=2000-01-01', headers=headers)
+    assert response.get_json() == {'error': 'No transaction history found for this product'}
+    response = client.get('/stock/1/history?to=2000-01-01&limit=10', headers=headers)
+    assert response.get_json() == {'items': [], 'next_cursor': None}
+    for path in ('/stock/99/history', '/stock/99/history?action=buy&limit=10'):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 404
+        assert response.get_json() == {'error': 'Product not found or access denied'}
+
+def test_get_stock_paginated(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    for i in range(4):
+        client.post('/stock/', json={'name': f'Product {i}', 'stock': 1, 'price': 5}, headers=headers)
+
+    seen = []
+    cursor = None
+    while True:
+        url = '/stock/?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data['items']) <= 2
+        seen.extend(item['id'] for item in data['items'])
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+
+    # Same rows, same order as the unpaginated listing
+    legacy = client.get('/stock/', headers=headers).get_json()
+    assert seen == [item['id'] for item in legacy]
+    assert len(seen) == 5
+
+def test_get_history_paginated(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.patch('/stock/1/stock/add', json={'stock': 2}, headers=headers)
+
+    response = client.get('/stock/history?limit=1', headers=headers)
+    data = response.get_json()
+    assert len(data['items']) == 1
+    assert data['next_cursor'] is not None
+
+    response = client.get(f"/stock/history?limit=1&cursor={data['next_cursor']}", headers=headers)
+    data2 = response.get_json()
+    assert data2['items'][0]['id'] < data['items'][0]['id']
+    assert data2['next_cursor'] is None
+
+def test_pagination_invalid_args(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/stock/?limit=0', headers=headers)
+    assert response.status_code == 400
+
+    response = client.get('/stock/history?cursor=not-a-cursor', headers=headers)
+    assert response.status_code == 400
+    assert b'Invalid cursor' in response.data
+
+def test_export_history_ndjson(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.patch('/stock/1/stock/remove', json={'stock': 2}, headers=headers)
+
+    response = client.get('/stock/history/export?format=ndjson', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert [record['action'] for record in records] == ['buy', 'sell']
+
+def test_export_history_csv(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/stock/history/export?format=csv', headers=headers)
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0][:3] == ['id', 'product_id', 'product_name']
+    assert rows[1][2] == 'Test Product'
+    assert len(rows) == 2
+
+def test_export_history_invalid_format(client):
+    token = get_test_user_token(client)
+    response = client.get('/stock/history/export?format=xml',
+                          headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 400
+
+def test_import_csv(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'text/csv'}
+    app.config['IMPORT_BATCH_SIZE'] = 2
+
+    body = 'name,stock,price,description\nA,5,2.5,first\nB,x,3,\nC,0,4,\n,1,1,\nD,3,1,\n'
+    response = client.post('/stock/import', data=body, headers=headers)
+    assert response.status_code == 200
+    assert response.get_json() == {
+        'imported': 3,
+        'failed': 2,
+        'errors': [
+            {'row': 2, 'error': 'Stock must be a non-negative integer'},
+            {'row': 4, 'error': 'Name must be a non-empty string'},
+        ],
+    }
+
+    with app.app_context():
+        db = get_db()
+        products = db.execute('SELECT name, stock, description FROM product WHERE id > 1 ORDER BY id').fetchall()
+        assert [tuple(row) for row in products] == [('A', 5, 'first'), ('C', 0, None), ('D', 3, None)]
+        # Initial stock is recorded as a purchase; C had none
+        history = db.execute("SELECT product_name, quantity FROM history WHERE action = 'buy' AND id > 1").fetchall()
+        assert [tuple(row) for row in history] == [('A', 5), ('D', 3)]
+
+def test_import_ndjson(client, app, runner, tmp_path):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    body = '{"name": "A", "stock": 2, "price": 1}\n\nnot json\n[1]\n{"name": "B", "stock": 1.5, "price": 1}\n'
+    response = client.post('/stock/import?format=ndjson', data=body, headers=headers)
+    data = response.get_json()
+    assert data['imported'] == 1
+    assert [error['row'] for error in data['errors']] == [2, 3, 4]
+
+    response = client.post('/stock/import', data=body, headers={**headers, 'Content-Type': 'application/json'})
+    assert response.status_code == 400
+
+    path = tmp_path / 'products.ndjson'
+    path.write_text('{"name": "C", "stock": 4, "price": 2}\n')
+    result = runner.invoke(args=['products', 'import', str(path), '--username', 'test'])
+    assert 'Imported 1 products, 0 rows failed.' in result.output
+    assert client.get('/stock/summary', headers=headers).get_json()['units_on_hand'] == 10 + 2 + 4
+
+def test_search_products(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    for name, description in [('Blue Widget', 'small'), ('Red widget', 'crème brûlée'), ('Gadget', 'fits widgets')]:
+        client.post('/stock/', json={'name': name, 'stock': 1, 'price': 1, 'description': description}, headers=headers)
+
+    def search(**args):
+        response = client.get('/stock/search', query_string=args, headers=headers)
+        assert response.status_code == 200
+        return response.get_json()
+
+    # Whole words and prefixes, name matches first
+    assert [p['name'] for p in search(q='widget')['items']][-1] == 'Gadget'
+    assert {p['name'] for p in search(q='wid')['items']} == {'Blue Widget', 'Red widget', 'Gadget'}
+    assert [p['name'] for p in search(q='blue wid')['items']] == ['Blue Widget']
+    assert [p['name'] for p in search(q='creme')['items']] == ['Red widget']
+
+    first = search(q='wid', limit=2)
+    assert len(first['items']) == 2
+    rest = search(q='wid', limit=2, cursor=first['next_cursor'])
+    assert len(rest['items']) == 1 and rest['next_cursor'] is None
+
+    # Updates and deletes are reflected immediately
+    client.put('/stock/4', json={'name': 'Sprocket', 'stock': 1, 'price': 1}, headers=headers)
+    client.delete('/stock/2', headers=headers)
+    assert [p['name'] for p in search(q='wid')['items']] == ['Red widget']
+    assert [p['name'] for p in search(q='sprock')['items']] == ['Sprocket']
+
+    # Other users' products are never returned
+    client.post('/auth/register', json={'username': 'other', 'password': 'otherpass'})
+    other = client.post('/auth/login', json={'username': 'other', 'password': 'otherpass'}).get_json()['token']
+    response = client.get('/stock/search?q=wid', headers={'Authorization': f'Bearer {other}'})
+    assert response.get_json()['items'] == []
+
+def test_search_invalid_args(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    for query in ('', 'q=', 'q=!!', 'q=a&limit=0', 'q=a&cursor=bad'):
+        assert client.get(f'/stock/search?{query}', headers=headers).status_code == 400
+
+def test_batch_stock(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.post('/stock/batch', json={'items': [
+        {'product_id': 1, 'action': 'remove', 'quantity': 4},
+        {'product_id': 1, 'action': 'add', 'quantity': 1},
+        {'product_id': 1, 'action': 'remove', 'quantity': 50},
+        {'product_id': 99, 'action': 'add', 'quantity': 1},
+        {'product_id': 1, 'action': 'steal', 'quantity': 1},
+    ]}, headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['applied'] == 2
+    assert data['failed'] == 3
+    assert [r['status'] for r in data['results']] == ['ok', 'ok', 'error', 'error', 'error']
+    assert data['results'][1]['stock'] == 7
+    assert 'Insufficient stock' in data['results'][2]['error']
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT stock FROM product WHERE id = 1').fetchone()[0] == 7
+        actions = [row[0] for row in db.execute('SELECT action FROM history ORDER BY id')]
+        assert actions == ['buy', 'sell', 'buy']
+
+def test_batch_stock_atomic(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.post('/stock/batch', json={'atomic': True, 'items': [
+        {'product_id': 1, 'action': 'remove', 'quantity': 4},
+        {'product_id': 1, 'action': 'remove', 'quantity': 7},
+    ]}, headers=headers)
+    assert response.status_code == 400
+    data = response.get_json()
+    assert data['applied'] == 0
+    assert [r['status'] for r in data['results']] == ['skipped', 'error']
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT stock FROM product WHERE id = 1').fetchone()[0] == 10
+        assert db.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 1
+
+def test_remove_stock_insufficient(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.patch('/stock/1/stock/remove', json={'stock': 11}, headers=headers)
+    assert response.status_code == 400
+    assert b'Insufficient stock. Available: 10, requested: 11' in response.data
+
+    response = client.patch('/stock/99/stock/remove', json={'stock': 1}, headers=headers)
+    assert response.status_code == 400
+    assert b'Product not found' in response.data
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT stock FROM product WHERE id = 1').fetchone()[0] == 10
+        assert db.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 1
+
+def test_inventory_summary(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    client.post('/stock/', json={'name': 'Widget', 'stock': 4, 'price': 2.5}, headers=headers)
+    client.patch('/stock/1/stock/remove', json={'stock': 3}, headers=headers)
+    client.put('/stock/2', json={'name': 'Widget', 'stock': 6, 'price': 3}, headers=headers)
+
+    response = client.get('/stock/summary', headers=headers)
+    assert response.status_code == 200
+    summary = response.get_json()
+    assert summary['product_count'] == 2
+    assert summary['units_on_hand'] == 7 + 6
+    assert summary['inventory_value'] == 7 * 100 + 6 * 3
+    assert summary['units_bought'] == 10 + 4
+    assert summary['buy_total'] == 10 * 100 + 4 * 2.5
+    assert summary['units_sold'] == 3
+    assert summary['sell_total'] == 300
+
+    client.delete('/stock/2', headers=headers)
+    assert client.get('/stock/summary', headers=headers).get_json()['product_count'] == 1
+
+def test_summary_rebuild_command(client, app, runner):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    expected = client.get('/stock/summary', headers=headers).get_json()
+
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE inventory_summary SET units_on_hand = 999')
+        db.commit()
+
+    result = runner.invoke(args=['summary', 'rebuild'])
+    assert 'Rebuilt summary for 1 owners' in result.output
+    rebuilt = client.get('/stock/summary', headers=headers).get_json()
+    assert rebuilt['units_on_hand'] == expected['units_on_hand'] == 10
+
+def test_history_rollup(client, app):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO history (product_id, product_name, user_id, price, quantity, action, created)"
+            " VALUES (1, 'Test Product', 1, 100, ?, ?, ?)",
+            [
+                (2, 'sell', '2026-03-02 09:00:00'),
+                (1, 'sell', '2026-03-02 17:30:00'),
+                (5, 'buy', '2026-03-04 12:00:00'),
+                (3, 'sell', '2026-03-09 08:00:00'),
+                (4, 'sell', '2026-04-01 10:00:00'),
+            ]
+        )
+        db.commit()
+
+    march = {'from': '2026-03-01', 'to': '2026-03-31'}
+    response = client.get('/stock/history/rollup', query_string=march, headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['bucket'] == 'day'
+    assert [row['period'] for row in data['rollup']] == ['2026-03-02', '2026-03-04', '2026-03-09']
+    assert data['rollup'][0]['units_sold'] == 3
+    assert data['rollup'][0]['sell_total'] == 300
+    assert data['rollup'][0]['transactions'] == 2
+
+    weeks = client.get('/stock/history/rollup', query_string={**march, 'bucket': 'week'}, headers=headers).get_json()
+    assert [(row['period'], row['units_sold'], row['units_bought']) for row in weeks['rollup']] == [
+        ('2026-03-02', 3, 5), ('2026-03-09', 3, 0)
+    ]
+
+    months = client.get('/stock/history/rollup', query_string={'bucket': 'month', 'from': '2026-03-01', 'to': '2026-04-30', 'product_id': 1},
+                        headers=headers).get_json()
+    assert [(row['period'], row['units_sold']) for row in months['rollup']] == [('2026-03-01', 6), ('2026-04-01', 4)]
+
+    # Live writes land in the current bucket straight away. The database may
+    # date them in UTC, so the bounds keep a day clear of the local date.
+    client.patch('/stock/1/stock/remove', json={'stock': 2}, headers=headers)
+    local_today = date.today()
+    after_sale = {'from': (local_today + timedelta(days=2)).isoformat()}
+    assert client.get('/stock/history/rollup', query_string=after_sale, headers=headers).get_json()['rollup'] == []
+    around_sale = {'from': (local_today - timedelta(days=1)).isoformat()}
+    rollup = client.get('/stock/history/rollup', query_string=around_sale, headers=headers).get_json()['rollup']
+    assert [row['units_sold'] for row in rollup] == [2]
+
+def test_history_rollup_invalid_args(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    for args in ({'bucket': 'year'}, {'from': 'yesterday'}, {'from': '2026-03-02', 'to': '2026-03-01'},
+                 {'product_id': 'abc'}):
+        response = client.get('/stock/history/rollup', query_string=args, headers=headers)
+        assert response.status_code == 400
+
+def test_product_reads_conditional(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/stock/', headers=headers)
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/stock/1', headers=headers).headers['ETag'] == etag
+
+    cached = client.get('/stock/', headers={**headers, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.data == b''
+    assert cached.headers['ETag'] == etag
+    assert client.get('/stock/1', headers={**headers, 'If-None-Match': etag}).status_code == 304
+
+    # Every kind of product write invalidates the tag
+    writes = [
+        lambda: client.patch('/stock/1/stock/add', json={'stock': 1}, headers=headers),
+        lambda: client.put('/stock/1', json={'name': 'Renamed', 'stock': 11, 'price': 100}, headers=headers),
+        lambda: client.post('/stock/', json={'name': 'Other', 'stock': 1, 'price': 1}, headers=headers),
+        lambda: client.post('/stock/batch', json={'items': [{'product_id': 1, 'action': 'remove', 'quantity': 1}]},
+                            headers=headers),
+        lambda: client.delete('/stock/2', headers=headers),
+    ]
+    for write in writes:
+        write()
+        response = client.get('/stock/', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        etag = response.headers['ETag']
+
+    # Errors are not tagged
+    assert 'ETag' not in client.get('/stock/999', headers=headers).headers
+
+def test_stock_events(client, app):
+    app.config['EVENTS_HEARTBEAT'] = 0.01
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    # A single-threaded worker would be tied up by the stream
+    response = client.get('/stock/events', headers=headers)
+    assert response.status_code == 503
+
+    response = client.get('/stock/events', headers=headers, buffered=False, environ_overrides=THREADED)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = response.iter_encoded()
+    assert next(chunks) == b'retry: 3000\n\n'
+
+    client.patch('/stock/1/stock/remove', json={'stock': 2}, headers=headers)
+    client.post('/stock/batch', json={'items': [
+        {'product_id': 1, 'action': 'add', 'quantity': 5},
+        {'product_id': 1, 'action': 'remove', 'quantity': 1},
+    ]}, headers=headers)
+    client.delete('/stock/1', headers=headers)
+
+    # The seeded product left the inventory version at 1
+    text = next(chunks).decode()
+    messages = [message.split('\n') for message in text.strip().split('\n\n')]
+    assert [lines[:2] for lines in messages] == [
+        ['id: 2', 'event: stock.removed'],
+        ['id: 3', 'event: stock.added'],
+        ['id: 4', 'event: product.deleted'],
+    ]
+    assert json.loads(messages[0][2][len('data: '):]) == {
+        'id': 1, 'name': 'Test Product', 'price': 100, 'stock': 8, 'quantity': 2
+    }
+    assert json.loads(messages[1][2][len('data: '):])['quantity'] == 4
+    assert next(chunks) == b': keep-alive\n\n'
+    response.close()
+
+def test_stock_events_resume(client, app):
+    app.config['EVENTS_HEARTBEAT'] = 0.01
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    client.patch('/stock/1/stock/add', json={'stock': 1}, headers=headers)
+    client.put('/stock/1', json={'name': 'Renamed', 'stock': 3, 'price': 100}, headers=headers)
+
+    def first_chunk(last_event_id):
+        response = client.get(
+            '/stock/events', headers={**headers, 'Last-Event-ID': last_event_id},
+            buffered=False, environ_overrides=THREADED
+        )
+        text = next(response.iter_encoded()).decode()
+        response.close()
+        return text
+
+    # Events after Last-Event-ID are replayed
+    text = first_chunk('2')
+    assert 'id: 2\n' not in text
+    assert 'id: 3\nevent: product.updated\n' in text
+    # Nothing missed
+    assert first_chunk('3') == 'retry: 3000\n\n'
+    # An id this worker cannot replay from asks the client to reload
+    assert 'id: 3\nevent: reset\ndata: {}' in first_chunk('99')
+
+    response = client.get('/stock/events', headers={**headers, 'Last-Event-ID': 'x'}, environ_overrides=THREADED)
+    assert response.status_code == 400
+
+def test_stock_events_subscriber_limit(client, app):
+    app.config['EVENTS_MAX_SUBSCRIBERS'] = 1
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    first = client.get('/stock/events', headers=headers, buffered=False, environ_overrides=THREADED)
+    next(first.iter_encoded())
+    response = client.get('/stock/events', headers=headers, environ_overrides=THREADED)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    first.close()
+
+    # The stream's thread is free again
+    response = client.get('/stock/events', headers=headers, buffered=False, environ_overrides=THREADED)
+    assert response.status_code == 200
+    response.close()
+
+def test_stock_changes(client):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    full = client.get('/stock/changes', headers=headers).get_json()
+    assert full['reset'] is True
+    assert [p['id'] for p in full['upserts']] == [1]
+    assert full['deletions'] == []
+
+    # Nothing changed since the token
+    same = client.get(f"/stock/changes?since={full['token']}", headers=headers).get_json()
+    assert same == {'reset': False, 'upserts': [], 'deletions': [], 'token': full['token']}
+
+    client.post('/stock/', json={'name': 'New Product', 'stock': 5, 'price': 50}, headers=headers)
+    client.patch('/stock/1/stock/add', json={'stock': 2}, headers=headers)
+    client.delete('/stock/2', headers=headers)
+
+    delta = client.get(f"/stock/changes?since={full['token']}", headers=headers).get_json()
+    assert delta['reset'] is False
+    assert [(p['id'], p['stock']) for p in delta['upserts']] == [(1, 12)]
+    assert delta['deletions'] == [2]
+    assert delta['token'] != full['token']
+
+    response = client.get('/stock/changes?since=bogus', headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid sync token'
+
+def test_prune_tombstones_command(client, runner):
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    since = client.get('/stock/changes', headers=headers).get_json()['token']
+    client.delete('/stock/1', headers=headers)
+
+    # Recent tombstones are kept
+    result = runner.invoke(args=['changes', 'prune'])
+    assert 'Removed 0 tombstones' in result.output
+    assert client.get(f'/stock/changes?since={since}', headers=headers).get_json()['deletions'] == [1]
+
+    result = runner.invoke(args=['changes', 'prune', '--days', '-1'])
+    assert 'Removed 1 tombstones' in result.output
+    # The token predates a pruned deletion, so the client resyncs in full
+    resync = client.get(f'/stock/changes?since={since}', headers=headers).get_json()
+    assert resync == {'reset': True, 'upserts': [], 'deletions': [], 'token': resync['token']}
+
+def test_group_commit_stock_changes(client, app):
+    app.config['GROUP_COMMIT'] = True
+    token = get_test_user_token(client)
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def remove_one(_):
+        return app.test_client().patch('/stock/1/stock/remove', json={'stock': 1}, headers=headers)
+
+    with ThreadPoolExecutor(max_workers=15) as pool:
+        responses = list(pool.map(remove_one, range(15)))
+
+    # Same answers as one transaction per request: 10 in stock, 5 refused
+    assert sorted(r.status_code for r in responses) == [200] * 10 + [400] * 5
+    assert all('Insufficient stock' in r.get_json()['error'] for r in responses if r.status_code == 400)
+    assert client.get('/stock/1', headers=headers).get_json()['stock'] == 0
+
+    response = client.post('/stock/', json={'name': 'New Product', 'stock': 5, 'price': 50}, headers=headers)
+    assert response.status_code == 201
+    response = client.patch('/stock/99/stock/add', json={'stock': 1}, headers=headers)
+    assert response.status_code == 400
+
+    with app.app_context():
+        sells = execute_query("SELECT COUNT(*) AS n FROM history WHERE action = 'sell'").fetchone()
+        assert sells['n'] == 10
+    stats = client.get('/stats').get_json()['group_commit']
+    assert stats['writes'] == 17
+    assert stats['groups'] <= stats['writes']
+
+def test_group_commit_rolls_back_failed_writes(app):
+    committer = GroupCommitter(app, window_ms=500, max_ops=3)
+
+    def insert(name, outcome):
+        execute_query(
+            'INSERT INTO product (name, stock, price, owner_id) VALUES (?, 1, 1, ?)', (name, g.user_id)
+        )
+        if outcome == 'raise':
+            raise RuntimeError('boom')
+        return outcome == 'keep', name
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [
+            pool.submit(committer.submit, 1, insert, name, name)
+            for name in ('keep', 'reject', 'raise')
+        ]
+        assert futures[0].result() == (True, 'keep')
+        assert futures[1].result() == (False, 'reject')
+        with pytest.raises(RuntimeError):
+            futures[2].result()
+
+    assert committer.stats()['groups'] == 1
+    with app.app_context():
+        names = [row['name'] for row in execute_query('SELECT name FROM product ORDER BY id').fetchall()]
+        assert names == ['Test Product', 'keep']
+
+def test_group_commit_with_one_pooled_connection(pg_app, monkeypatch):
+    # The request's own connection must be back in the pool before the writer needs one
+    monkeypatch.setitem(pg_app.config, 'GROUP_COMMIT', True)
+    monkeypatch.setitem(pg_app.config, 'DB_POOL_MAX', 1)
+    monkeypatch.setitem(pg_app.config, 'DB_POOL_TIMEOUT', 0.5)
+    shoptrack_db._pool.closeall()
+    shoptrack_db._pool = None
+
+    client = pg_app.test_client()
+    headers = {'Authorization': f'Bearer {get_test_user_token(client)}'}
+    response = client.patch('/stock/1/stock/remove', json={'stock': 1}, headers=headers)
+    assert response.status_code == 200
+    assert client.get('/stock/1', headers=headers).get_json()['stock'] == 9